@@ -56,6 +56,7 @@ from .core import browse_api  # noqa: F401
 from .core import template_api  # noqa: F401
 from .core import tag_api  # noqa: F401
 from .core import wildcard_api  # noqa: F401
+from .core import compile_api  # noqa: F401
 from .core import history_api  # noqa: F401
 from .core import model_api  # noqa: F401
 from .core import lora_catalog  # noqa: F401
@@ -6,9 +6,22 @@ that's three copies of the same ~30MB weights and three cold-start
 loads on boot. This module owns one shared instance behind a lock.
 
 Public API:
-    get() -> (model, tokenizer, device)
+    get() -> (model, tokenizer, device)   # backend per config.embed_backend
     get_load_error() -> str | None  # None means "not yet attempted or
                                     # currently in transient retry state"
+    embed(texts) -> tensor/ndarray [N, 384]  # length-bucketed, see embed()
+    embed_cached(texts) -> ndarray [N, 384]  # query LRU + micro-batcher
+    await embed_cached_async(texts)          # same, for coroutines
+    query_cache_stats() / batcher_stats() -> dict
+
+Query-side callers (the three searches, natlang pose matching) embed the
+same short strings — slot names, pose names, sub-intents — over and over
+within a request and across requests. `embed_cached` keeps a bounded LRU
+of text → normalized float32 vector so a repeat costs a dict lookup instead
+of a tokenize + forward pass. Misses from concurrent callers are
+coalesced into one forward pass by the micro-batcher (see BATCH_WINDOW_MS
+below). Index builds call `embed` directly: their thousands of one-off
+rows would only flush the cache.
 
 Behavior matches the pattern the call-sites already implemented locally:
 - ModuleNotFoundError caches a hard failure (won't retry without pip install)
@@ -20,6 +33,8 @@ from __future__ import annotations
 
 import logging
 import threading
+from collections import OrderedDict
+from pathlib import Path
 from typing import Any
 
 logger = logging.getLogger("promptchain.embed")
@@ -27,7 +42,29 @@ logger = logging.getLogger("promptchain.embed")
 MODEL_ID = "BAAI/bge-small-en-v1.5"
 EMBED_DIM = 384
 
+# Token caps. Index rows (wiki bodies) get the model's full 512; queries
+# are short by nature and a runaway paste shouldn't cost a 512-token pass.
+MAX_LENGTH = 512
+QUERY_MAX_LENGTH = 128
+# Texts tokenized (and length-sorted) together by embed(); bounds the
+# un-padded token lists held at once during a big index build.
+_SORT_WINDOW = 2048
+# Padded-token budget per batch, per row of batch_size (see _length_batches).
+_BATCH_TOKENS_PER_ROW = 128
+
+# Query-embedding LRU cap. An entry is ~1.6 KB (384 float32 + the key), so
+# 16 MiB holds ~10k distinct strings. 0 disables the cache.
+QUERY_CACHE_MAX_BYTES = 16 * 1024 * 1024
+_ENTRY_OVERHEAD = 200     # OrderedDict node + tensor object, roughly
+
 _lock = threading.RLock()
+# The HF fast tokenizer keeps its truncation/padding settings in shared Rust
+# state and rewrites them whenever a call's settings differ from the last
+# one's. Index builds (MAX_LENGTH) and the query batcher (QUERY_MAX_LENGTH)
+# call it from different threads, so every tokenizer call holds this lock:
+# unserialized, two calls overlap into "RuntimeError: Already borrowed" or
+# one runs under the other's max_length.
+_tokenizer_lock = threading.Lock()
 _state: dict[str, Any] = {
     "ready": False,
     "model": None,
@@ -41,6 +78,16 @@ def get_load_error() -> str | None:
     return _state["load_error"]
 
 
+def _configured_backend() -> str:
+    """config.embed_backend(), or "torch" when config can't be read (no
+    ComfyUI around, e.g. the standalone scripts)."""
+    try:
+        from . import config
+        return config.embed_backend()
+    except Exception:
+        return "torch"
+
+
 def get() -> tuple[Any, Any, str] | None:
     """Load (or return cached) shared encoder. Returns None on failure;
     caller is expected to degrade gracefully (search returns empty list
@@ -50,9 +97,11 @@ def get() -> tuple[Any, Any, str] | None:
             return _state["model"], _state["tokenizer"], _state["device"]
         if _state["load_error"]:
             return None
+        backend = _configured_backend()
         try:
-            import torch  # noqa: F401  (only checking availability here)
-            from transformers import AutoTokenizer, AutoModel
+            if backend == "torch":
+                import torch  # noqa: F401  (only checking availability here)
+            from transformers import AutoTokenizer, AutoModel  # noqa: F401
         except ModuleNotFoundError as e:
             _state["load_error"] = f"missing dependency: {e}"
             logger.warning(
@@ -84,18 +133,11 @@ def get() -> tuple[Any, Any, str] | None:
             )
             return None
         try:
-            # bge-small is ~30MB on GPU — negligible against image-gen VRAM
-            # budgets, and a 5090 rebuilds the 14k-row tag index in ~30s
-            # vs 5-10 min on CPU. Fall back to CPU when CUDA isn't there.
-            import torch
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
-            model = AutoModel.from_pretrained(MODEL_ID).to(device).eval()
+            model, tokenizer, device = load_backend(backend)
             _state["tokenizer"] = tokenizer
             _state["model"] = model
             _state["device"] = device
             _state["ready"] = True
-            logger.info("embed_model: loaded %s on %s", MODEL_ID, device)
             return model, tokenizer, device
         except OSError as e:
             # HF download / disk error — transient (network/lock). Retry.
@@ -110,9 +152,172 @@ def get() -> tuple[Any, Any, str] | None:
             return None
 
 
-def embed(texts: list[str], batch_size: int = 32):
-    """L2-normalized CLS-pooled embeddings for `texts`. Returns torch
-    tensor [N, 384]. Returns None if the model isn't loaded.
+# ── backends ─────────────────────────────────────────────────────
+#
+# "torch" runs the transformers model (CUDA when available). "onnx" and
+# "onnx-int8" run an exported graph of the same model on ONNX Runtime's
+# CPU provider — for CPU-only hosts, where torch eager mode is the slow
+# part of both index rebuilds and queries. The graph is exported from the
+# torch model on first use (CLS head only: [batch, seq] ids → [batch, 384])
+# into ONNX_DIR; "onnx-int8" additionally runs onnxruntime's dynamic
+# quantization over it. Same tokenizer either way. Any failure (no
+# onnxruntime, export error) logs and falls back to torch.
+#
+# Only the one-time export needs torch: with the graph already in
+# ONNX_DIR the ONNX backends load and embed on transformers' tokenizer,
+# onnxruntime and numpy alone, so a CPU host can drop torch after the
+# first run (or copy the exported graph over from another machine).
+# scripts/test_embed_onnx_parity.py / bench_embed_backends.py.
+
+ONNX_DIR = Path(__file__).resolve().parent.parent / "cache" / "embed_onnx"
+_ONNX_OPSET = 17
+
+
+class _OnnxEncoder:
+    """ONNX Runtime session over the exported CLS graph."""
+
+    def __init__(self, session, variant: str):
+        self.session = session
+        self.variant = variant
+        self.input_names = [i.name for i in session.get_inputs()]
+
+    def cls(self, batch):
+        """Un-normalized CLS vectors, float32 numpy [batch, 384]."""
+        import numpy as np
+
+        feed = {name: np.asarray(batch[name], dtype=np.int64) for name in self.input_names}
+        return self.session.run(None, feed)[0]
+
+
+def _onnx_path(variant: str) -> Path:
+    stem = MODEL_ID.split("/")[-1]
+    return ONNX_DIR / (f"{stem}.int8.onnx" if variant == "onnx-int8" else f"{stem}.onnx")
+
+
+def _export_onnx(tokenizer, variant: str) -> Path:
+    """Export (and for onnx-int8, quantize) the graph if it isn't on disk.
+    Each file is written under a temp name and renamed into place."""
+    fp32 = _onnx_path("onnx")
+    if not fp32.exists():
+        import torch
+        from transformers import AutoModel
+
+        class ClsHead(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids):
+                out = self.model(input_ids=input_ids, attention_mask=attention_mask,
+                                 token_type_ids=token_type_ids)
+                return out.last_hidden_state[:, 0]
+
+        logger.info("embed_model: exporting %s to ONNX (one-time)", MODEL_ID)
+        head = ClsHead(AutoModel.from_pretrained(MODEL_ID).eval())
+        sample = tokenizer(["a short sample", "and a slightly longer sample text"],
+                           padding=True, return_tensors="pt")
+        names = ["input_ids", "attention_mask", "token_type_ids"]
+        ONNX_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = fp32.with_name(fp32.stem + ".tmp.onnx")
+        with torch.no_grad():
+            torch.onnx.export(
+                head, tuple(sample[n] for n in names), str(tmp),
+                input_names=names, output_names=["cls"],
+                dynamic_axes={**{n: {0: "batch", 1: "seq"} for n in names},
+                              "cls": {0: "batch"}},
+                opset_version=_ONNX_OPSET,
+            )
+        tmp.replace(fp32)
+    if variant != "onnx-int8":
+        return fp32
+    int8 = _onnx_path("onnx-int8")
+    if not int8.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        logger.info("embed_model: quantizing the ONNX graph to int8 (one-time)")
+        tmp = int8.with_name(int8.stem + ".tmp.onnx")
+        quantize_dynamic(str(fp32), str(tmp), weight_type=QuantType.QInt8)
+        tmp.replace(int8)
+    return int8
+
+
+def _load_onnx(tokenizer, variant: str) -> _OnnxEncoder | None:
+    try:
+        import onnxruntime as ort
+    except ImportError:
+        logger.warning("embed_model: %s backend needs onnxruntime — using torch", variant)
+        return None
+    try:
+        path = _export_onnx(tokenizer, variant)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        session = ort.InferenceSession(str(path), sess_options=opts,
+                                       providers=["CPUExecutionProvider"])
+    except Exception:
+        logger.warning("embed_model: %s backend failed to load — using torch", variant,
+                       exc_info=True)
+        return None
+    return _OnnxEncoder(session, variant)
+
+
+def load_backend(name: str) -> tuple[Any, Any, str]:
+    """(model, tokenizer, device) for backend `name` ("torch", "onnx",
+    "onnx-int8"), independent of the shared instance — get() uses it for
+    the configured backend; the parity test and benchmark load several."""
+    from transformers import AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_ID)
+    if name in ("onnx", "onnx-int8"):
+        encoder = _load_onnx(tokenizer, name)
+        if encoder is not None:
+            logger.info("embed_model: loaded %s on onnxruntime (%s, cpu)", MODEL_ID, name)
+            return encoder, tokenizer, "cpu"
+    # bge-small is ~30MB on GPU — negligible against image-gen VRAM
+    # budgets, and a 5090 rebuilds the 14k-row tag index in ~30s
+    # vs 5-10 min on CPU. Fall back to CPU when CUDA isn't there.
+    import torch
+    from transformers import AutoModel
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model = AutoModel.from_pretrained(MODEL_ID).to(device).eval()
+    logger.info("embed_model: loaded %s on %s", MODEL_ID, device)
+    return model, tokenizer, device
+
+
+def _length_batches(lengths: list[int], batch_size: int) -> list[list[int]]:
+    """Positions grouped into batches of similar token length (shortest
+    first; stable, so equal lengths keep input order). A batch closes at
+    `batch_size` texts or once the next text would push its padded size
+    past batch_size * _BATCH_TOKENS_PER_ROW, so the long tail runs in
+    smaller batches instead of padding short neighbours out to 512."""
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    budget = batch_size * _BATCH_TOKENS_PER_ROW
+    batches: list[list[int]] = []
+    cur: list[int] = []
+    for i in order:
+        if cur and (len(cur) >= batch_size or (len(cur) + 1) * lengths[i] > budget):
+            batches.append(cur)
+            cur = []
+        cur.append(i)
+    if cur:
+        batches.append(cur)
+    return batches
+
+
+def embed(texts: list[str], batch_size: int = 32, max_length: int = MAX_LENGTH,
+          report: dict | None = None, on_progress=None):
+    """L2-normalized CLS-pooled embeddings for `texts`, [N, 384] in input
+    order: a torch tensor on the torch backend, a float32 numpy array on
+    the ONNX ones (`_as_numpy` takes either). Returns None if the model
+    isn't loaded.
+
+    Texts are tokenized once per _SORT_WINDOW without padding, grouped by
+    token length (`_length_batches`), and each batch is padded only to its
+    own longest sequence — a wiki row no longer pads 63 three-word tag
+    names out to its length. `max_length` caps tokens per text (queries
+    use QUERY_MAX_LENGTH). `report`, when given, is filled with texts /
+    tokens / padded_tokens / seconds (see `describe_report`);
+    `on_progress(report)` runs after each window.
 
     Note: bge-small uses CLS pooling (per the model card). E5 family
     requires mean pooling — if we ever switch models, callers may need
@@ -121,20 +326,277 @@ def embed(texts: list[str], batch_size: int = 32):
     loaded = get()
     if loaded is None:
         return None
+    return _embed_with(loaded, texts, batch_size, max_length, report, on_progress)
+
+
+def _embed_with(loaded: tuple[Any, Any, str], texts: list[str], batch_size: int = 32,
+                max_length: int = MAX_LENGTH, report: dict | None = None,
+                on_progress=None):
+    """`embed` on an explicit (model, tokenizer, device) from load_backend.
+    The ONNX backends compute and return numpy without importing torch."""
     model, tokenizer, device = loaded
 
-    import torch
-    import torch.nn.functional as F
-
-    out_chunks = []
-    for i in range(0, len(texts), batch_size):
-        chunk = texts[i:i + batch_size]
-        enc = tokenizer(
-            chunk, padding=True, truncation=True, max_length=512,
-            return_tensors="pt",
-        ).to(device)
-        with torch.no_grad():
-            out = model(**enc)
-        cls = out.last_hidden_state[:, 0]
-        out_chunks.append(F.normalize(cls, p=2, dim=1))
-    return torch.cat(out_chunks, dim=0)
+    import time
+
+    onnx = isinstance(model, _OnnxEncoder)
+    t0 = time.perf_counter()
+    if onnx:
+        import numpy as np
+
+        out = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+    else:
+        import torch
+        import torch.nn.functional as F
+
+        out = torch.empty((len(texts), EMBED_DIM), device=device)
+    stats = report if report is not None else {}
+    stats.update(texts=0, tokens=0, padded_tokens=0, seconds=0.0)
+    for w in range(0, len(texts), _SORT_WINDOW):
+        window = texts[w:w + _SORT_WINDOW]
+        with _tokenizer_lock:
+            enc = tokenizer(window, truncation=True, max_length=max_length)
+        lengths = [len(ids) for ids in enc["input_ids"]]
+        for sel in _length_batches(lengths, batch_size):
+            # one pad per length bucket: each is its own tokenizer call
+            with _tokenizer_lock:
+                batch = tokenizer.pad({k: [enc[k][i] for i in sel] for k in enc.keys()},
+                                      padding=True, return_tensors="np" if onnx else "pt")
+            rows = [w + i for i in sel]
+            if onnx:
+                cls = model.cls(batch)
+                # F.normalize's eps, so both backends agree on degenerate rows.
+                norms = np.linalg.norm(cls, axis=1, keepdims=True)
+                out[rows] = cls / np.maximum(norms, 1e-12)
+            else:
+                with torch.no_grad():
+                    cls = model(**batch.to(device)).last_hidden_state[:, 0]
+                out[torch.tensor(rows, device=device)] = F.normalize(cls, p=2, dim=1)
+            stats["tokens"] += sum(lengths[i] for i in sel)
+            stats["padded_tokens"] += len(sel) * max(lengths[i] for i in sel)
+        stats["texts"] += len(window)
+        stats["seconds"] = time.perf_counter() - t0
+        if on_progress is not None:
+            on_progress(stats)
+    return out
+
+
+def describe_report(report: dict) -> str:
+    """'N texts, X tokens/s, padding Y%' for an `embed` report."""
+    secs = report.get("seconds") or 0.0
+    padded = report.get("padded_tokens") or 0
+    rate = report.get("tokens", 0) / secs if secs else 0.0
+    pad = (padded - report.get("tokens", 0)) / padded if padded else 0.0
+    return f"{report.get('texts', 0)} texts, {rate:,.0f} tokens/s, padding {pad:.0%}"
+
+
+_cache_lock = threading.Lock()
+_query_cache: "OrderedDict[str, Any]" = OrderedDict()
+_cache_counts = {"hits": 0, "misses": 0, "evictions": 0, "bytes": 0}
+
+
+def _entry_bytes(text: str, vec) -> int:
+    return int(vec.nbytes) + len(text.encode("utf-8")) + _ENTRY_OVERHEAD
+
+
+def _as_numpy(out):
+    import numpy as np
+
+    if hasattr(out, "cpu"):
+        out = out.float().cpu().numpy()
+    return np.asarray(out, dtype=np.float32)
+
+
+def _cache_lookup(texts: list[str]) -> tuple[list, dict[str, list[int]]]:
+    """(vectors with None for misses, {missing text: positions})."""
+    vecs: list[Any] = [None] * len(texts)
+    missing: dict[str, list[int]] = {}
+    if QUERY_CACHE_MAX_BYTES <= 0:
+        for i, text in enumerate(texts):
+            missing.setdefault(text, []).append(i)
+        return vecs, missing
+    with _cache_lock:
+        for i, text in enumerate(texts):
+            vec = _query_cache.get(text)
+            if vec is None:
+                missing.setdefault(text, []).append(i)
+                continue
+            _query_cache.move_to_end(text)
+            _cache_counts["hits"] += 1
+            vecs[i] = vec
+        _cache_counts["misses"] += len(missing)
+    return vecs, missing
+
+
+def _cache_fill(vecs: list, missing: dict[str, list[int]], fresh):
+    """Slot `fresh` (rows in `missing` order) into `vecs`, remember them,
+    evict down to the cap, and stack the result."""
+    import numpy as np
+
+    with _cache_lock:
+        for row, (text, positions) in enumerate(missing.items()):
+            # copy: a row view would pin the whole batch array.
+            vec = fresh[row].copy()
+            for i in positions:
+                vecs[i] = vec
+            if QUERY_CACHE_MAX_BYTES <= 0:
+                continue
+            if text in _query_cache:
+                _cache_counts["bytes"] -= _entry_bytes(text, _query_cache[text])
+            _cache_counts["bytes"] += _entry_bytes(text, vec)
+            _query_cache[text] = vec
+            _query_cache.move_to_end(text)
+        while _cache_counts["bytes"] > QUERY_CACHE_MAX_BYTES and _query_cache:
+            old_text, old_vec = _query_cache.popitem(last=False)
+            _cache_counts["bytes"] -= _entry_bytes(old_text, old_vec)
+            _cache_counts["evictions"] += 1
+    return np.stack(vecs)
+
+
+def embed_cached(texts: list[str]):
+    """`embed` through the query LRU, as a float32 numpy array [N, 384]
+    (what the numpy-scored indexes want). Texts seen before skip the
+    model; the misses go to the micro-batcher as one request, where they
+    share a forward pass with other callers' concurrent misses. Returns
+    None if the model isn't loaded."""
+    import numpy as np
+
+    if get() is None:
+        return None
+    if not texts:
+        return np.zeros((0, EMBED_DIM), dtype=np.float32)
+    vecs, missing = _cache_lookup(texts)
+    if not missing:
+        return np.stack(vecs)
+    fresh = _batcher.submit(list(missing)).result()
+    return None if fresh is None else _cache_fill(vecs, missing, fresh)
+
+
+async def embed_cached_async(texts: list[str]):
+    """`embed_cached` for coroutines: awaits the batcher's future instead
+    of blocking the event loop on the forward pass."""
+    import asyncio
+
+    import numpy as np
+
+    if get() is None:
+        return None
+    if not texts:
+        return np.zeros((0, EMBED_DIM), dtype=np.float32)
+    vecs, missing = _cache_lookup(texts)
+    if not missing:
+        return np.stack(vecs)
+    fresh = await asyncio.wrap_future(_batcher.submit(list(missing)))
+    return None if fresh is None else _cache_fill(vecs, missing, fresh)
+
+
+# ── micro-batching ───────────────────────────────────────────────
+#
+# Concurrent searches (agent turns, patch calls, autocomplete) each embed
+# one or two query strings, and each used to pay a full tokenize + forward
+# dispatch. The batcher's worker thread takes the first queued request,
+# keeps collecting for BATCH_WINDOW_MS (or until BATCH_MAX_TEXTS texts),
+# runs one `embed` over the distinct texts and resolves every caller's
+# future with its rows. A lone caller pays at most the window; under load
+# requests that queue while a forward pass runs go out together in the
+# next one. BATCH_WINDOW_MS = 0 skips the wait and only coalesces what is
+# already queued.
+
+BATCH_WINDOW_MS = 2.0
+BATCH_MAX_TEXTS = 64
+
+
+class _EmbedBatcher:
+    def __init__(self):
+        import queue
+
+        self._queue: "queue.Queue[tuple[list[str], Any]]" = queue.Queue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._counts = {"batches": 0, "requests": 0, "texts": 0, "max_requests": 0}
+
+    def submit(self, texts: list[str]):
+        """Future resolving to float32 [len(texts), 384] (or None when the
+        model isn't loaded)."""
+        from concurrent.futures import Future
+
+        future: Future = Future()
+        self._queue.put((texts, future))
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(
+                        target=self._run, name="promptchain-embed-batcher", daemon=True)
+                    self._thread.start()
+        return future
+
+    def _collect(self) -> list:
+        import queue
+        import time
+
+        batch = [self._queue.get()]
+        count = len(batch[0][0])
+        deadline = time.perf_counter() + max(BATCH_WINDOW_MS, 0.0) / 1000.0
+        while count < BATCH_MAX_TEXTS:
+            timeout = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(item)
+            count += len(item[0])
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            unique = list(dict.fromkeys(t for texts, _ in batch for t in texts))
+            try:
+                out = embed(unique, batch_size=BATCH_MAX_TEXTS, max_length=QUERY_MAX_LENGTH)
+                rows = None if out is None else _as_numpy(out)
+            except BaseException as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            with self._stats_lock:
+                self._counts["batches"] += 1
+                self._counts["requests"] += len(batch)
+                self._counts["texts"] += len(unique)
+                self._counts["max_requests"] = max(self._counts["max_requests"], len(batch))
+            if rows is None:
+                for _, future in batch:
+                    future.set_result(None)
+                continue
+            where = {t: i for i, t in enumerate(unique)}
+            for texts, future in batch:
+                future.set_result(rows[[where[t] for t in texts]])
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            c = dict(self._counts)
+        c["requests_per_batch"] = round(c["requests"] / c["batches"], 2) if c["batches"] else 0.0
+        c["window_ms"] = BATCH_WINDOW_MS
+        c["max_texts"] = BATCH_MAX_TEXTS
+        return c
+
+
+_batcher = _EmbedBatcher()
+
+
+def batcher_stats() -> dict:
+    return _batcher.stats()
+
+
+def query_cache_stats() -> dict:
+    with _cache_lock:
+        lookups = _cache_counts["hits"] + _cache_counts["misses"]
+        return {**_cache_counts, "entries": len(_query_cache),
+                "max_bytes": QUERY_CACHE_MAX_BYTES,
+                "hit_rate": round(_cache_counts["hits"] / lookups, 4) if lookups else 0.0}
+
+
+def clear_query_cache() -> None:
+    with _cache_lock:
+        _query_cache.clear()
+        for k in _cache_counts:
+            _cache_counts[k] = 0
@@ -31,6 +31,8 @@ import server
 
 from .api_utils import atomic_write_json, error_response, parse_json
 from . import model_settings
+from .db_generation import FingerprintGate, tag_builder_generation
+from .phrase_matcher import PhraseMatcher, VersionedBuild, unicode_word_char
 from .shared import send_ws
 from .tags import get_store as get_tag_store
 
@@ -502,6 +504,20 @@ async def _api_setup_status(request):
     })
 
 
+@routes.get("/promptchain/ai/search-stats")
+async def _api_search_stats(request):
+    """Per-phase overhead of the embedding searches (freshness check /
+    query embed / scoring / hydration, mean + last in ms), how often the
+    DB fingerprint actually had to be recomputed, the query-embedding
+    cache's hit rate and size, and how well the embed micro-batcher is
+    coalescing concurrent queries."""
+    from . import _embed_model, bucket_search, modifier_search, tag_search  # noqa: F401  (register stats)
+    from .db_generation import all_search_stats
+    return web.json_response({**all_search_stats(),
+                              "embed_query_cache": _embed_model.query_cache_stats(),
+                              "embed_batcher": _embed_model.batcher_stats()})
+
+
 @routes.post("/promptchain/ai/auto-configure")
 async def _api_auto_configure(request):
     """First-run default: if the user hasn't configured a provider yet and
@@ -5134,15 +5150,12 @@ def _strip_articles_from_phrasal(token: str) -> str:
 
 # ── DB-driven modifier detection ──────────────────────────────────
 # Loaded from slot_modifiers table — DB-driven so adding a new modifier
-# (e.g. a fresh slang phrasing) is an INSERT, not a code change.
-
-_SLOT_MODIFIERS_CACHE: list[dict] | None = None
+# (e.g. a fresh slang phrasing) is an INSERT, not a code change — and
+# picked up without a restart: the list and its alias automaton reload
+# when the table's signature moves.
 
 
-def _load_slot_modifiers() -> list[dict]:
-    global _SLOT_MODIFIERS_CACHE
-    if _SLOT_MODIFIERS_CACHE is not None:
-        return _SLOT_MODIFIERS_CACHE
+def _read_slot_modifiers() -> list[dict]:
     try:
         from .tag_builder import get_db
         db = get_db()
@@ -5170,11 +5183,50 @@ def _load_slot_modifiers() -> list[dict]:
                 "implies_outfit_tag": implies or None,
                 "definition": definition,
             })
-        _SLOT_MODIFIERS_CACHE = out
+        return out
     except Exception:
         logger.warning("could not load slot_modifiers — using empty list", exc_info=True)
-        _SLOT_MODIFIERS_CACHE = []
-    return _SLOT_MODIFIERS_CACHE
+        return []
+
+
+def _slot_modifiers_signature() -> tuple | None:
+    """Moves when slot_modifiers rows are added, removed or edited."""
+    try:
+        from .tag_builder import get_db
+        r = get_db().execute(
+            "SELECT COUNT(*), COALESCE(MAX(rowid), 0), "
+            "       COALESCE(SUM(LENGTH(canonical_tag) + LENGTH(COALESCE(aliases, ''))"
+            "                    + COALESCE(sort_order, 0)), 0) "
+            "FROM slot_modifiers"
+        ).fetchone()
+        return tuple(r)
+    except Exception:
+        return None
+
+
+def _build_slot_modifiers() -> tuple[list[dict], PhraseMatcher, list[tuple[int, int]]]:
+    """(modifiers, matcher over every alias, phrase id → (modifier index,
+    alias index))."""
+    mods = _read_slot_modifiers()
+    phrases: list[str] = []
+    owners: list[tuple[int, int]] = []
+    for mi, mod in enumerate(mods):
+        for ai, alias in enumerate(mod["aliases"]):
+            phrases.append(alias)
+            owners.append((mi, ai))
+    return mods, PhraseMatcher(phrases, word_char=unicode_word_char), owners
+
+
+# Reloaded (and the alias automaton rebuilt) when the slot_modifiers
+# signature moves; the signature is only re-queried after a DB write.
+_slot_modifiers = VersionedBuild(
+    FingerprintGate(tag_builder_generation(), _slot_modifiers_signature).get,
+    _build_slot_modifiers,
+)
+
+
+def _load_slot_modifiers() -> list[dict]:
+    return _slot_modifiers.get()[0]
 
 
 # ── Danbooru tag-group data ────────────────────────────────────────
@@ -5240,15 +5292,19 @@ def _detect_modifiers_in_text(text: str) -> list[dict]:
     to drop the concept."""
     if not text:
         return []
+    mods, matcher, owners = _slot_modifiers.get()
+    # First occurrence of each alias (what re.search would have found),
+    # from one automaton pass over the text.
+    first: dict[tuple[int, int], int] = {}
+    for hit in matcher.scan(text):
+        first.setdefault(owners[hit.phrase_id], hit.start)
     matched: dict[str, dict] = {}
-    for mod in _load_slot_modifiers():
-        for alias in mod["aliases"]:
-            if not alias:
-                continue
-            m = re.search(r"(?<!\w)" + re.escape(alias) + r"(?!\w)", text, re.IGNORECASE)
-            if not m:
+    for mi, mod in enumerate(mods):
+        for ai, alias in enumerate(mod["aliases"]):
+            start = first.get((mi, ai))
+            if start is None:
                 continue
-            if _is_negated_match(text, m.start()):
+            if _is_negated_match(text, start):
                 continue
             if mod["canonical_tag"] not in matched:
                 matched[mod["canonical_tag"]] = {
@@ -9,8 +9,15 @@ synonym/paraphrase gaps; embeddings can.
 
 Index shape: every row of pose_items + nsfw_action_items + action_items +
 expression_items + scene_items gets a 384-dim embedding from
-BAAI/bge-small-en-v1.5. Stored as a single torch tensor in memory; cosine
-similarity is one matmul.
+BAAI/bge-small-en-v1.5. Stored as one `EmbeddingIndex` matrix (at the
+`embed_index_dtype` config precision); cosine similarity is one matmul.
+
+The index is persisted under `<repo>/cache/bucket_search/` in tag_search's
+on-disk format (`embed_index.sync_index`). A restart with an unchanged DB
+maps the cache instead of re-embedding every bucket row and prop bundle;
+a changed DB re-embeds only rows whose text changed. The cache carries a
+digest of every row and text, so edits the cheap (MAX(rowid), COUNT(*))
+signature below can't see still invalidate it.
 
 Hot-reload: every search() call cheaply checks (bucket, MAX(rowid),
 COUNT(*)) per indexed table. If anything moved, the index rebuilds.
@@ -23,6 +30,7 @@ import logging
 import math
 import re
 import threading
+from pathlib import Path
 from typing import Any
 
 
@@ -262,13 +270,22 @@ INDEXED_BUCKETS = (
 
 # Embedding model is loaded once and shared by bucket_search,
 # modifier_search, and tag_search. See core/_embed_model.py.
-from . import _embed_model
+from . import _embed_model, topk
+from . import config as global_config
+from .db_generation import FingerprintGate, SearchStats, tag_builder_generation
+from .embed_index import sync_index
+
+CACHE_DIR = Path(__file__).resolve().parent.parent / "cache" / "bucket_search"
+# Bump when the row dicts or the embedded text change shape — a mismatch
+# discards the cache.
+SCHEMA_VERSION = 1
 
 _lock = threading.RLock()
 _state: dict[str, Any] = {
-    "embeddings": None,      # torch.Tensor [N, 384]
-    "rows": [],              # list[dict] aligned with embeddings
+    "index": None,           # EmbeddingIndex [N, 384]
+    "rows": [],              # list[dict] aligned with the index rows
     "fingerprint": None,     # tuple of (bucket, max_rowid, count) — change → rebuild
+    "bucket_masks": {},      # buckets filter tuple → bool array [N]
 }
 
 
@@ -277,11 +294,6 @@ def _ensure_model_loaded() -> bool:
     return _embed_model.get() is not None
 
 
-def _embed(texts: list[str]):
-    """Return L2-normalized CLS embeddings for `texts` as a torch.Tensor."""
-    return _embed_model.embed(texts, batch_size=64)
-
-
 def _to_underscored_bundle(base_tags: str) -> str:
     """Convert space-form tag tokens in a curated bundle to Danbooru-
     canonical underscored form, preserving weighted-tag syntax. Bucket
@@ -349,6 +361,18 @@ def _fingerprint() -> tuple:
     return tuple(sig)
 
 
+# The seven aggregate queries above only re-run once the DB's write
+# generation moves (db_generation.py); a search otherwise compares a token.
+_fp_gate = FingerprintGate(tag_builder_generation(), _fingerprint)
+_stats = SearchStats("bucket_search", extra=lambda: {"fingerprint": _fp_gate.stats()})
+
+
+def search_stats() -> dict:
+    """Mean / last per-phase search overhead (ms) across search() and
+    search_for_apply(), plus fingerprint gate counts."""
+    return _stats.snapshot()
+
+
 def _build_prop_bundles(db) -> list[tuple[dict, str]]:
     """Build prop bundles from the tag-builder props + prop_actions
     tables. Each prop becomes one bundle on its own (so 'cammy with a
@@ -432,9 +456,9 @@ def _build_prop_bundles(db) -> list[tuple[dict, str]]:
 
 
 def _rebuild_index() -> None:
-    """Read every indexed bucket, embed every row, store as one tensor.
-    Includes the curated *_items buckets plus props and prop+action
-    virtual bundles."""
+    """Read every indexed bucket and sync the index to it: the disk cache
+    when it matches, else embed just the new/changed rows. Includes the
+    curated *_items buckets plus props and prop+action virtual bundles."""
     from .tag_builder import get_db
     if not _ensure_model_loaded():
         return
@@ -475,32 +499,46 @@ def _rebuild_index() -> None:
         else:
             action_count += 1
     if not rows:
-        _state["embeddings"] = None
+        _state["index"] = None
         _state["rows"] = []
-        _state["fingerprint"] = _fingerprint()
+        _state["fingerprint"] = _fp_gate.get()
+        return
+
+    def embed(positions: list[int]):
+        # embed batches internally (64 rows), so peak memory stays bounded.
+        report: dict = {}
+        out = _embed_model.embed([texts[i] for i in positions], batch_size=64, report=report)
+        if out is None:
+            raise RuntimeError("embed model not loaded")
+        logger.info("bucket_search: embed pass: %s", _embed_model.describe_report(report))
+        return _embed_model._as_numpy(out)
+
+    manifest = {"model_id": _embed_model.MODEL_ID, "embed_dim": _embed_model.EMBED_DIM,
+                "schema_version": SCHEMA_VERSION}
+    try:
+        index, embedded = sync_index(CACHE_DIR, rows, texts, manifest,
+                                     _embed_model.EMBED_DIM, embed,
+                                     dtype=global_config.embed_index_dtype())
+    except RuntimeError:
+        logger.warning("bucket_search: embed() returned None — model not loaded")
         return
-    # Batch to keep peak memory bounded; bge-small is light, but a 5k row
-    # batch on CPU still allocates a chunk of RAM.
-    import torch
-    batch_size = 64
-    all_emb = []
-    for i in range(0, len(texts), batch_size):
-        chunk = texts[i:i + batch_size]
-        all_emb.append(_embed(chunk))
-    embeddings = torch.cat(all_emb, dim=0)
-    _state["embeddings"] = embeddings
+    _state["index"] = index
     _state["rows"] = rows
-    _state["fingerprint"] = _fingerprint()
+    _state["bucket_masks"] = {}
+    _state["fingerprint"] = _fp_gate.get()
     logger.info(
-        "bucket_search: indexed %d rows (%d buckets + %d props + %d prop_actions)",
+        "bucket_search: indexed %d rows (%d buckets + %d props + %d prop_actions; "
+        "%d embedded, %d from cache)",
         len(rows), len(INDEXED_BUCKETS), prop_count, action_count,
+        embedded, len(rows) - embedded,
     )
 
 
 def _ensure_index_fresh() -> None:
-    """Rebuild if the tag-builder DB has shifted since last index. Cheap
-    metadata query first; rebuild only if shape changed."""
-    if _state["fingerprint"] == _fingerprint() and _state["embeddings"] is not None:
+    """Rebuild if the tag-builder DB has shifted since last index. Write-
+    generation check first, the metadata query only when it moved; rebuild
+    only if shape changed."""
+    if _state["fingerprint"] == _fp_gate.get() and _state["index"] is not None:
         return
     _rebuild_index()
 
@@ -534,99 +572,110 @@ def search(user_text: str, top_k: int = 30) -> list[dict]:
     user_text = (user_text or "").strip()
     if not user_text:
         return []
+    if not _ensure_model_loaded():
+        return []
+    run = _stats.start()
+    # Lock only for the freshness check: a rebuild swaps in new index/rows
+    # objects, so the snapshot stays valid, and the query embed outside
+    # the lock can batch with other concurrent searches.
     with _lock:
-        if not _ensure_model_loaded():
-            return []
         _ensure_index_fresh()
-        embeddings = _state["embeddings"]
+        index = _state["index"]
         rows = _state["rows"]
-        if embeddings is None or not rows:
-            return []
-        import torch
-        # Expand presentation verbs (pointing/showing/displaying/etc.)
-        # and embed all variants. Take max cosine per bundle so we keep
-        # the best literal-word match AND the best synonym-substituted
-        # match — neither path suffers when the user phrases their
-        # intent with a verb the bundle didn't use.
-        variants = _expand_presentation_verbs(user_text)
-        q = _embed(variants)  # [k, dim], one row per variant
-        # Cosine == dot since both sides are L2-normalized.
-        # scores_per_variant: [N, k]; we take max over k.
-        scores_per_variant = embeddings @ q.T  # [N, k]
-        scores = scores_per_variant.max(dim=1).values  # [N]
-        # Literal-word vs synonym alignment: when expansion fired (i.e.
-        # the user used a presentation verb), bundles whose original-
-        # query cosine is meaningfully HIGHER than any variant's cosine
-        # are aligned with literal pointing (Pointing at Viewer for
-        # 'pointing X at viewer'). In presentation context, the user's
-        # likely intent is the synonym/presenting interpretation, so
-        # demote those to fall out of top-K. Threshold (>0.02 stronger
-        # on original than variants) avoids false positives where the
-        # cosines are roughly tied.
-        if len(variants) > 1:
-            orig = scores_per_variant[:, 0]  # [N] cosine to original
-            variant_max = scores_per_variant[:, 1:].max(dim=1).values  # [N]
-            literal_aligned = (orig - variant_max) > 0.02
-            scores = scores + literal_aligned.float() * (-0.10)
-        # Pull a wider net for the cosine cut, then rerank by adjusted
-        # score (cosine + richness bonus). A bundle like
-        # "Presenting Feet → (legs up:1.1), sitting, presenting feet,
-        # soles, foot focus" should outrank a 1-tag stub like
-        # "Presenting Foot → presenting_foot" when the cosine gap is
-        # within tens of millis. The curator put the rich bundle there
-        # for a reason; cosine alone treats foot/feet as tied.
-        # Wide cosine pool so the diversity cap has enough non-dominant
-        # bucket entries to draw from. With queries like 'fully nude
-        # sitting with legs up' the embedding pulls hard toward NSFW
-        # content — Presenting Feet (pure pose bundle) lands at rank
-        # 50-80 cosine. Pool of top_k*2 missed it; widening to ~150
-        # for top_k=30 catches the long-tail pose/scene bundles the
-        # diversity cap can then surface back into top_k.
-        cosine_pool = min(max(top_k * 5, top_k + 100), scores.shape[0])
-        pool = torch.topk(scores, k=cosine_pool)
-        # Body-region awareness: when the user's text mentions clothing
-        # that implies a body region (e.g. 'red socks' → feet), boost
-        # bundles that engage that region. Catches phrasings like
-        # 'pointing red socks at viewer' where literal-word retrieval
-        # surfaces hand-pointing bundles instead of foot-presentation.
-        regions = _detect_body_regions(user_text)
-        out = []
-        for s, idx in zip(pool.values.tolist(), pool.indices.tolist()):
-            entry = dict(rows[idx])
-            entry["score"] = float(s)
-            # log keeps the bonus modest: 1 tag → 0, 5 tags → 0.032,
-            # 20 tags → 0.060. Enough to flip the order on a 0.01-0.05
-            # cosine gap without overpowering genuinely better matches.
-            n_tags = max(1, len([t for t in (entry.get("base_tags") or "").split(",") if t.strip()]))
-            adjusted = float(s) + 0.02 * math.log(n_tags)
-            if regions and _bundle_matches_region(entry, regions):
-                adjusted += 0.05
-            # Demote bundles whose display_name contains a body-part
-            # word the user never mentioned AND whose region isn't
-            # implied by user's clothing/body mentions. Catches 'Finger
-            # Gun' for 'pointing a gun' (no hand/finger/glove implied),
-            # but doesn't demote 'Presenting Feet' for 'wearing red
-            # socks' (socks → feet region → match).
-            if _bundle_introduces_unmentioned_body_part(entry, user_text, regions):
-                adjusted -= 0.10
-            entry["adjusted_score"] = adjusted
-            # Normalize to underscored canonical form before returning —
-            # bucket rows can be a mix of 'presenting feet' / 'green_leotard'.
-            # The downstream LLM rule expects one canonical form throughout,
-            # and the post-stream output formatter converts back to spaces
-            # for spaces-format target models.
-            entry["base_tags"] = _to_underscored_bundle(entry.get("base_tags") or "")
-            out.append(entry)
-        out.sort(key=lambda e: e["adjusted_score"], reverse=True)
-        # Diversity cap: keywords like 'nude' pull bge-small embeddings
-        # heavily toward NSFW bundles, drowning out pure pose / scene /
-        # expression bundles that match the user's actual intent
-        # (e.g. 'sitting with legs up pointing socks at viewer' should
-        # surface Presenting Feet but loses cosine to Wide Spread Legs,
-        # Cum on Legs, etc.). Cap any single bucket at half of top_k so
-        # other buckets' best matches always reach the model. Within
-        # the cap, cosine ordering is preserved.
-        return _diversify_by_bucket(out, top_k)
+    run.lap("fresh")
+    if index is None or not rows:
+        return []
+    # Expand presentation verbs (pointing/showing/displaying/etc.)
+    # and embed all variants. Take max cosine per bundle so we keep
+    # the best literal-word match AND the best synonym-substituted
+    # match — neither path suffers when the user phrases their
+    # intent with a verb the bundle didn't use.
+    variants = _expand_presentation_verbs(user_text)
+    q = _embed_model.embed_cached(variants)  # [k, dim], one row per variant
+    if q is None:
+        return []
+    run.lap("embed")
+    # Cosine == dot since both sides are L2-normalized.
+    # scores_per_variant: [N, k]; we take max over k.
+    scores_per_variant = index.scores(q.T)  # [N, k]
+    scores = scores_per_variant.max(axis=1)  # [N]
+    # Literal-word vs synonym alignment: when expansion fired (i.e.
+    # the user used a presentation verb), bundles whose original-
+    # query cosine is meaningfully HIGHER than any variant's cosine
+    # are aligned with literal pointing (Pointing at Viewer for
+    # 'pointing X at viewer'). In presentation context, the user's
+    # likely intent is the synonym/presenting interpretation, so
+    # demote those to fall out of top-K. Threshold (>0.02 stronger
+    # on original than variants) avoids false positives where the
+    # cosines are roughly tied.
+    if len(variants) > 1:
+        orig = scores_per_variant[:, 0]  # [N] cosine to original
+        variant_max = scores_per_variant[:, 1:].max(axis=1)  # [N]
+        literal_aligned = (orig - variant_max) > 0.02
+        scores = scores + literal_aligned.astype(scores.dtype) * (-0.10)
+    # Pull a wider net for the cosine cut, then rerank by adjusted
+    # score (cosine + richness bonus). A bundle like
+    # "Presenting Feet → (legs up:1.1), sitting, presenting feet,
+    # soles, foot focus" should outrank a 1-tag stub like
+    # "Presenting Foot → presenting_foot" when the cosine gap is
+    # within tens of millis. The curator put the rich bundle there
+    # for a reason; cosine alone treats foot/feet as tied.
+    # Wide cosine pool so the diversity cap has enough non-dominant
+    # bucket entries to draw from. With queries like 'fully nude
+    # sitting with legs up' the embedding pulls hard toward NSFW
+    # content — Presenting Feet (pure pose bundle) lands at rank
+    # 50-80 cosine. Pool of top_k*2 missed it; widening to ~150
+    # for top_k=30 catches the long-tail pose/scene bundles the
+    # diversity cap can then surface back into top_k.
+    cosine_pool = max(top_k * 5, top_k + 100)
+    pool = topk.top_k(scores, cosine_pool)
+    run.lap("score")
+    # Body-region awareness: when the user's text mentions clothing
+    # that implies a body region (e.g. 'red socks' → feet), boost
+    # bundles that engage that region. Catches phrasings like
+    # 'pointing red socks at viewer' where literal-word retrieval
+    # surfaces hand-pointing bundles instead of foot-presentation.
+    regions = _detect_body_regions(user_text)
+    out = []
+    for idx, s in pool:
+        entry = dict(rows[idx])
+        entry["score"] = s
+        # log keeps the bonus modest: 1 tag → 0, 5 tags → 0.032,
+        # 20 tags → 0.060. Enough to flip the order on a 0.01-0.05
+        # cosine gap without overpowering genuinely better matches.
+        n_tags = max(1, len([t for t in (entry.get("base_tags") or "").split(",") if t.strip()]))
+        adjusted = float(s) + 0.02 * math.log(n_tags)
+        if regions and _bundle_matches_region(entry, regions):
+            adjusted += 0.05
+        # Demote bundles whose display_name contains a body-part
+        # word the user never mentioned AND whose region isn't
+        # implied by user's clothing/body mentions. Catches 'Finger
+        # Gun' for 'pointing a gun' (no hand/finger/glove implied),
+        # but doesn't demote 'Presenting Feet' for 'wearing red
+        # socks' (socks → feet region → match).
+        if _bundle_introduces_unmentioned_body_part(entry, user_text, regions):
+            adjusted -= 0.10
+        entry["adjusted_score"] = adjusted
+        # Normalize to underscored canonical form before returning —
+        # bucket rows can be a mix of 'presenting feet' / 'green_leotard'.
+        # The downstream LLM rule expects one canonical form throughout,
+        # and the post-stream output formatter converts back to spaces
+        # for spaces-format target models.
+        entry["base_tags"] = _to_underscored_bundle(entry.get("base_tags") or "")
+        out.append(entry)
+    out.sort(key=lambda e: e["adjusted_score"], reverse=True)
+    # Diversity cap: keywords like 'nude' pull bge-small embeddings
+    # heavily toward NSFW bundles, drowning out pure pose / scene /
+    # expression bundles that match the user's actual intent
+    # (e.g. 'sitting with legs up pointing socks at viewer' should
+    # surface Presenting Feet but loses cosine to Wide Spread Legs,
+    # Cum on Legs, etc.). Cap any single bucket at half of top_k so
+    # other buckets' best matches always reach the model. Within
+    # the cap, cosine ordering is preserved.
+    out = _diversify_by_bucket(out, top_k)
+    run.lap("hydrate")
+    _dbg.debug("bucket_search: overhead %s", run.finish())
+    return out
 
 
 def search_for_apply(user_text: str,
@@ -654,39 +703,62 @@ def search_for_apply(user_text: str,
     user_text = (user_text or "").strip()
     if not user_text:
         return []
+    if not _ensure_model_loaded():
+        return []
+    run = _stats.start()
+    # Lock only for the freshness check (see search()).
     with _lock:
-        if not _ensure_model_loaded():
-            return []
         _ensure_index_fresh()
-        embeddings = _state["embeddings"]
+        index = _state["index"]
         rows = _state["rows"]
-        if embeddings is None or not rows:
-            return []
-        import torch
-        q = _embed([user_text])  # [1, dim]
-        scores = (embeddings @ q.T).squeeze(1)  # [N]
-        cosine_pool = min(max(top_k * 5, top_k + 50), scores.shape[0])
-        pool = torch.topk(scores, k=cosine_pool)
-        regions = _detect_body_regions(user_text)
-        out: list[dict] = []
-        for s, idx in zip(pool.values.tolist(), pool.indices.tolist()):
-            entry = dict(rows[idx])
-            if buckets and entry.get("bucket") not in buckets:
-                continue
-            entry["score"] = float(s)
-            n_tags = max(1, len([
-                t for t in (entry.get("base_tags") or "").split(",") if t.strip()
-            ]))
-            adjusted = float(s) + 0.02 * math.log(n_tags)
-            if regions and _bundle_matches_region(entry, regions):
-                adjusted += 0.05
-            if _bundle_introduces_unmentioned_body_part(entry, user_text, regions):
-                adjusted -= 0.10
-            entry["adjusted_score"] = adjusted
-            entry["base_tags"] = _to_underscored_bundle(entry.get("base_tags") or "")
-            out.append(entry)
-        out.sort(key=lambda e: e["adjusted_score"], reverse=True)
-        return out[:top_k]
+        # Bucket filter is a mask on the scores, so the pool is the best
+        # rows *within* `buckets` rather than whatever survives a filter
+        # of the global pool.
+        mask = _bucket_mask(buckets) if (buckets and rows) else None
+    run.lap("fresh")
+    if index is None or not rows:
+        return []
+    q = _embed_model.embed_cached([user_text])  # [1, dim]
+    if q is None:
+        return []
+    q = q[0]
+    run.lap("embed")
+    scores = index.scores(q)  # [N]
+    cosine_pool = max(top_k * 5, top_k + 50)
+    pool = topk.top_k(scores, cosine_pool, mask=mask)
+    run.lap("score")
+    regions = _detect_body_regions(user_text)
+    out: list[dict] = []
+    for idx, s in pool:
+        entry = dict(rows[idx])
+        entry["score"] = s
+        n_tags = max(1, len([
+            t for t in (entry.get("base_tags") or "").split(",") if t.strip()
+        ]))
+        adjusted = float(s) + 0.02 * math.log(n_tags)
+        if regions and _bundle_matches_region(entry, regions):
+            adjusted += 0.05
+        if _bundle_introduces_unmentioned_body_part(entry, user_text, regions):
+            adjusted -= 0.10
+        entry["adjusted_score"] = adjusted
+        entry["base_tags"] = _to_underscored_bundle(entry.get("base_tags") or "")
+        out.append(entry)
+    out.sort(key=lambda e: e["adjusted_score"], reverse=True)
+    run.lap("hydrate")
+    _dbg.debug("bucket_search: overhead %s", run.finish())
+    return out[:top_k]
+
+
+def _bucket_mask(buckets: tuple[str, ...]):
+    """Bool array [N], True for rows in `buckets`. Cached per filter until
+    the next rebuild (callers pass a handful of fixed tuples)."""
+    key = tuple(buckets)
+    mask = _state["bucket_masks"].get(key)
+    if mask is None:
+        import numpy as np
+        mask = np.array([r.get("bucket") in key for r in _state["rows"]], dtype=bool)
+        _state["bucket_masks"][key] = mask
+    return mask
 
 
 def _diversify_by_bucket(results: list[dict], top_k: int) -> list[dict]:
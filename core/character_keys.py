@@ -0,0 +1,318 @@
+"""
+Normalized-name keys for tag_builder's character matcher.
+
+`match_characters_inner` resolves the user's mentions to `characters` rows
+in five stages. Two of them compared against a string computed per row
+at query time:
+
+  * stage 2 (bare-alphanumeric: `m. bison` -> `m._bison`) ran six nested
+    REPLACEs and a LOWER over every tag — a full scan with per-row string
+    work;
+  * stages 3-5 (name prefix: `cammy` -> `cammy_white`) ran
+    `LOWER(tag) LIKE 'cammy\\_%'`, which no index serves because of the
+    LOWER.
+
+Both forms are now persisted on `characters` and indexed:
+
+  name_key     tag lowercased with _ - . space ( ) removed — the stage 2 key
+  name_prefix  lowercased tag up to its first underscore (NULL without
+               one) — the first-name alias stages 3-5 look up
+
+plus an expression index on LOWER(tag) for the exact half of stages 4/5.
+SQLite computes both columns from the same expressions the old queries
+used, in triggers on insert and on tag updates, so direct sqlite3 CLI
+writes stay in sync and the keyed queries return exactly the old rows.
+
+`match_character_rows` runs the five stages for several mentions (token
+lists) at once: every stage is one query over the union of all the
+mentions' keys, and each mention is then resolved from those rows with
+the same per-mention rules as before — a mention's result doesn't depend
+on what else was in the batch.
+
+Falls back to the old per-row queries, with identical results, when the
+key columns are missing (a DB file replaced mid-session).
+"""
+from __future__ import annotations
+
+import logging
+import re
+import sqlite3
+from typing import Callable, Iterable
+
+logger = logging.getLogger("promptchain.character_keys")
+
+_CANON_ORDER = (
+    # Canonical-ness: fewer `_(` disambiguators first, then shorter total
+    # length, then alphabetical.
+    "(LENGTH(c.tag) - LENGTH(REPLACE(c.tag, '_(', ''))) ASC, "
+    "LENGTH(c.tag) ASC, c.tag ASC"
+)
+_ROW_COLS = "c.tag, c.display, c.series, c.base_tags, c.base_natlang"
+_PREFIX_LIMIT = 5
+# Stage 2 only matches bare forms this long — shorter ones ("j") would
+# match every J-named character.
+_MIN_BARE = 3
+
+
+def _bare_sql(expr: str) -> str:
+    return (f"LOWER(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE("
+            f"{expr}, '_', ''), '-', ''), '.', ''), ' ', ''), '(', ''), ')', ''))")
+
+
+def _prefix_sql(expr: str) -> str:
+    return (f"CASE WHEN instr({expr}, '_') > 0 "
+            f"THEN LOWER(substr({expr}, 1, instr({expr}, '_') - 1)) END")
+
+
+_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS characters_keys_ai AFTER INSERT ON characters BEGIN
+    UPDATE characters SET name_key = {_bare_sql("new.tag")}, name_prefix = {_prefix_sql("new.tag")}
+    WHERE rowid = new.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS characters_keys_au AFTER UPDATE OF tag ON characters BEGIN
+    UPDATE characters SET name_key = {_bare_sql("new.tag")}, name_prefix = {_prefix_sql("new.tag")}
+    WHERE rowid = new.rowid;
+END;
+CREATE INDEX IF NOT EXISTS idx_characters_name_key ON characters(name_key);
+CREATE INDEX IF NOT EXISTS idx_characters_name_prefix ON characters(name_prefix);
+CREATE INDEX IF NOT EXISTS idx_characters_tag_lower ON characters(LOWER(tag));
+"""
+
+
+def ensure_character_name_keys(conn: sqlite3.Connection) -> bool:
+    """Migration: add name_key / name_prefix, their indexes and triggers,
+    and fill in any row whose keys are missing or stale (first run, or
+    rows written before the triggers existed). Idempotent; writes nothing
+    once the keys are in sync. False when `characters` doesn't exist."""
+    for column in ("name_key", "name_prefix"):
+        try:
+            conn.execute(f"ALTER TABLE characters ADD COLUMN {column} TEXT")
+        except sqlite3.OperationalError:
+            # column already exists (or no characters table — caught below)
+            pass
+    try:
+        conn.executescript(_TRIGGERS)
+        n = conn.execute(
+            f"UPDATE characters SET name_key = {_bare_sql('tag')}, "
+            f"name_prefix = {_prefix_sql('tag')} "
+            f"WHERE name_key IS NOT {_bare_sql('tag')} "
+            f"   OR name_prefix IS NOT {_prefix_sql('tag')}"
+        ).rowcount
+        conn.commit()
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        logger.info("character_keys: name keys unavailable (%s) — using per-row matching", e)
+        return False
+    if n:
+        logger.info("character_keys: computed name keys for %d characters", n)
+    return True
+
+
+def bare_key(token: str) -> str:
+    """Python side of name_key for a user token."""
+    return re.sub(r"[\s_\-\.()]+", "", token).lower()
+
+
+def _like_prefix(prefix: str) -> str:
+    # Escape LIKE metacharacters so a name with % or _ doesn't wildcard-match.
+    esc = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return esc + r"\_%"
+
+
+# ---- queries: keyed, and the per-row forms they replace ----------------
+
+def _exact_rows(conn, tags: list[str]) -> list:
+    if not tags:
+        return []
+    return conn.execute(
+        f"SELECT {_ROW_COLS} FROM characters c "
+        f"WHERE c.tag IN ({','.join('?' * len(tags))}) ORDER BY c.tag",
+        tags,
+    ).fetchall()
+
+
+def _bare_rows(conn, keys: list[str], use_keys: bool) -> list:
+    """Rows whose name_key is in `keys`, in table order, each carrying its
+    name_key."""
+    if not keys:
+        return []
+    key_expr = "c.name_key" if use_keys else _bare_sql("c.tag")
+    return conn.execute(
+        f"SELECT {_ROW_COLS}, {key_expr} AS name_key FROM characters c "
+        f"WHERE {key_expr} IN ({','.join('?' * len(keys))}) ORDER BY c.rowid",
+        keys,
+    ).fetchall()
+
+
+def _prefix_rows(conn, lookups: list[tuple[str | None, str]],
+                 use_keys: bool) -> dict[tuple[str | None, str], list]:
+    """Top candidates, in canonical-ness order, for each (exact, prefix)
+    lookup: tags shaped `<prefix>_<anything>`, or equal to `exact` when
+    it's set."""
+    out: dict[tuple[str | None, str], list] = {lk: [] for lk in lookups}
+    if not lookups:
+        return out
+    if not use_keys:
+        for exact, prefix in lookups:
+            where = "LOWER(tag) LIKE ? ESCAPE '\\'"
+            params: list = [_like_prefix(prefix)]
+            if exact is not None:
+                where = "LOWER(tag) = ? OR " + where
+                params.insert(0, exact)
+            out[(exact, prefix)] = conn.execute(
+                "SELECT tag, display, series, base_tags, base_natlang FROM characters "
+                f"WHERE {where} "
+                "ORDER BY (LENGTH(tag) - LENGTH(REPLACE(tag, '_(', ''))) ASC, "
+                "         LENGTH(tag) ASC, tag ASC "
+                f"LIMIT {_PREFIX_LIMIT}",
+                params,
+            ).fetchall()
+        return out
+    # The LIKE stays as a filter, but only over rows whose name_prefix —
+    # the tag up to its first underscore — equals the pattern's own first
+    # segment, which every LIKE match has.
+    params = []
+    for i, (exact, prefix) in enumerate(lookups):
+        params += [i, exact, prefix.split("_", 1)[0], _like_prefix(prefix)]
+    rows = conn.execute(
+        f"WITH q(k, exact, seg, pat) AS (VALUES "
+        f"{','.join(['(?, ?, ?, ?)'] * len(lookups))}), "
+        "hit(k, rid) AS ("
+        "  SELECT q.k, c.rowid FROM q JOIN characters c ON LOWER(c.tag) = q.exact"
+        "  UNION"
+        "  SELECT q.k, c.rowid FROM q JOIN characters c ON c.name_prefix = q.seg"
+        "  WHERE LOWER(c.tag) LIKE q.pat ESCAPE '\\') "
+        f"SELECT * FROM (SELECT h.k AS _k, {_ROW_COLS}, "
+        f"ROW_NUMBER() OVER (PARTITION BY h.k ORDER BY {_CANON_ORDER}) AS _rn "
+        "FROM hit h JOIN characters c ON c.rowid = h.rid) "
+        f"WHERE _rn <= {_PREFIX_LIMIT} ORDER BY _k, _rn",
+        params,
+    ).fetchall()
+    for r in rows:
+        out[lookups[r["_k"]]].append(r)
+    return out
+
+
+# ---- the five stages ---------------------------------------------------
+
+def _prefix_lookups(tokens: list[str], stoplist: frozenset) -> tuple[list, list, list]:
+    """Stage 3/4/5 candidates for one mention: [(prefix, token), ...]
+    each, first token per prefix."""
+    stage3: dict[str, str] = {}
+    stage4: dict[str, str] = {}
+    stage5: dict[str, str] = {}
+    for token in tokens:
+        # Stage 3: the user typed just a first name (`mythra`, `cammy`,
+        # `ryu`) — no spaces, underscores, hyphens or parens. Length
+        # floor 3 keeps short canonical names (`ryu`, `ada`, `ken`); the
+        # stoplist drops generic words (`red`, `boy`).
+        if not re.search(r"[\s_\-()]", token):
+            if len(token) >= 3 and token.lower() not in stoplist:
+                stage3.setdefault(token.lower(), token)
+            continue
+        # Stage 4: canonical-shaped token with the wrong franchise
+        # (`mythra_(xenoblade_chronicles_2)` vs the DB's
+        # `mythra_(xenoblade)`) — the name before `_(`, matched exactly
+        # (`sagat`, `cammy_white`) or as a prefix.
+        if "_(" in token:
+            bare_name = token.split("_(", 1)[0].strip()
+            if len(bare_name) >= 4 and bare_name.lower() not in stoplist:
+                stage4.setdefault(bare_name.lower(), token)
+            continue
+        # Stage 5: a typo the agent paraphrased into a malformed canonical
+        # (`ryu_streets_fighter`) — the first underscore segment, same
+        # lookup as stage 4.
+        if "_" in token:
+            bare_name = token.split("_", 1)[0].strip()
+            if len(bare_name) >= 3 and bare_name.lower() not in stoplist:
+                stage5.setdefault(bare_name.lower(), token)
+    return list(stage3.items()), list(stage4.items()), list(stage5.items())
+
+
+def match_character_rows(
+    conn: sqlite3.Connection,
+    mentions: Iterable[dict[str, str]],
+    *,
+    latest_user_text: str = "",
+    stoplist: frozenset = frozenset(),
+    pick: Callable[[list, str], object] | None = None,
+    use_keys: bool = True,
+) -> list[tuple[dict[str, str], list]]:
+    """Resolve each mention's tokens to character rows.
+
+    A mention is `norm_to_original`: DB-shaped token variants -> the
+    user's original token. Returns, per mention, (norm_to_original with
+    each matched tag added, matched rows in stage order). `pick(rows,
+    latest_user_text)` chooses among a name-prefix stage's candidates
+    (default: the first, most canonical one)."""
+    mentions = [dict(m) for m in mentions]
+    if use_keys:
+        try:
+            return _match(conn, mentions, latest_user_text, stoplist, pick, True)
+        except sqlite3.OperationalError as e:
+            logger.debug("character_keys: keyed match failed (%s) — per-row fallback", e)
+    return _match(conn, mentions, latest_user_text, stoplist, pick, False)
+
+
+def _match(conn, mentions, latest_user_text, stoplist, pick, use_keys):
+    if pick is None:
+        pick = lambda rows, _text: rows[0] if rows else None  # noqa: E731
+    user_tokens = [list(m) for m in mentions]
+    bare_maps: list[dict[str, str]] = []
+    for m in mentions:
+        bare_to_tokens: dict[str, str] = {}
+        for token, original in m.items():
+            bare = bare_key(token)
+            if len(bare) >= _MIN_BARE:
+                bare_to_tokens.setdefault(bare, original)
+        bare_maps.append(bare_to_tokens)
+    stages = [_prefix_lookups(t, stoplist) for t in user_tokens]
+
+    # One query per stage for the whole batch.
+    all_tags = sorted({t for toks in user_tokens for t in toks})
+    exact = _exact_rows(conn, all_tags)
+    bare = _bare_rows(conn, sorted({k for b in bare_maps for k in b}), use_keys)
+    lookups: dict[tuple[str | None, str], None] = {}
+    for s3, s4, s5 in stages:
+        for prefix, _ in s3:
+            lookups[(None, prefix)] = None
+        for prefix, _ in s4 + s5:
+            lookups[(prefix, prefix)] = None
+    candidates = _prefix_rows(conn, list(lookups), use_keys)
+
+    results = []
+    for m, toks, bare_to_tokens, (s3, s4, s5) in zip(
+            mentions, user_tokens, bare_maps, stages):
+        # Stage 1: exact tag.
+        token_set = set(toks)
+        char_rows = [r for r in exact if r["tag"] in token_set]
+        already_matched = {r["tag"] for r in char_rows}
+        # Stage 2: tags with literals the separator variants can't
+        # produce — `m._bison`, `c.c.`, `t.m._opera_o_(umamusume)` —
+        # compared with [_-. ()] stripped from both sides. Skips tags the
+        # mention names exactly so nothing is counted twice.
+        for r in bare:
+            if r["tag"] in token_set or r["tag"] in already_matched:
+                continue
+            if r["name_key"] not in bare_to_tokens:
+                continue
+            original = bare_to_tokens.get(bare_key(r["tag"]))
+            if original is not None:
+                m.setdefault(r["tag"], original)
+                char_rows.append(r)
+                already_matched.add(r["tag"])
+        # Stages 3-5: name prefix, in that order.
+        for exact_too, found in ((False, s3), (True, s4), (True, s5)):
+            for prefix, token in found:
+                original = m.get(token)
+                if original is None:
+                    continue
+                rows = candidates[(prefix if exact_too else None, prefix)]
+                chosen = pick(rows, latest_user_text)
+                if chosen is None or chosen["tag"] in already_matched:
+                    continue
+                m.setdefault(chosen["tag"], original)
+                char_rows.append(chosen)
+                already_matched.add(chosen["tag"])
+        results.append((m, char_rows))
+    return results
@@ -0,0 +1,261 @@
+"""
+Character picker search over tag_builder's `characters` table.
+
+The picker searches ~11.5k characters on every keystroke. Each search word
+has to appear in the tag, display name, series or series tag (underscores
+read as spaces, case-insensitive). The old query was a
+`LOWER(REPLACE(col, '_', ' ')) LIKE '%word%'` over all four columns, run
+once for the COUNT and again for the LIMIT/OFFSET page — two full scans
+with per-row string work.
+
+`characters_fts` is an FTS5 shadow table with the trigram tokenizer over
+the same four columns (underscores already replaced), keyed by the
+characters rowid and kept in sync by triggers. A trigram MATCH is an
+index lookup for any substring of 3+ characters. Shorter words keep the
+LIKE predicate, which is then applied only to the rows FTS already
+narrowed. With a search, sort="relevance" ranks by bm25.
+
+Pages are keyset-paginated. Every sort ends in `c.tag` (unique), and
+`next_cursor` encodes the last row's sort key. Passing it back continues
+after that row without an OFFSET scan, and pages stay stable while rows
+are added. page/per_page (OFFSET) still works, in the same order.
+
+Falls back to the LIKE path, with identical results, where this SQLite
+has no FTS5/trigram (3.34+) or the shadow table is missing (a DB file
+replaced mid-session).
+"""
+from __future__ import annotations
+
+import base64
+import json
+import logging
+import sqlite3
+
+logger = logging.getLogger("promptchain.character_search")
+
+FTS_TABLE = "characters_fts"
+_FTS_COLUMNS = ("tag", "display", "series", "series_tag")
+# Trigram MATCH needs at least 3 characters; shorter words use LIKE.
+_MIN_TRIGRAM = 3
+# Sorts NULL below every number and string — where NULLs already sat in
+# both ASC and DESC — so keyset comparisons never meet a NULL.
+_NULL_KEY = -1e308
+
+_SORTS: dict[str, tuple[tuple[str, str], ...]] = {
+    "display": (("c.display", "ASC"),),
+    "tag": (),
+    "post_count": (("c.post_count", "DESC"),),
+    "updated_at": (("c.updated_at", "DESC"),),
+    "series": (("c.series", "ASC"), ("c.display", "ASC")),
+}
+# bm25 with the name columns outweighing the series ones — "street" should
+# put a character named Street ahead of everyone who merely belongs to
+# Street Fighter — then popularity.
+_RELEVANCE = ((f"bm25({FTS_TABLE}, 2.0, 4.0, 1.0, 1.0)", "ASC"), ("c.post_count", "DESC"))
+# Older SQLite (< 3.35) has no MATERIALIZED hint.
+_MATERIALIZED = "MATERIALIZED " if sqlite3.sqlite_version_info >= (3, 35, 0) else ""
+
+
+def _norm(expr: str) -> str:
+    return f"REPLACE(COALESCE({expr}, ''), '_', ' ')"
+
+
+# characters_fts_bi: INSERT OR REPLACE drops the conflicting row without
+# firing the delete trigger (unless recursive_triggers is on), so clear the
+# shadow row of any existing row with the same tag up front.
+_TRIGGERS = f"""
+CREATE TRIGGER IF NOT EXISTS characters_fts_bi BEFORE INSERT ON characters BEGIN
+    DELETE FROM {FTS_TABLE}
+    WHERE rowid IN (SELECT rowid FROM characters WHERE tag = new.tag);
+END;
+CREATE TRIGGER IF NOT EXISTS characters_fts_ai AFTER INSERT ON characters BEGIN
+    INSERT INTO {FTS_TABLE} (rowid, {", ".join(_FTS_COLUMNS)})
+    VALUES (new.rowid, {", ".join(_norm("new." + c) for c in _FTS_COLUMNS)});
+END;
+CREATE TRIGGER IF NOT EXISTS characters_fts_ad AFTER DELETE ON characters BEGIN
+    DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS characters_fts_au
+AFTER UPDATE OF {", ".join(_FTS_COLUMNS)} ON characters BEGIN
+    DELETE FROM {FTS_TABLE} WHERE rowid = old.rowid;
+    INSERT INTO {FTS_TABLE} (rowid, {", ".join(_FTS_COLUMNS)})
+    VALUES (new.rowid, {", ".join(_norm("new." + c) for c in _FTS_COLUMNS)});
+END;
+"""
+
+
+def ensure_characters_fts(conn: sqlite3.Connection) -> bool:
+    """Create the shadow table and triggers if missing, and (re)fill it
+    when its row count disagrees with `characters` (first run, or rows
+    written by a SQLite without FTS5). False when FTS5 / the trigram
+    tokenizer isn't available or `characters` doesn't exist — searches
+    then take the LIKE path."""
+    try:
+        conn.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} "
+            f"USING fts5({', '.join(_FTS_COLUMNS)}, tokenize='trigram')"
+        )
+        conn.executescript(_TRIGGERS)
+        have = conn.execute(f"SELECT COUNT(*) FROM {FTS_TABLE}").fetchone()[0]
+        want = conn.execute("SELECT COUNT(*) FROM characters").fetchone()[0]
+        if have != want:
+            conn.execute(f"DELETE FROM {FTS_TABLE}")
+            conn.execute(
+                f"INSERT INTO {FTS_TABLE} (rowid, {', '.join(_FTS_COLUMNS)}) "
+                f"SELECT rowid, {', '.join(_norm('c.' + col) for col in _FTS_COLUMNS)} "
+                "FROM characters c"
+            )
+            logger.info("character_search: indexed %d characters for full-text search", want)
+        conn.commit()
+        return True
+    except sqlite3.OperationalError as e:
+        conn.rollback()
+        logger.info("character_search: full-text index unavailable (%s) — using LIKE scans", e)
+        return False
+
+
+def encode_cursor(key: list) -> str:
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> list | None:
+    """Sort key from `encode_cursor`, or None when it doesn't parse."""
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        return None
+    return key if isinstance(key, list) else None
+
+
+def _like_clause(word: str) -> tuple[str, list[str]]:
+    # Escape LIKE metacharacters in the user's query so a search for
+    # literal "_" or "%" doesn't wildcard-match everything. Matches tag,
+    # display, AND series — searching "street fighter" should surface
+    # every Street Fighter character, not just ones with "street" or
+    # "fighter" in their own name.
+    esc = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    sql = "(" + " OR ".join(
+        f"LOWER({_norm('c.' + col)}) LIKE ? ESCAPE '\\'" for col in _FTS_COLUMNS
+    ) + ")"
+    return sql, [f"%{esc}%"] * len(_FTS_COLUMNS)
+
+
+def _fts_phrase(word: str) -> str:
+    return '"' + word.replace('"', '""') + '"'
+
+
+def search_characters(conn: sqlite3.Connection, search: str = "", *,
+                      status: str = "", natlang_status: str = "", category: str = "",
+                      sort: str = "", per_page: int = 50, page: int = 1,
+                      cursor: str | None = None, use_fts: bool = True) -> dict:
+    """One page of characters. Returns {rows, total, next_cursor}: rows are
+    dicts of the characters columns; total is None on cursor requests (the
+    caller already has it from the first page — skipping the COUNT is the
+    point). `sort` is one of _SORTS or "relevance" (the default when
+    searching; without a search it means post_count). Raises ValueError
+    for a cursor that doesn't belong to this sort."""
+    words = search.replace("_", " ").lower().split()
+    if use_fts and any(len(w) >= _MIN_TRIGRAM for w in words):
+        try:
+            return _query(conn, words, True, status, natlang_status, category,
+                          sort, per_page, page, cursor)
+        except sqlite3.OperationalError as e:
+            logger.debug("character_search: FTS path failed (%s) — LIKE fallback", e)
+    return _query(conn, words, False, status, natlang_status, category,
+                  sort, per_page, page, cursor)
+
+
+def _query(conn, words, fts, status, natlang_status, category, sort,
+           per_page, page, cursor) -> dict:
+    where: list[str] = []
+    params: list = []
+    if fts:
+        from_sql = f"{FTS_TABLE} JOIN characters c ON c.rowid = {FTS_TABLE}.rowid"
+        where.append(f"{FTS_TABLE} MATCH ?")
+        params.append(" AND ".join(_fts_phrase(w) for w in words if len(w) >= _MIN_TRIGRAM))
+        like_words = [w for w in words if len(w) < _MIN_TRIGRAM]
+    else:
+        from_sql = "characters c"
+        like_words = words
+    if status:
+        where.append("c.status = ?")
+        params.append(status)
+    # natlang_status: TagBuilder2 sends `normalized` so only fully-curated
+    # characters surface in its Subjects rail / All view.
+    if natlang_status:
+        where.append("c.natlang_status = ?")
+        params.append(natlang_status)
+    # Subjects rail filters by category via character_series.
+    if category:
+        from_sql += " JOIN character_series cs ON cs.series_tag = c.series_tag"
+        where.append("cs.category = ?")
+        params.append(category)
+    for word in like_words:
+        sql, p = _like_clause(word)
+        where.append(sql)
+        params.extend(p)
+    where_sql = (" WHERE " + " AND ".join(where)) if where else ""
+    if not sort:
+        sort = "relevance" if words else "display"
+    if sort == "relevance":
+        keys = _RELEVANCE if fts else _SORTS["post_count"]
+    else:
+        keys = _SORTS.get(sort, _SORTS["display"])
+    keys = tuple(keys) + (("c.tag", "ASC"),)
+    key_cols = ", ".join(
+        f"COALESCE({expr}, {_NULL_KEY}) AS _k{i}" for i, (expr, _) in enumerate(keys)
+    )
+    order_sql = ", ".join(f"_k{i} {d}" for i, (_, d) in enumerate(keys))
+    # Every match's rowid and sort key, computed once per request: the page
+    # (top N of these, then joined to characters for its rows only) and the
+    # first page's total both read it.
+    with_sql = (f"WITH m AS {_MATERIALIZED}(SELECT c.rowid AS rid, {key_cols} "
+                f"FROM {from_sql}{where_sql}) ")
+
+    outer: list[str] = []
+    outer_params: list = []
+    after = decode_cursor(cursor) if cursor else None
+    if cursor and (after is None or len(after) != len(keys)):
+        raise ValueError("invalid cursor")
+    if after is not None:
+        # (k0, k1, ...) strictly after the cursor in this mixed-direction
+        # order: k0 past it, or k0 equal and k1 past it, and so on.
+        ors = []
+        for i, (_, d) in enumerate(keys):
+            ands = [f"_k{j} = ?" for j in range(i)]
+            ands.append(f"_k{i} {'>' if d == 'ASC' else '<'} ?")
+            ors.append("(" + " AND ".join(ands) + ")")
+            outer_params.extend(after[:i + 1])
+        outer.append("(" + " OR ".join(ors) + ")")
+    outer_sql = (" WHERE " + " AND ".join(outer)) if outer else ""
+    offset = 0 if cursor else max(0, (page - 1) * per_page)
+
+    count_col = "" if cursor else ", (SELECT COUNT(*) FROM m) AS _total"
+    rows = conn.execute(
+        f"{with_sql}SELECT c.*, p.*{count_col} FROM "
+        f"(SELECT * FROM m{outer_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?) p "
+        f"JOIN characters c ON c.rowid = p.rid ORDER BY {order_sql}",
+        params + outer_params + [per_page + 1, offset],
+    ).fetchall()
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    total = None
+    if not cursor:
+        if rows:
+            total = rows[0]["_total"]
+        else:
+            total = conn.execute(f"{with_sql}SELECT COUNT(*) FROM m", params).fetchone()[0]
+
+    out = []
+    for r in rows:
+        d = dict(r)
+        d.pop("_total", None)
+        d.pop("rid", None)
+        for i in range(len(keys)):
+            d.pop(f"_k{i}", None)
+        out.append(d)
+    next_cursor = None
+    if more and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor([last[f"_k{i}"] for i in range(len(keys))])
+    return {"rows": out, "total": total, "next_cursor": next_cursor}
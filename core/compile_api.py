@@ -0,0 +1,134 @@
+# Compile API — prompt compiler diagnostics (compile cache counters) and batch
+# compilation of many variants of one template.
+
+import asyncio
+import json
+import time
+
+from aiohttp import web
+import server
+
+from .api_utils import error_response, ok_response, parse_json
+from .compiler import clear_compile_cache, compile_batch, compile_cache_stats
+
+routes = server.PromptServer.instance.routes
+
+# Above this many variants the batch endpoint streams SSE events instead of
+# building one JSON body; the client can also ask for streaming explicitly.
+_STREAM_THRESHOLD = 200
+_MAX_VARIANTS = 100_000
+_CHUNK = 100  # variants compiled per worker-thread hop while streaming
+
+
+# ── compile cache ────────────────────────────────────────────────
+
+@routes.get("/promptchain/compile/cache")
+async def _api_compile_cache_stats(request):
+    return web.json_response(compile_cache_stats())
+
+
+@routes.post("/promptchain/compile/cache/clear")
+async def _api_compile_cache_clear(request):
+    clear_compile_cache()
+    return ok_response()
+
+
+# ── batch compile ────────────────────────────────────────────────
+
+def _is_int(value) -> bool:
+    # JSON true/false arrive as bool, which is an int subclass.
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _int_list(value, field: str):
+    """Accept [1, 2, 3] or {"start": 0, "count": 500}; None passes through."""
+    if value is None:
+        return None
+    if isinstance(value, dict):
+        start, count = value.get("start", 0), value.get("count", 0)
+        if not _is_int(start) or not _is_int(count) or count < 0:
+            raise ValueError(f"{field}: start/count must be non-negative integers")
+        # Checked before the range is materialized — count=10**12 must not
+        # get as far as building the list.
+        if count > _MAX_VARIANTS:
+            raise ValueError(f"{field}: count {count} exceeds {_MAX_VARIANTS}")
+        return list(range(start, start + count))
+    if isinstance(value, list) and all(_is_int(v) for v in value):
+        return value
+    raise ValueError(f"{field}: expected a list of integers or {{start, count}}")
+
+
+@routes.post("/promptchain/compile/batch")
+async def _api_compile_batch(request):
+    """Compile one template for many seeds / iterate indices in one request.
+
+    Body: {prompt, seeds?, iterate?, mode?, switch_index?, wildcard_modes?,
+    regions? (default true), stream?}. Each variant is
+    {seed, iterate_index, positive, negative, regions}.
+    """
+    data, err = await parse_json(request)
+    if err: return err
+    prompt = data.get("prompt")
+    if not isinstance(prompt, str):
+        return error_response("missing prompt")
+    try:
+        seeds = _int_list(data.get("seeds"), "seeds")
+        iterate = _int_list(data.get("iterate"), "iterate")
+    except ValueError as e:
+        return error_response(str(e))
+    total = len(seeds if seeds is not None else [0]) * len(iterate if iterate is not None else [None])
+    if total > _MAX_VARIANTS:
+        return error_response(f"too many variants ({total} > {_MAX_VARIANTS})")
+
+    mode = data.get("mode", "combine")
+    if mode not in ("combine", "roll", "switch"):
+        mode = "combine"
+    kwargs = {"mode": mode, "regions": data.get("regions", True) is not False}
+    if isinstance(data.get("switch_index"), int):
+        kwargs["switch_index"] = data["switch_index"]
+    if isinstance(data.get("wildcard_modes"), dict):
+        kwargs["wildcard_modes"] = data["wildcard_modes"]
+
+    variants = compile_batch(prompt, seeds=seeds, iterate=iterate, **kwargs)
+    started = time.perf_counter()
+
+    if not data.get("stream", total > _STREAM_THRESHOLD):
+        results = await asyncio.to_thread(list, variants)
+        return web.json_response({
+            "variants": results,
+            "count": len(results),
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        })
+
+    resp = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+    await resp.prepare(request)
+
+    def next_chunk():
+        chunk = []
+        for variant in variants:
+            chunk.append(variant)
+            if len(chunk) >= _CHUNK:
+                break
+        return chunk
+
+    sent = 0
+    try:
+        while True:
+            chunk = await asyncio.to_thread(next_chunk)
+            if not chunk:
+                break
+            await resp.write(b"".join(
+                b"data: " + json.dumps(v).encode("utf-8") + b"\n\n" for v in chunk))
+            sent += len(chunk)
+        await resp.write(b"data: " + json.dumps({
+            "done": True,
+            "count": sent,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 2),
+        }).encode("utf-8") + b"\n\n")
+    except (ConnectionResetError, ConnectionError):
+        pass  # client went away; stop compiling
+    return resp
@@ -9,11 +9,18 @@
 #   5. split on "Negative Prompt:" marker  (after resolution so per-option negs work)
 #   6. deduplicate() each part
 
+import copy
+import functools
+import hashlib
 import json
 import logging
 import os
 import random
 import re
+import sys
+import threading
+import time
+from collections import OrderedDict
 from pathlib import Path
 
 import yaml
@@ -25,46 +32,47 @@ logger = logging.getLogger("promptchain.compiler")
 # Comment Stripping
 # =============================================================================
 
+# One search per comment opener instead of a Python-level step per character:
+# the text between openers is copied in slices, so long prompts strip in linear
+# time. Semantics are the old char loop's, including its precedence ("/*" before
+# "//" at the same offset) and its line-start rule for "#".
+_COMMENT_OPEN_RE = re.compile(r"/\*|//|#")
+
+
 def strip_comments(text: str) -> str:
     if not text:
         return ""
 
     result = []
     cursor = 0
-    in_block = False
+    n = len(text)
 
-    while cursor < len(text):
-        if not in_block and text[cursor:cursor+2] == "/*":
-            in_block = True
-            cursor += 2
-            continue
-        if in_block and text[cursor:cursor+2] == "*/":
-            in_block = False
-            cursor += 2
+    while cursor < n:
+        m = _COMMENT_OPEN_RE.search(text, cursor)
+        if m is None:
+            result.append(text[cursor:])
+            break
+        start = m.start()
+        result.append(text[cursor:start])
+        token = m.group()
+        if token == "/*":
+            close = text.find("*/", start + 2)
+            cursor = n if close < 0 else close + 2
             continue
-        if in_block:
-            cursor += 1
+        if token == "//":
+            newline = text.find("\n", start)
+            cursor = n if newline < 0 else newline
             continue
-        if text[cursor:cursor+2] == "//":
-            while cursor < len(text) and text[cursor] != "\n":
-                cursor += 1
+        # "#" is a comment only at line start (leading spaces/tabs allowed)
+        scan = start - 1
+        while scan >= 0 and text[scan] in " \t":
+            scan -= 1
+        if scan < 0 or text[scan] == "\n":
+            newline = text.find("\n", start)
+            cursor = n if newline < 0 else newline
             continue
-        if text[cursor] == "#":
-            is_line_start = cursor == 0 or text[cursor-1] == "\n"
-            if not is_line_start:
-                scan = cursor - 1
-                while scan >= 0 and text[scan] in " \t":
-                    scan -= 1
-                is_line_start = scan < 0 or text[scan] == "\n"
-            if is_line_start:
-                while cursor < len(text) and text[cursor] != "\n":
-                    cursor += 1
-                continue
-            result.append(text[cursor])
-            cursor += 1
-            continue
-        result.append(text[cursor])
-        cursor += 1
+        result.append("#")
+        cursor = start + 1
 
     return "".join(result)
 
@@ -77,7 +85,9 @@ def strip_comments(text: str) -> str:
 # The close brace is matched by DEPTH (not the first `}`) so a wildcard or
 # <SCRIPT> brace inside a body ({a|b}) doesn't truncate the region and leak the
 # rest into the global prompt.
-_REGION_OPEN_RE = re.compile(r"\$(\w+)\s*\{")
+# Lexed in one pass: `$name{` openers and bare braces. Outside a group only an
+# opener matters; inside one, every opener or "{" nests and "}" closes.
+_REGION_TOKEN_RE = re.compile(r"\$(\w+)\s*\{|[{}]")
 
 
 def _iter_region_spans(text: str):
@@ -86,26 +96,20 @@ def _iter_region_spans(text: str):
     `$name{...}` (braces included) for removing it from the global remainder."""
     if not text or "$" not in text:
         return
-    pos = 0
-    while True:
-        m = _REGION_OPEN_RE.search(text, pos)
-        if not m:
-            return
-        depth, i = 1, m.end()
-        while i < len(text) and depth > 0:
-            c = text[i]
-            if c == "{":
-                depth += 1
-            elif c == "}":
-                depth -= 1
-            i += 1
-        if depth != 0:
-            # Unbalanced (no matching close): take the rest as the body rather
-            # than loop forever, matching the old regex's graceful give-up.
-            yield m.group(1), text[m.end():], m.start(), len(text)
-            return
-        yield m.group(1), text[m.end():i - 1], m.start(), i
-        pos = i
+    opener, depth = None, 0
+    for m in _REGION_TOKEN_RE.finditer(text):
+        if opener is None:
+            if m.group(1) is not None:
+                opener, depth = m, 1
+            continue
+        depth += -1 if m.group() == "}" else 1
+        if depth == 0:
+            yield opener.group(1), text[opener.end():m.start()], opener.start(), m.end()
+            opener = None
+    if opener is not None:
+        # Unbalanced (no matching close): take the rest as the body rather
+        # than drop it, matching the old regex's graceful give-up.
+        yield opener.group(1), text[opener.end():], opener.start(), len(text)
 
 
 def _remove_region_spans(text: str, spans) -> str:
@@ -150,14 +154,210 @@ def compile_regions(text: str, **compile_kwargs) -> dict:
     # Strip comments FIRST so example $name{} blocks in the // help scaffold
     # (e.g. "//   $alice{ red dress }") aren't extracted as real regions — that
     # turned a 2-region prompt into a 5-region mess and broke binding.
-    text = strip_comments(text or "")
-    spans = list(_iter_region_spans(text))
-    groups = [(name, body) for name, body, _s, _e in spans]
+    text, spans = _split_regions(text or "")
+    return _compile_region_spans(text, spans, compile_kwargs)
+
+
+@functools.lru_cache(maxsize=256)
+def _split_regions(text: str) -> tuple[str, tuple]:
+    """(comment-stripped text, its `$name{}` spans), memoized per text."""
+    text = strip_comments(text)
+    return text, tuple(_iter_region_spans(text))
+
+
+def compile_prompt_regions(text: str, **compile_kwargs):
+    """`compile_prompt` and `compile_regions` of the same text in one call.
+
+    Returns (positive, negative, metadata, regions). The text is compiled in
+    ONE pass: each `$name{}` body is bracketed with region markers, wildcard
+    files and braces are resolved once over the whole prompt, and the result
+    is cut at the markers into the flat prompt (bodies inline), the global
+    remainder and each region's text. Every output therefore shows the same
+    wildcard picks, and the cost is one compile however many regions there
+    are. Prompts the marked-up pass can't express — ::Label:: lines, <SCRIPT>
+    templates, a region inside a {a|b} option, a __name__ reference or a bare
+    a|b part that runs into a region's edge — take the per-piece path
+    (`compile_prompt` plus `compile_regions`), so the outputs always match it.
+    """
+    stripped, spans = _split_regions(text or "")
+    if not spans:
+        positive, negative, metadata = compile_prompt(text, **compile_kwargs)
+        return positive, negative, metadata, {"global": positive, "regions": [],
+                                              "negative": negative}
+    if SCRIPT_PATTERN.search(text) is None:
+        rng = compile_kwargs.get("rng") or random
+        state = rng.getstate()
+        result = _compile_marked_regions(text, **compile_kwargs)
+        if result is not None:
+            return result
+        # Some fallbacks are only known after drawing; rewind so the per-piece
+        # path picks exactly what it would have on its own.
+        rng.setstate(state)
+    positive, negative, metadata = compile_prompt(text, **compile_kwargs)
+    return positive, negative, metadata, _compile_region_spans(stripped, spans, compile_kwargs)
+
+
+# compile_prompt_regions' single pass. Private-use characters that can't come
+# from a prompt: region open/close, and a line break inside a region body
+# (newline->comma in the flat and global prompts, newline->space in the region).
+_REGION_OPEN = "\ue000"
+_REGION_CLOSE = "\ue001"
+_REGION_NL = "\ue002"
+_REGION_CUT_RE = re.compile("([,\ue000\ue001\ue002])")
+_REGION_MARKED_RE = re.compile("[^\ue000\ue001]*(?:\ue000[^\ue000\ue001]*\ue001[^\ue000\ue001]*)*")
+_LABEL_LINE_RE = re.compile(r"^\s*::([^:]+)::", re.MULTILINE)
+
+
+@functools.lru_cache(maxsize=256)
+def _mark_regions(text: str) -> tuple[str, tuple] | None:
+    """(comment-stripped text with each `$name{body}` replaced by its marked-up
+    body, the region names in order), memoized per text. None when a region
+    sits inside a {a|b} group, where the pick decides whether it exists."""
+    stripped, spans = _split_regions(text)
+    parts, cursor, depth = [], 0, 0
+    for _name, body, start, end in spans:
+        for brace in _BRACE_TOKEN_RE.findall(stripped, cursor, start):
+            depth = depth + 1 if brace == "{" else max(depth - 1, 0)
+        if depth:
+            return None
+        parts.append(stripped[cursor:start])
+        body = re.sub(r"\s*\n\s*", _REGION_NL, strip_region_markers(body))
+        parts.append(_REGION_OPEN + body + _REGION_CLOSE)
+        cursor = end
+    parts.append(stripped[cursor:])
+    return "".join(parts), tuple(span[0] for span in spans)
+
+
+def _compile_marked_regions(text: str, mode: str = "combine", switch_index: int = 1,
+                            load_image_prompts: dict | None = None,
+                            wildcard_modes: dict | None = None,
+                            rng: random.Random | None = None):
+    """compile_prompt_regions' result from one pass over the marked-up text,
+    or None when the prompt needs the per-piece path. `mode` and
+    `switch_index` only select ::Label:: lines, which take that path."""
+    marked = _mark_regions(text)
+    if marked is None or _LABEL_LINE_RE.search(marked[0]):
+        return None
+    marked, names = marked
+    rng = rng or random
+
+    if load_image_prompts and "__LoadImage" in marked:
+        for keyword, replacement in load_image_prompts.items():
+            marked = marked.replace(keyword, replacement)
+    if "__" in marked and _refs_cross_regions(marked):
+        return None
+    wc_results, wc_unresolved = {}, []
+    marked = expand_wildcard_files(marked, wildcard_modes=wildcard_modes,
+                                   wildcard_results=wc_results,
+                                   unresolved=wc_unresolved, rng=rng)
+    if _LABEL_LINE_RE.search(marked.replace(_REGION_NL, "\n")):
+        return None
+
+    # resolve_wildcards' combine mode over the whole prompt
+    lines = [line.strip() for line in marked.split("\n")
+             if line.strip() and not line.strip().startswith(("//", "#"))]
+    resolved = _resolve_braces(", ".join(lines), rng)
+    if resolved.count(_REGION_OPEN) != len(names) \
+            or not _REGION_MARKED_RE.fullmatch(resolved):
+        return None     # a wildcard file's braces swallowed a region
+    # A bare a|b part is cut at a region edge in the regions but not in the
+    # flat prompt (and at a body's line break only in the flat prompt), so the
+    # pieces would pick from different option lists.
+    if any("|" in token and "{" not in token
+           for token in _REGION_CUT_RE.split(resolved)[0::2]):
+        return None
+
+    flat = resolved.replace(_REGION_OPEN, "").replace(_REGION_CLOSE, "")
+    positive, negative = _finish_piece(flat.replace(_REGION_NL, ","))
+    outside = re.sub("\ue000[^\ue001]*\ue001", "", resolved)
+    g_pos, g_neg = _finish_piece(outside.replace(_REGION_NL, ","))
+    regions = []
+    bodies = re.findall("\ue000([^\ue001]*)\ue001", resolved)
+    for name, body in zip(names, bodies):
+        num = re.search(r"(\d+)$", name)
+        rid = int(num.group(1)) if num else len(regions) + 1
+        regions.append({"id": rid, "name": name,
+                        "text": _finish_piece(body.replace(_REGION_NL, " "))[0]})
+
+    metadata = {}
+    if wc_results:
+        metadata["wildcard_results"] = wc_results
+    if wc_unresolved:
+        metadata["unresolved_wildcards"] = wc_unresolved
+    return positive, negative, metadata, {"global": g_pos, "regions": regions,
+                                          "negative": g_neg}
+
+
+def _refs_cross_regions(marked: str) -> bool:
+    """Whether the flat prompt (markers dropped) or the global one (bodies
+    dropped) lexes __name__ references differently from the marked-up text,
+    e.g. `__a__$r{__b__}` reads as `__a____b__` in the flat prompt."""
+    segments = re.split("[\ue000\ue001]", marked)     # outside, body, outside, ...
+
+    def joined_refs(pieces):
+        spans, offset = [], 0
+        for piece in pieces:
+            spans.extend((offset + start, offset + end)
+                         for start, end, _name in _wildcard_refs(piece))
+            offset += len(piece)
+        return spans
+
+    for pieces in (segments, segments[0::2]):
+        whole = [(start, end) for start, end, _name in _wildcard_refs("".join(pieces))]
+        if whole != joined_refs(pieces):
+            return True
+    return False
+
+
+def _finish_piece(text: str) -> tuple[str, str]:
+    """A resolved piece of the marked-up prompt → (positive, negative): the
+    smart-join, whitespace and dedup steps compile_prompt runs after braces."""
+    parts = [part.strip() for part in text.split(",") if part.strip()]
+    text = deduplicate(re.sub(r"\s+", " ", _smart_join(parts)).strip())
+    parts = re.split(r"negative\s+prompt\s*:", text, maxsplit=1, flags=re.IGNORECASE)
+    return deduplicate(parts[0].strip()), deduplicate(parts[1].strip()) if len(parts) > 1 else ""
+
+
+def compile_batch(text: str, seeds=None, iterate=None, stream: str = "batch",
+                  regions: bool = True, **compile_kwargs):
+    """Yield one compiled variant of `text` per seed and/or iterate index.
+
+    seeds: ints; each variant draws from make_rng(seed, stream, iterate index),
+        so a batch is reproducible and matches a single compile with that rng.
+    iterate: 0-based ::Label:: indices, compiled in switch mode (what the node's
+        own-content iterate does per step). With both, every seed runs every
+        index; with neither, one variant at seed 0.
+    Yields {"seed", "iterate_index", "positive", "negative"[, "regions"]}.
+
+    The template's RNG-free work (comment strip, region scan, brace parse) is
+    memoized per text, so each variant pays only for its draws.
+    """
+    seeds = list(seeds) if seeds is not None else [0]
+    indices = list(iterate) if iterate is not None else [None]
+    for seed in seeds:
+        for index in indices:
+            kwargs = dict(compile_kwargs)
+            if index is not None:
+                kwargs["mode"] = "switch"
+                kwargs["switch_index"] = index + 1
+            kwargs["rng"] = make_rng(seed, stream, "" if index is None else index)
+            if regions:
+                pos, neg, _meta, reg = compile_prompt_regions(text, **kwargs)
+            else:
+                pos, neg, _meta = compile_prompt(text, **kwargs)
+            variant = {"seed": seed, "iterate_index": index,
+                       "positive": pos, "negative": neg}
+            if regions:
+                variant["regions"] = reg
+            yield variant
+
+
+def _compile_region_spans(text: str, spans: list, compile_kwargs: dict) -> dict:
     global_text = _remove_region_spans(text, spans) if spans else text
     g_pos, g_neg, _ = compile_prompt(global_text, **compile_kwargs)
 
     regions = []
-    for name, body in groups:
+    for name, body, _start, _end in spans:
         # A region is ONE figure's description — a continuous phrase, not a lazy
         # tag-stack. So its line breaks collapse to spaces (a wildcard or phrase
         # spread across lines reads naturally) instead of the global's
@@ -397,11 +597,13 @@ def get_wildcard_paths() -> list[Path]:
 def add_wildcard_path(path: str):
     if path not in _EXTRA_WILDCARD_PATHS:
         _EXTRA_WILDCARD_PATHS.append(path)
+        invalidate_wildcard_index()
 
 
 def remove_wildcard_path(path: str):
     if path in _EXTRA_WILDCARD_PATHS:
         _EXTRA_WILDCARD_PATHS.remove(path)
+        invalidate_wildcard_index()
 
 
 # -- Internal helpers ----------------------------------------------------------
@@ -450,6 +652,66 @@ def _dash_underscore_variants(name: str) -> list[str]:
     return variants
 
 
+# -- Parsed-file cache ---------------------------------------------------------
+# Wildcard files are re-read on every `__name__` reference, and
+# expand_wildcard_files runs up to _MAX_RECURSION passes per prompt, so a chain
+# over a big YAML tree re-parses the same file hundreds of times per compile.
+# Parsed contents are cached process-wide (the node and wildcard_api share it)
+# and invalidated by (mtime_ns, size), so an edit on disk is seen immediately.
+
+_WILDCARD_CACHE_MAX = 256
+
+_wildcard_cache: "OrderedDict[Path, tuple]" = OrderedDict()
+# {path: ((mtime_ns, size), parsed)} — parsed is the txt option list or the
+# (single-root-unwrapped) YAML/JSON data. Never handed out mutably.
+_wildcard_cache_lock = threading.Lock()
+_wildcard_cache_counts = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def _load_wildcard_cached(path: Path):
+    """Parsed contents of a wildcard file, re-read only when its stat changes.
+
+    Raises like the uncached loaders (callers keep their own except blocks).
+    """
+    version = _file_version(path)
+    with _wildcard_cache_lock:
+        entry = _wildcard_cache.get(path)
+        if entry is not None and version is not None and entry[0] == version:
+            _wildcard_cache.move_to_end(path)
+            _wildcard_cache_counts["hits"] += 1
+            return entry[1]
+        _wildcard_cache_counts["misses"] += 1
+
+    if path.suffix.lower() == ".txt":
+        parsed = tuple(_read_txt_options(path))
+    else:
+        parsed = _load_structured_data(path)
+
+    if version is not None:
+        with _wildcard_cache_lock:
+            _wildcard_cache[path] = (version, parsed)
+            _wildcard_cache.move_to_end(path)
+            while len(_wildcard_cache) > _WILDCARD_CACHE_MAX:
+                _wildcard_cache.popitem(last=False)
+                _wildcard_cache_counts["evictions"] += 1
+    return parsed
+
+
+def invalidate_wildcard_cache(path: Path | None = None):
+    """Drop one file's parsed entry (or all of them when `path` is None)."""
+    with _wildcard_cache_lock:
+        if path is None:
+            _wildcard_cache.clear()
+        else:
+            _wildcard_cache.pop(Path(path).resolve(), None)
+
+
+def wildcard_cache_stats() -> dict:
+    with _wildcard_cache_lock:
+        return {**_wildcard_cache_counts, "size": len(_wildcard_cache),
+                "max_size": _WILDCARD_CACHE_MAX}
+
+
 # -- Parsing -------------------------------------------------------------------
 
 def parse_wildcard_file(path: Path, key_path: str | None = None) -> list[str]:
@@ -470,6 +732,10 @@ def parse_wildcard_file(path: Path, key_path: str | None = None) -> list[str]:
 
 
 def _parse_txt_wildcard(path: Path) -> list[str]:
+    return list(_load_wildcard_cached(path))
+
+
+def _read_txt_options(path: Path) -> list[str]:
     raw = path.read_text(encoding="utf-8")
     cleaned = strip_comments(raw)
     lines = [line.strip() for line in cleaned.split("\n") if line.strip()]
@@ -484,7 +750,7 @@ def _parse_txt_wildcard(path: Path) -> list[str]:
 
 
 def _parse_structured_wildcard(path: Path, key_path: str | None) -> list[str]:
-    data = _load_structured_data(path)
+    data = _load_wildcard_cached(path)
     if data is None:
         return []
 
@@ -504,7 +770,7 @@ def get_wildcard_sections(path: Path) -> list[str]:
     if path.suffix.lower() not in STRUCTURED_EXTENSIONS:
         return []
     try:
-        data = _load_structured_data(path)
+        data = _load_wildcard_cached(path)
         return list(data.keys()) if isinstance(data, dict) else []
     except Exception:
         return []
@@ -516,7 +782,7 @@ def get_wildcard_info(path: Path) -> tuple[int, list[str]]:
         options = parse_wildcard_file(path)
         sections = []
         if ext in STRUCTURED_EXTENSIONS:
-            data = _load_structured_data(path)
+            data = _load_wildcard_cached(path)
             if isinstance(data, dict):
                 sections = list(data.keys())
         return len(options), sections
@@ -525,6 +791,93 @@ def get_wildcard_info(path: Path) -> tuple[int, list[str]]:
         return 0, []
 
 
+# -- Namespace index -----------------------------------------------------------
+# Resolving `__a/b/c__` used to probe the filesystem for every split depth x
+# base path x dash/underscore variant x extension — dozens of stat calls per
+# reference, per pass, which crawls on network-mounted wildcard folders. One
+# walk per base now builds {relative stem: {ext: path}}; resolution is a dict
+# lookup with the exact same precedence (deepest split, then base order, then
+# name variant, then WILDCARD_EXTENSIONS order). The walk is redone only when a
+# directory mtime moves (files added/removed/renamed) or the base paths change;
+# content edits are the parsed-file cache's job. Directory stats are themselves
+# throttled to one sweep per _INDEX_RECHECK_SECONDS.
+
+_INDEX_RECHECK_SECONDS = 1.0
+_CASE_INSENSITIVE_FS = os.path.normcase("A") == "a" or sys.platform == "darwin"
+
+_wildcard_index: dict = {"bases": None, "dirs": {}, "stems": [], "generation": 0,
+                         "checked": 0.0}
+# stems: per base, {relative stem: {ext: resolved path}} (stems casefolded on
+# case-insensitive filesystems, mirroring what is_file() used to accept)
+_wildcard_index_lock = threading.Lock()
+
+
+def _index_key(stem: str) -> str:
+    return stem.casefold() if _CASE_INSENSITIVE_FS else stem
+
+
+def _walk_wildcard_base(base: Path, dirs: dict) -> dict:
+    stems: dict[str, dict[str, Path]] = {}
+    seen_real = set()
+    for root, subdirs, files in os.walk(base, followlinks=True):
+        real = os.path.realpath(root)
+        if real in seen_real:  # symlink loop
+            subdirs[:] = []
+            continue
+        seen_real.add(real)
+        try:
+            dirs[root] = os.stat(root).st_mtime_ns
+        except OSError:
+            continue
+        for fname in files:
+            stem, ext = os.path.splitext(fname)
+            if ext.lower() not in WILDCARD_EXTENSIONS:
+                continue
+            candidate = Path(root, fname).resolve()
+            try:
+                candidate.relative_to(base)
+            except ValueError:
+                continue  # symlink escaping the wildcard root
+            rel = Path(root, stem).relative_to(base).as_posix()
+            stems.setdefault(_index_key(rel), {}).setdefault(ext.lower(), candidate)
+    return stems
+
+
+def _dirs_changed(dirs: dict) -> bool:
+    for path, mtime in dirs.items():
+        try:
+            if os.stat(path).st_mtime_ns != mtime:
+                return True
+        except OSError:
+            return True
+    return False
+
+
+def _get_wildcard_index() -> dict:
+    """The current namespace index, rebuilt if the wildcard tree changed."""
+    with _wildcard_index_lock:
+        idx = _wildcard_index
+        now = time.monotonic()
+        if idx["bases"] is not None and now - idx["checked"] < _INDEX_RECHECK_SECONDS:
+            return idx
+        bases = tuple(get_wildcard_paths())
+        if idx["bases"] == bases:
+            idx["checked"] = now
+            if not _dirs_changed(idx["dirs"]):
+                return idx
+        dirs: dict = {}
+        stems = [_walk_wildcard_base(base, dirs) if base.is_dir() else {} for base in bases]
+        idx.update(bases=bases, dirs=dirs, stems=stems, checked=now,
+                   generation=idx["generation"] + 1)
+        return idx
+
+
+def invalidate_wildcard_index():
+    """Force the next resolution to re-walk the wildcard folders."""
+    with _wildcard_index_lock:
+        _wildcard_index["bases"] = None
+
+
 # -- File resolution -----------------------------------------------------------
 
 def resolve_wildcard_name(name: str) -> tuple[Path | None, str | None]:
@@ -537,59 +890,101 @@ def resolve_wildcard_name(name: str) -> tuple[Path | None, str | None]:
     if ".." in name:
         return None, None
 
+    index = _get_wildcard_index()
     parts = name.split("/")
     for split_at in range(len(parts), 0, -1):
         file_stem = "/".join(parts[:split_at])
         key_path = "/".join(parts[split_at:]) or None
-        result = _find_wildcard_file(file_stem, key_path)
+        result = _find_wildcard_file(index, file_stem, key_path)
         if result[0] is not None:
             return result
     return None, None
 
 
-def _find_wildcard_file(file_stem: str, key_path: str | None) -> tuple[Path | None, str | None]:
-    for search_base in get_wildcard_paths():
-        result = _find_wildcard_file_in_base(search_base, file_stem, key_path)
+def _find_wildcard_file(index: dict, file_stem: str, key_path: str | None) -> tuple[Path | None, str | None]:
+    for stems in index["stems"]:
+        result = _find_wildcard_file_in_base(stems, file_stem, key_path)
         if result[0] is not None:
             return result
     return None, None
 
 
-def _find_wildcard_file_in_base(base: Path, file_stem: str, key_path: str | None) -> tuple[Path | None, str | None]:
+def _find_wildcard_file_in_base(stems: dict, file_stem: str, key_path: str | None) -> tuple[Path | None, str | None]:
     segments = file_stem.split("/")
     parent_path = "/".join(segments[:-1])
 
     for variant in _dash_underscore_variants(segments[-1]):
         relative_stem = f"{parent_path}/{variant}" if parent_path else variant
+        if relative_stem.startswith("/"):
+            continue  # absolute name: would escape the base
+        by_ext = stems.get(_index_key(Path(relative_stem).as_posix()))
+        if not by_ext:
+            continue
         for ext in WILDCARD_EXTENSIONS:
             if ext == ".txt" and key_path:
                 continue
-            candidate = (base / f"{relative_stem}{ext}").resolve()
-            try:
-                candidate.relative_to(base)
-            except ValueError:
-                continue
-            if candidate.is_file():
+            candidate = by_ext.get(ext)
+            if candidate is not None:
                 return candidate, (None if ext == ".txt" else key_path)
 
     return None, None
 
 
 # -- Expansion -----------------------------------------------------------------
+#
+# `__name__` references are lexed once per text (memoized, like the brace
+# program) and expanded level by level: a substituted option is lexed for the
+# references nested in it, but text an earlier level already scanned is not
+# rescanned — the old loop re-ran WILDCARD_PATTERN.sub over the whole string
+# on every level. That is exact: the pattern is greedy over a run of name
+# characters, so a reference always reaches the last "__" of its run, and the
+# text beside it in the run holds no "__" and doesn't touch it with "_" — no
+# reference can form across the seam of a substitution. Each level still
+# substitutes left to right, so draws happen in the old order and the output
+# is byte-identical per seed.
+
+
+@functools.lru_cache(maxsize=1024)
+def _wildcard_refs(text: str) -> tuple:
+    """(start, end, name) of each `__name__` reference in `text`."""
+    return tuple((m.start(), m.end(), m.group(1)) for m in WILDCARD_PATTERN.finditer(text))
+
 
 def expand_wildcard_files(text: str, wildcard_modes: dict | None = None,
-                          wildcard_results: dict | None = None) -> str:
+                          wildcard_results: dict | None = None,
+                          unresolved: list | None = None,
+                          rng: random.Random | None = None) -> str:
+    """Substitute `__name__` references with an option from their file.
+
+    rng: the Random instance randomized picks draw from (see `make_rng`);
+        None uses the global `random` module.
+    unresolved: optional list that receives each name that matched no file,
+        once — the diagnostics for a prompt, instead of a silent re-probe on
+        every substitution pass.
+    """
     if not text or "__" not in text:
         return text
-
-    def replace(match):
-        name = match.group(1)
-        found_path, resolved_key = resolve_wildcard_name(name)
+    rng = rng or random
+
+    # name -> (path, key) for this expansion; misses are remembered too so a
+    # dangling reference is looked up once, not once per pass.
+    resolved: dict[str, tuple] = {}
+
+    def replace(name: str):
+        """The substitution for `__name__`, or None to leave it as written."""
+        if name not in resolved:
+            resolved[name] = resolve_wildcard_name(name)
+            if resolved[name][0] is None and unresolved is not None \
+                    and name not in unresolved:
+                unresolved.append(name)
+        found_path, resolved_key = resolved[name]
         if found_path is None:
-            return match.group(0)
+            _note_unresolved()
+            return None
+        _note_file(found_path)
         options = parse_wildcard_file(found_path, resolved_key)
         if not options:
-            return match.group(0)
+            return None
 
         # check per-wildcard mode override
         if wildcard_modes:
@@ -606,7 +1001,8 @@ def expand_wildcard_files(text: str, wildcard_modes: dict | None = None,
                 # "randomize" falls through to random pick below
 
         # randomize: pick now and track the result
-        selected_idx = random.randint(0, len(options) - 1)
+        _note_draw(len(options))
+        selected_idx = rng.randint(0, len(options) - 1)
         selected = options[selected_idx]
         if wildcard_results is not None:
             # clean label: strip weight syntax for display
@@ -620,11 +1016,26 @@ def expand_wildcard_files(text: str, wildcard_modes: dict | None = None,
             }
         return selected
 
+    fresh = [(0, len(text))]    # spans of `text` to lex for references
     for _ in range(_MAX_RECURSION):
-        expanded = WILDCARD_PATTERN.sub(replace, text)
-        if expanded == text:
+        parts, subs, cursor, size, changed = [], [], 0, 0, False
+        for lo, hi in fresh:
+            for start, end, name in _wildcard_refs(text[lo:hi]):
+                sub = replace(name)
+                if sub is None:
+                    continue
+                parts.append(text[cursor:lo + start])
+                size += lo + start - cursor
+                subs.append((size, size + len(sub)))
+                parts.append(sub)
+                size += len(sub)
+                changed = changed or sub != text[lo + start:lo + end]
+                cursor = lo + end
+        parts.append(text[cursor:])
+        text = "".join(parts)
+        if not changed:
             break
-        text = expanded
+        fresh = subs
 
     return text
 
@@ -633,30 +1044,116 @@ def expand_wildcard_files(text: str, wildcard_modes: dict | None = None,
 # Brace Wildcard Resolution
 # =============================================================================
 
-def _resolve_braces(text: str) -> str:
-    for _ in range(100):
-        match = re.search(r"\{([^{}]+)\}", text)
-        if not match:
-            break
-        # Strip whitespace AND leading/trailing commas off each option. Lines are
-        # comma-joined before braces resolve, so a multi-line wildcard can hand us
-        # ", red" or "blue,"; internal commas (a multi-tag option like "a, b") are
-        # kept so {a⏎b|c⏎d} resolves to "a, b" / "c, d".
-        options = [o for o in (opt.strip(" \t\r\n,") for opt in match.group(1).split("|")) if o]
-        replacement = random.choice(options) if options else ""
-        text = text[:match.start()] + replacement + text[match.end():]
-    return text.strip()
+# {a|b|c} groups are parsed once into a postfix program and evaluated in a
+# single pass. The old implementation re-ran `re.search(r"\{([^{}]+)\}")` over
+# the whole string after every substitution (up to _MAX_BRACE_GROUPS times),
+# i.e. O(length x groups). Evaluation order is that loop's order exactly — it
+# always resolved the leftmost brace-free group, which is the group whose "}"
+# comes first, so groups resolve in closing-brace order and draw from the RNG
+# in the same sequence: for a given seed the output is byte-identical.
+#
+# Edge cases carried over from the regex: an empty group "{}" (or one whose
+# options are all blank after resolution leaves it empty) never matched and
+# stays literal, which also keeps every enclosing group literal; an unmatched
+# "{" or "}" is plain text; only the first _MAX_BRACE_GROUPS groups resolve.
+
+_MAX_BRACE_GROUPS = 100
+_BRACE_TOKEN_RE = re.compile(r"[{}]")
+
+# postfix ops
+_OP_TEXT = 0       # (op, text)        push literal text
+_OP_GROUP = 1      # (op, n_items)     pop n, push resolved choice (or literal)
+_OP_UNCLOSED = 2   # (op, n_items)     pop n, push "{" + joined (unmatched open)
+
+
+class BraceTemplate:
+    """A brace-parsed prompt fragment, reusable across many RNG draws."""
+
+    __slots__ = ("ops", "groups")
+
+    def __init__(self, text: str):
+        ops = []
+        counts = [0]  # items emitted at each open depth (root first)
+        cursor = 0
+        for m in _BRACE_TOKEN_RE.finditer(text):
+            if m.start() > cursor:
+                ops.append((_OP_TEXT, text[cursor:m.start()]))
+                counts[-1] += 1
+            cursor = m.end()
+            if m.group() == "{":
+                counts.append(0)
+            elif len(counts) > 1:
+                ops.append((_OP_GROUP, counts.pop()))
+                counts[-1] += 1
+            else:
+                ops.append((_OP_TEXT, "}"))  # stray close
+                counts[-1] += 1
+        if cursor < len(text):
+            ops.append((_OP_TEXT, text[cursor:]))
+            counts[-1] += 1
+        while len(counts) > 1:
+            ops.append((_OP_UNCLOSED, counts.pop()))
+            counts[-1] += 1
+        self.ops = ops
+        self.groups = sum(1 for op in ops if op[0] == _OP_GROUP)
+
+    def render(self, rng: random.Random | None = None) -> str:
+        rng = rng or random
+        stack: list[tuple[str, bool]] = []  # (text, literal-braces-inside)
+        resolved = 0
+        for op, arg in self.ops:
+            if op == _OP_TEXT:
+                stack.append((arg, False))
+                continue
+            items = stack[len(stack) - arg:]
+            del stack[len(stack) - arg:]
+            content = "".join(t for t, _ in items)
+            blocked = any(b for _, b in items)
+            if op == _OP_UNCLOSED:
+                stack.append(("{" + content, True))
+            elif blocked or not content or resolved >= _MAX_BRACE_GROUPS:
+                stack.append(("{" + content + "}", True))
+            else:
+                resolved += 1
+                stack.append((_choose_brace_option(content, rng), False))
+        return "".join(t for t, _ in stack).strip()
+
+
+def _choose_brace_option(content: str, rng) -> str:
+    # Strip whitespace AND leading/trailing commas off each option. Lines are
+    # comma-joined before braces resolve, so a multi-line wildcard can hand us
+    # ", red" or "blue,"; internal commas (a multi-tag option like "a, b") are
+    # kept so {a⏎b|c⏎d} resolves to "a, b" / "c, d".
+    # _REGION_NL is a region body's line break in compile_prompt_regions' pass.
+    options = [o for o in (opt.strip(" \t\r\n," + _REGION_NL) for opt in content.split("|")) if o]
+    _note_draw(len(options))
+    return rng.choice(options) if options else ""
+
+
+@functools.lru_cache(maxsize=256)
+def _brace_template(text: str) -> BraceTemplate:
+    # Parsed once per distinct text: a batch of seeds over one template, or a
+    # chain re-queued unchanged, renders the same program with new draws.
+    return BraceTemplate(text)
 
 
-def resolve_wildcards(text: str, mode: str = "combine", switch_index: int = 1):
+def _resolve_braces(text: str, rng: random.Random | None = None) -> str:
+    if "{" not in text:
+        return text.strip()
+    return _brace_template(text).render(rng)
+
+
+def resolve_wildcards(text: str, mode: str = "combine", switch_index: int = 1,
+                      rng: random.Random | None = None):
     """Returns string, or (string, selected_index) tuple in roll mode."""
     if not text or not text.strip():
         return ""
+    rng = rng or random
 
     # handle <SCRIPT> template blocks
     template, prompt_text = _process_script_template(text)
     if template is not None:
-        resolved = resolve_wildcards(prompt_text, mode, switch_index) if prompt_text else ""
+        resolved = resolve_wildcards(prompt_text, mode, switch_index, rng) if prompt_text else ""
         roll_idx = None
         if isinstance(resolved, tuple):
             resolved, roll_idx = resolved
@@ -697,11 +1194,12 @@ def resolve_wildcards(text: str, mode: str = "combine", switch_index: int = 1):
             else:
                 return ""
         else:
-            selected_idx = random.randint(0, len(label_lines) - 1)
+            _note_draw(len(label_lines))
+            selected_idx = rng.randint(0, len(label_lines) - 1)
             selected_line = label_lines[selected_idx]
 
         selected_line = re.sub(r"^::([^:]+)::\s*", "", selected_line)
-        resolved = _resolve_braces(selected_line)
+        resolved = _resolve_braces(selected_line, rng)
         if mode == "roll":
             return (resolved, selected_idx + 1)
         return resolved
@@ -712,7 +1210,7 @@ def resolve_wildcards(text: str, mode: str = "combine", switch_index: int = 1):
 
     # combine mode: join all lines, resolve braces
     all_text = ", ".join(lines)
-    resolved = _resolve_braces(all_text)
+    resolved = _resolve_braces(all_text, rng)
 
     parts = [part.strip() for part in resolved.split(",") if part.strip()]
     processed = []
@@ -720,7 +1218,8 @@ def resolve_wildcards(text: str, mode: str = "combine", switch_index: int = 1):
         if "|" in part and "{" not in part:
             options = [opt.strip() for opt in part.split("|") if opt.strip()]
             if options:
-                part = random.choice(options)
+                _note_draw(len(options))
+                part = rng.choice(options)
         processed.append(part)
 
     return _smart_join(processed)
@@ -747,21 +1246,48 @@ def _process_script_template(text: str):
     return template, "\n".join(prompt_parts) if prompt_parts else ""
 
 
+# =============================================================================
+# Random Streams
+# =============================================================================
+# Every pick (brace options, randomized __wildcards__, roll labels) draws from
+# an explicit Random instance threaded through the pipeline, never from the
+# process-global `random` module: another custom node reseeding or drawing
+# from `random` can't perturb a compile, and independent compiles can run
+# interleaved or on other threads with the same results as serially.
+
+def make_rng(seed: int | None = None, *stream) -> random.Random:
+    """A Random for one compile.
+
+    seed None: fresh OS entropy (the node's reshuffle-every-queue behavior).
+    Otherwise the stream is derived from (seed, *stream) — e.g. (seed, node_id,
+    iteration) — via SHA-256, so every node/iteration gets its own independent,
+    reproducible sequence rather than all sharing one seeded generator.
+    """
+    if seed is None:
+        return random.Random()
+    material = ":".join(str(part) for part in (seed, *stream)).encode("utf-8")
+    return random.Random(int.from_bytes(hashlib.sha256(material).digest()[:8], "big"))
+
+
 # =============================================================================
 # Full Compilation Pipeline
 # =============================================================================
 
 def compile_prompt(text: str, mode: str = "combine", switch_index: int = 1,
                    load_image_prompts: dict | None = None,
-                   wildcard_modes: dict | None = None):
+                   wildcard_modes: dict | None = None,
+                   rng: random.Random | None = None):
     """Returns (positive, negative, metadata).
 
     load_image_prompts: optional dict mapping keywords like
         "__LoadImagePositive__" / "__LoadImageNegative__" to replacement text.
     wildcard_modes: optional dict mapping wildcard names to mode overrides,
         e.g. {"creatures": {"mode": "switch", "index": 2}}.
+    rng: Random instance every pick draws from (see `make_rng`). None falls
+        back to the global `random` module (legacy callers / scripts).
     metadata includes wildcard_results: dict mapping wildcard names to
-        {"index": N, "label": "..."} for randomly picked options.
+        {"index": N, "label": "..."} for randomly picked options, and
+        unresolved_wildcards: names that matched no wildcard file.
     """
     if not text:
         return "", "", {}
@@ -770,14 +1296,19 @@ def compile_prompt(text: str, mode: str = "combine", switch_index: int = 1,
     # BEFORE splitting on "Negative Prompt:" so per-option negatives stay
     # paired with their positive text.
     wc_results = {}
+    wc_unresolved = []
     result = _process_part(text, mode=mode, switch_index=switch_index,
                            load_image_prompts=load_image_prompts,
                            wildcard_modes=wildcard_modes,
-                           wildcard_results=wc_results)
+                           wildcard_results=wc_results,
+                           unresolved=wc_unresolved,
+                           rng=rng)
 
     metadata = {}
     if wc_results:
         metadata["wildcard_results"] = wc_results
+    if wc_unresolved:
+        metadata["unresolved_wildcards"] = wc_unresolved
     if isinstance(result, tuple):
         resolved, roll_selected = result
         metadata["roll_selected"] = roll_selected
@@ -796,18 +1327,26 @@ def compile_prompt(text: str, mode: str = "combine", switch_index: int = 1,
     return positive, negative, metadata
 
 
+@functools.lru_cache(maxsize=256)
+def _prepare_part(text: str) -> tuple[bool, str]:
+    """The RNG-free front of the pipeline, memoized per template text."""
+    has_script = SCRIPT_PATTERN.search(text) is not None
+    text = strip_comments(text)
+    # Flat output keeps region bodies inline (braces removed) so non-regional
+    # use is unchanged; the regional path calls compile_regions instead.
+    return has_script, strip_region_markers(text)
+
+
 def _process_part(text: str, mode: str = "combine", switch_index: int = 1,
                    load_image_prompts: dict | None = None,
                    wildcard_modes: dict | None = None,
-                   wildcard_results: dict | None = None):
+                   wildcard_results: dict | None = None,
+                   unresolved: list | None = None,
+                   rng: random.Random | None = None):
     if not text:
         return ""
 
-    has_script = SCRIPT_PATTERN.search(text) is not None
-    text = strip_comments(text)
-    # Flat output keeps region bodies inline (braces removed) so non-regional
-    # use is unchanged; the regional path calls compile_regions instead.
-    text = strip_region_markers(text)
+    has_script, text = _prepare_part(text)
 
     # resolve __LoadImagePositive__ / __LoadImageNegative__ before wildcard
     # expansion so they don't get misidentified as wildcard file references
@@ -817,9 +1356,11 @@ def _process_part(text: str, mode: str = "combine", switch_index: int = 1,
                 text = text.replace(keyword, replacement)
 
     text = expand_wildcard_files(text, wildcard_modes=wildcard_modes,
-                                 wildcard_results=wildcard_results)
+                                 wildcard_results=wildcard_results,
+                                 unresolved=unresolved,
+                                 rng=rng)
 
-    result = resolve_wildcards(text, mode=mode, switch_index=switch_index)
+    result = resolve_wildcards(text, mode=mode, switch_index=switch_index, rng=rng)
 
     roll_idx = None
     if isinstance(result, tuple):
@@ -836,3 +1377,137 @@ def _process_part(text: str, mode: str = "combine", switch_index: int = 1,
     if roll_idx is not None:
         return (text, roll_idx)
     return text
+
+
+# =============================================================================
+# Compile Cache
+# =============================================================================
+# The node re-executes on every queue (fingerprint_inputs is NaN so wildcards
+# reshuffle), but most chains in a batch are fully deterministic: no {a|b}
+# with more than one option, no randomized __wildcard__, no roll. Those compile
+# to the same text every time, so the result is cached on the compile inputs.
+#
+# Determinism is observed, not guessed: every random pick goes through
+# _note_draw(), and a compile that drew from the RNG (or hit an unresolved
+# __name__ that a new file could satisfy later) is never stored. Wildcard files
+# the compile read are stored with their (mtime_ns, size) and re-stat'ed on a
+# hit, so editing a wildcard file invalidates every prompt that used it; a
+# namespace-index rebuild (a file added or removed, which can change what a
+# name resolves to) invalidates every entry that read wildcard files at all.
+
+_COMPILE_CACHE_MAX = 512
+
+_compile_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+# {key: (result, ((path, (mtime_ns, size)), ...), index generation)}
+_compile_cache_lock = threading.Lock()
+_compile_cache_counts = {"hits": 0, "misses": 0, "uncacheable": 0}
+
+_trace = threading.local()
+
+
+def _note_draw(n_options: int):
+    trace = getattr(_trace, "active", None)
+    if trace is not None and n_options > 1:
+        trace["draws"] += 1
+
+
+def _note_unresolved():
+    trace = getattr(_trace, "active", None)
+    if trace is not None:
+        trace["unresolved"] = True
+
+
+def _note_file(path: Path):
+    trace = getattr(_trace, "active", None)
+    if trace is not None and path not in trace["files"]:
+        trace["files"][path] = _file_version(path)
+
+
+def _file_version(path: Path):
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _freeze(value):
+    """Hashable, order-independent form of a compile kwarg (dicts from JSON)."""
+    if isinstance(value, dict):
+        return tuple(sorted((str(k), _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _cached_compile(kind: str, fn, text: str, kwargs: dict):
+    # the RNG only matters to compiles that draw from it, and those are never
+    # stored — it is not part of the key
+    key = (kind, text, _freeze({k: v for k, v in kwargs.items() if k != "rng"}))
+    with _compile_cache_lock:
+        entry = _compile_cache.get(key)
+    if entry is not None:
+        result, files, generation = entry
+        if (not files or _get_wildcard_index()["generation"] == generation) \
+                and all(_file_version(path) == version for path, version in files):
+            with _compile_cache_lock:
+                if key in _compile_cache:
+                    _compile_cache.move_to_end(key)
+                _compile_cache_counts["hits"] += 1
+            return copy.deepcopy(result)
+        with _compile_cache_lock:
+            _compile_cache.pop(key, None)
+
+    outer = getattr(_trace, "active", None)
+    trace = {"draws": 0, "unresolved": False, "files": {}}
+    _trace.active = trace
+    try:
+        result = fn(text, **kwargs)
+    finally:
+        _trace.active = outer
+    generation = _wildcard_index["generation"]
+    if outer is not None:
+        outer["draws"] += trace["draws"]
+        outer["unresolved"] = outer["unresolved"] or trace["unresolved"]
+        for path, version in trace["files"].items():
+            outer["files"].setdefault(path, version)
+
+    with _compile_cache_lock:
+        _compile_cache_counts["misses"] += 1
+        if trace["draws"] or trace["unresolved"]:
+            _compile_cache_counts["uncacheable"] += 1
+            return result
+        _compile_cache[key] = (copy.deepcopy(result), tuple(trace["files"].items()),
+                               generation)
+        _compile_cache.move_to_end(key)
+        while len(_compile_cache) > _COMPILE_CACHE_MAX:
+            _compile_cache.popitem(last=False)
+    return result
+
+
+def compile_prompt_cached(text: str, **kwargs):
+    """`compile_prompt` through the compile cache — same args, same result."""
+    return _cached_compile("prompt", compile_prompt, text, kwargs)
+
+
+def compile_regions_cached(text: str, **kwargs) -> dict:
+    """`compile_regions` through the compile cache — same args, same result."""
+    return _cached_compile("regions", compile_regions, text, kwargs)
+
+
+def compile_prompt_regions_cached(text: str, **kwargs):
+    """`compile_prompt_regions` through the compile cache."""
+    return _cached_compile("prompt+regions", compile_prompt_regions, text, kwargs)
+
+
+def compile_cache_stats() -> dict:
+    with _compile_cache_lock:
+        return {**_compile_cache_counts, "size": len(_compile_cache),
+                "max_size": _COMPILE_CACHE_MAX}
+
+
+def clear_compile_cache():
+    with _compile_cache_lock:
+        _compile_cache.clear()
+        for k in _compile_cache_counts:
+            _compile_cache_counts[k] = 0
@@ -55,3 +55,34 @@ def set_ai_setup_dismissed():
     config = load()
     config["ai_setup_dismissed"] = True
     save(config)
+
+
+# Opt-in: load the user tag CSVs as they are and run the system → user sync
+# on a background thread afterwards, so tag routes answer before the sync's
+# hashing/copying finishes. First boot still syncs inline (nothing to load).
+def is_tag_sync_background() -> bool:
+    return bool(load().get("tag_sync_background", False))
+
+
+# Storage precision for the embedding search indexes (tag, bucket,
+# modifier): "float32" (exact), "float16" (half the memory) or "int8"
+# (a quarter, per-row scaled). See scripts/eval_embed_quant.py for the
+# rank agreement each gives.
+EMBED_INDEX_DTYPES = ("float32", "float16", "int8")
+
+
+def embed_index_dtype() -> str:
+    value = load().get("embed_index_dtype", "float32")
+    return value if value in EMBED_INDEX_DTYPES else "float32"
+
+
+# Runtime for the bge-small encoder: "torch" (default; CUDA when there),
+# "onnx" (ONNX Runtime CPU, exported graph) or "onnx-int8" (the same graph
+# dynamically quantized). Falls back to torch when onnxruntime is missing.
+# See scripts/test_embed_onnx_parity.py and scripts/bench_embed_backends.py.
+EMBED_BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def embed_backend() -> str:
+    value = load().get("embed_backend", "torch")
+    return value if value in EMBED_BACKENDS else "torch"
@@ -0,0 +1,271 @@
+"""
+Write-generation counter for the tag-builder SQLite DB.
+
+The search modules validate their indexes against a fingerprint of the
+tables they embed (aggregates over the rows, plus DDL and the alias seed
+sync for tag_search). Computing that on every search put a metadata
+round-trip ahead of every query. This module gives them a token that
+changes whenever the DB can have been written, cheap enough (one stat
+and one PRAGMA, microseconds) to compare per call:
+
+  * `PRAGMA data_version` on a private read-only connection — SQLite bumps
+    it whenever *another* connection commits to the file, in this process
+    or any other, in rollback-journal and WAL mode alike.
+  * (inode, size, mtime_ns) of the DB file — catches the file being
+    replaced wholesale (git pull, restore), which leaves the private
+    connection reading the old inode; it is reopened then. (The -wal file
+    isn't stat'ed: opening a reader recreates it, and data_version already
+    covers WAL commits.)
+
+`FingerprintGate` caches an expensive fingerprint function behind that
+token: the fingerprint runs again only once the token moves.
+
+`ReadConnections` hands out a reused read-only connection per thread (the
+searches' hit hydration used to open one connection per hit), and
+`rows_by_key` fetches many rows in a few `IN (...)` queries.
+
+`SearchStats` is the per-search overhead breakdown (freshness check /
+query embed / scoring / hydration) each search module records into;
+`all_search_stats()` backs GET /promptchain/ai/search-stats.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable
+
+TAG_BUILDER_DB = Path(__file__).resolve().parent.parent / "data" / "tag-builder" / "tag-builder.db"
+
+
+class DBGeneration:
+    """`current()` returns a token that differs whenever the DB at `path`
+    may have changed since the last call that returned an equal token."""
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self._ino: int | None = None
+
+    def _stat(self, path: Path) -> tuple:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return ()
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def current(self) -> tuple | None:
+        """Generation token, or None when the DB can't be read (callers
+        then fall back to computing their fingerprint)."""
+        db = self._stat(self._path)
+        if not db:
+            return None
+        with self._lock:
+            try:
+                if self._conn is None or self._ino != db[0]:
+                    self._reopen(db[0])
+                version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            except sqlite3.Error:
+                self._close()
+                return None
+        return (db, version)
+
+    def _reopen(self, ino: int) -> None:
+        self._close()
+        self._conn = sqlite3.connect(f"{self._path.resolve().as_uri()}?mode=ro",
+                                     uri=True, check_same_thread=False)
+        self._ino = ino
+
+    def _close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+        self._conn = None
+        self._ino = None
+
+
+_tag_builder_generation: DBGeneration | None = None
+_generation_lock = threading.Lock()
+
+
+def tag_builder_generation() -> DBGeneration:
+    """The process-wide generation counter for tag-builder.db (one private
+    connection shared by every search module)."""
+    global _tag_builder_generation
+    with _generation_lock:
+        if _tag_builder_generation is None:
+            _tag_builder_generation = DBGeneration(TAG_BUILDER_DB)
+        return _tag_builder_generation
+
+
+class ReadConnections:
+    """Per-thread read-only connections to the SQLite file at `path`,
+    reused across calls. A connection is reopened when the file's inode
+    changes (replaced by a git pull / restore) — an open handle would keep
+    reading the old file. Commits from other connections are visible to
+    the next statement as usual; nothing here caches rows."""
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.opens = 0
+
+    def get(self) -> sqlite3.Connection:
+        """The calling thread's connection. Raises sqlite3.Error (or
+        OSError) when the DB can't be opened — callers already handle
+        DB errors."""
+        ino = os.stat(self._path).st_ino
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.ino == ino:
+            return conn
+        if conn is not None:
+            try:
+                conn.close()
+            except sqlite3.Error:
+                pass
+        conn = sqlite3.connect(f"{self._path.resolve().as_uri()}?mode=ro", uri=True)
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = lambda b: b.decode("utf-8", "replace")
+        self._local.conn, self._local.ino = conn, ino
+        with self._lock:
+            self.opens += 1
+        return conn
+
+
+_tag_builder_reads: ReadConnections | None = None
+
+
+def tag_builder_reads() -> ReadConnections:
+    """Process-wide read-only connections to tag-builder.db."""
+    global _tag_builder_reads
+    with _generation_lock:
+        if _tag_builder_reads is None:
+            _tag_builder_reads = ReadConnections(TAG_BUILDER_DB)
+        return _tag_builder_reads
+
+
+# SQLite's default host-parameter cap is 999 on older builds.
+_IN_CHUNK = 500
+
+
+def rows_by_key(conn: sqlite3.Connection, sql: str, keys: list) -> list:
+    """Run `sql` — containing one `IN ({})` — over `keys` in chunks and
+    return every row. Keys are de-duplicated; row order across chunks
+    follows the chunks."""
+    keys = list(dict.fromkeys(keys))
+    out: list = []
+    for i in range(0, len(keys), _IN_CHUNK):
+        chunk = keys[i:i + _IN_CHUNK]
+        out.extend(conn.execute(sql.format(", ".join("?" * len(chunk))), chunk).fetchall())
+    return out
+
+
+class FingerprintGate:
+    """Memoizes `compute()` until `generation` moves. A None token (DB
+    unreadable) always recomputes — the fingerprint's own error handling
+    decides what that means."""
+
+    def __init__(self, generation: DBGeneration, compute: Callable[[], Any]):
+        self._generation = generation
+        self._compute = compute
+        self._lock = threading.Lock()
+        self._token: tuple | None = None
+        self._value: Any = None
+        self._counts = {"checks": 0, "recomputes": 0}
+
+    def get(self) -> Any:
+        # Token first, then compute: a write landing in between leaves a
+        # stale token, so the next call recomputes rather than missing it.
+        token = self._generation.current()
+        with self._lock:
+            self._counts["checks"] += 1
+            if token is not None and token == self._token:
+                return self._value
+        value = self._compute()
+        with self._lock:
+            self._counts["recomputes"] += 1
+            self._token, self._value = token, value
+        return value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._token = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._counts)
+
+
+# ── per-search overhead ──────────────────────────────────────────
+
+_registry: dict[str, "SearchStats"] = {}
+
+
+class SearchStats:
+    """Per-phase wall time of one search module's searches. Usage:
+
+        run = _stats.start()
+        ...freshness check...;  run.lap("fresh")
+        ...embed the query...;  run.lap("embed")
+        run.finish()            # records the run
+
+    Runs that return early (no model, empty index) aren't recorded."""
+
+    def __init__(self, name: str, extra: Callable[[], dict] | None = None):
+        self.name = name
+        self._extra = extra
+        self._lock = threading.Lock()
+        self._count = 0
+        self._total: dict[str, float] = {}
+        self._last: dict[str, float] = {}
+        _registry[name] = self
+
+    def start(self) -> "_SearchRun":
+        return _SearchRun(self)
+
+    def _record(self, laps: dict[str, float]) -> None:
+        with self._lock:
+            self._count += 1
+            for phase, ms in laps.items():
+                self._total[phase] = self._total.get(phase, 0.0) + ms
+            self._last = laps
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            n = self._count
+            out = {
+                "searches": n,
+                "mean_ms": {p: round(t / n, 3) for p, t in self._total.items()} if n else {},
+                "last_ms": {p: round(t, 3) for p, t in self._last.items()},
+            }
+        if self._extra is not None:
+            out.update(self._extra())
+        return out
+
+
+class _SearchRun:
+    def __init__(self, stats: SearchStats):
+        self._stats = stats
+        self._t = time.perf_counter()
+        self._laps: dict[str, float] = {}
+
+    def lap(self, phase: str) -> None:
+        now = time.perf_counter()
+        self._laps[phase] = self._laps.get(phase, 0.0) + (now - self._t) * 1000.0
+        self._t = now
+
+    def finish(self) -> dict[str, float]:
+        laps = dict(self._laps)
+        laps["total"] = sum(laps.values())
+        self._stats._record(laps)
+        return laps
+
+
+def all_search_stats() -> dict:
+    return {name: stats.snapshot() for name, stats in sorted(_registry.items())}
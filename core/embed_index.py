@@ -0,0 +1,406 @@
+"""
+Memory-mapped on-disk embedding index.
+
+`tag_search` used to `np.load` its whole [N, 384] matrix, parse every line
+of rows.jsonl into a dict and copy the lot onto the model's device — each
+ComfyUI process paying the RAM and the parse on every start. This format
+is opened instead of loaded:
+
+    manifest.json  caller fields + {format, rowcount, dim, dtype, data_dir}
+    data-<id>/     one generation of the index:
+      vectors.bin  row-major [N, dim] little-endian float32, float16 or
+                   int8, no header — row i starts at i * dim * itemsize
+      scales.bin   int8 only: float32 [N] per-row scale
+      hashes.bin   optional uint64 [N] content hash of each row's embedded
+                   text (`content_hash`), for incremental re-embedding
+      rows.bin     concatenated UTF-8 JSON objects, one per row
+      rows.idx     little-endian uint64 offsets [N + 1] into rows.bin
+
+Both data files are mapped read-only, so processes on one host share the
+page cache and opening costs a few stats and mmaps, not a parse. Rows are
+decoded only when `row(i)` asks — a search materializes its hits, nothing
+else. A write fills a fresh data-<id>/ and then swaps manifest.json (one
+rename) to point at it, so a reader in any process sees the old
+generation or the new one, never a mix. Superseded generations are
+pruned by later writes once they are older than the current one and
+untouched for `_PRUNE_GRACE_S` — several processes can share a cache
+dir, and a generation another process is still writing, or has only
+just published, must survive (an open mapping stays valid on its inode).
+
+Incremental rebuilds: `reuse_vectors` keeps the vector of every row whose
+content hash the previous index already has and embeds only the rest.
+`sync_index` wraps the whole cycle for callers whose rows are cheap to
+read back from the DB (bucket_search, modifier_search): map the cache
+when its content fingerprint matches, otherwise patch it and write a new
+generation.
+
+Quantized storage: float16 halves the matrix, int8 quarters it (each row
+scaled by max|x| / 127, scale kept in float32). Scoring dequantizes a
+chunk of rows at a time, so the float32 matrix never exists in full. The
+in-memory indexes (bucket_search, modifier_search) use the same class via
+`from_memory` when their cache dir isn't writable.
+scripts/eval_embed_quant.py measures rank agreement.
+
+numpy only; the query side hands in float32 vectors.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import mmap
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any
+
+logger = logging.getLogger("promptchain.embed_index")
+
+FORMAT = "mmap-v1"
+VECTORS_FILE = "vectors.bin"
+SCALES_FILE = "scales.bin"
+HASHES_FILE = "hashes.bin"
+ROWS_FILE = "rows.bin"
+OFFSETS_FILE = "rows.idx"
+MANIFEST_FILE = "manifest.json"
+
+_DTYPES = {"float32": "<f4", "float16": "<f2", "int8": "i1"}
+DTYPES = tuple(_DTYPES)
+
+# Higher keeps more of the embedding: converting a cache down the list is
+# a requantize, converting up needs the float32 source (a re-embed).
+PRECISION = {"int8": 0, "float16": 1, "float32": 2}
+
+# Quantized rows are dequantized this many at a time for the dot product —
+# numpy's half/int matmul is slow and upcasting the whole matrix would
+# undo the point of storing it small.
+_SCORE_CHUNK = 8192
+
+# A generation nobody has written to for this long, and older than the
+# one the manifest points at, is no longer being built or published.
+_PRUNE_GRACE_S = 600.0
+
+
+def content_hash(text: str) -> int:
+    """64-bit hash of the text a row was embedded from."""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(),
+                          "little")
+
+
+def content_fingerprint(rows: list[dict], texts: list[str]) -> str:
+    """Digest of every row dict and embedded text, in order. Catches edits
+    a (MAX(rowid), COUNT(*)) signature can't see."""
+    h = hashlib.blake2b(digest_size=16)
+    for row, text in zip(rows, texts):
+        h.update(json.dumps(row, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+        h.update(b"\0")
+        h.update(text.encode("utf-8"))
+        h.update(b"\0")
+    h.update(str(len(rows)).encode("ascii"))
+    return h.hexdigest()
+
+
+def quantize(vectors, dtype: str):
+    """(stored array, per-row scales or None) for `vectors` in `dtype`."""
+    import numpy as np
+
+    arr = np.asarray(vectors, dtype=np.float32)
+    if dtype == "int8":
+        scales = np.abs(arr).max(axis=1) / 127.0 if arr.size else np.zeros(len(arr))
+        scales = np.where(scales > 0, scales, 1.0).astype(np.float32)
+        q = np.clip(np.rint(arr / scales[:, None]), -127, 127).astype(np.int8)
+        return q, scales
+    return np.ascontiguousarray(arr.astype(_DTYPES[dtype])), None
+
+
+def read_manifest(directory: Path) -> dict | None:
+    """The manifest dict, or None when missing/unreadable/another format."""
+    try:
+        manifest = json.loads((directory / MANIFEST_FILE).read_text(encoding="utf-8"))
+    except Exception:
+        return None
+    if not isinstance(manifest, dict) or manifest.get("format") != FORMAT:
+        return None
+    return manifest
+
+
+def write_index(directory: Path, vectors, rows: list[dict], manifest: dict,
+                dtype: str = "float32", hashes: list[int] | None = None) -> None:
+    """Persist `vectors` ([N, dim] array-like, float32 values) and `rows`
+    (N dicts) under `directory`, stored as `dtype`, as a new generation.
+    `manifest` carries the caller's validity fields (model, fingerprint,
+    ...); the format fields are added here. `hashes` (N content hashes)
+    enables `reuse_vectors` on the next rebuild."""
+    import numpy as np
+
+    arr, scales = quantize(vectors, dtype)
+    if arr.ndim != 2 or arr.shape[0] != len(rows):
+        raise ValueError(f"vectors {arr.shape} do not match {len(rows)} rows")
+    if hashes is not None and len(hashes) != len(rows):
+        raise ValueError(f"{len(hashes)} hashes do not match {len(rows)} rows")
+    data_dir = f"data-{uuid.uuid4().hex[:12]}"
+    gen = directory / data_dir
+    gen.mkdir(parents=True)
+    try:
+        (gen / VECTORS_FILE).write_bytes(np.ascontiguousarray(arr).tobytes())
+        if scales is not None:
+            (gen / SCALES_FILE).write_bytes(scales.astype("<f4").tobytes())
+        if hashes is not None:
+            (gen / HASHES_FILE).write_bytes(np.asarray(hashes, dtype="<u8").tobytes())
+        offsets = np.zeros(len(rows) + 1, dtype="<u8")
+        with open(gen / ROWS_FILE, "wb") as f:
+            pos = 0
+            for i, row in enumerate(rows):
+                blob = json.dumps(row, ensure_ascii=False).encode("utf-8")
+                f.write(blob)
+                pos += len(blob)
+                offsets[i + 1] = pos
+        (gen / OFFSETS_FILE).write_bytes(offsets.tobytes())
+
+        full = dict(manifest)
+        full.update({"format": FORMAT, "rowcount": int(arr.shape[0]),
+                     "dim": int(arr.shape[1]), "dtype": dtype, "data_dir": data_dir})
+        _replace_bytes(directory / MANIFEST_FILE,
+                       json.dumps(full, indent=2).encode("utf-8"))
+    except BaseException:
+        shutil.rmtree(gen, ignore_errors=True)
+        raise
+    _prune_generations(directory)
+
+
+def _last_write(path: Path) -> float:
+    """Newest mtime of a generation dir and its files (0 when unreadable)."""
+    try:
+        return max([path.stat().st_mtime]
+                   + [f.stat().st_mtime for f in path.iterdir()])
+    except OSError:
+        return 0.0
+
+
+def _prune_generations(directory: Path) -> None:
+    """Best-effort removal of superseded generations (and the files of the
+    pre-generation flat layout). The manifest is re-read here, not taken
+    from this write: another process may have published since. Only
+    generations older than the current one and idle past _PRUNE_GRACE_S
+    go — a younger one may be another process's write in progress. A
+    generation still mapped can't be deleted on Windows; it goes on a
+    later write."""
+    manifest = read_manifest(directory)
+    _prune_superseded(directory, "data-*", manifest.get("data_dir") if manifest else None)
+    for name in (VECTORS_FILE, SCALES_FILE, ROWS_FILE, OFFSETS_FILE):
+        try:
+            (directory / name).unlink(missing_ok=True)
+        except OSError:
+            pass
+
+
+def _prune_superseded(directory: Path, pattern: str, current: str | None) -> None:
+    """Remove the `pattern` dirs under `directory` other than `current` that
+    are older than it and idle past _PRUNE_GRACE_S (see _prune_generations)."""
+    current_written = _last_write(directory / current) if current else 0.0
+    cutoff = time.time() - _PRUNE_GRACE_S
+    for path in directory.glob(pattern):
+        if path.name == current or not path.is_dir():
+            continue
+        written = _last_write(path)
+        if written < current_written and written < cutoff:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def _replace_bytes(path: Path, data: bytes) -> None:
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as f:
+        f.write(data)
+    tmp.replace(path)
+
+
+class EmbeddingIndex:
+    """[N, dim] embeddings plus their N row dicts, scored with a dot product.
+
+    `open` maps an on-disk index; `from_memory` wraps arrays already in RAM
+    (the bucket/modifier indexes, or a fresh tag rebuild whose cache dir
+    isn't writable) behind the same API. `vectors` holds the stored dtype;
+    `dense` / `scores` hand back float32."""
+
+    def __init__(self, vectors, row_at, count: int, scales=None, hashes=None):
+        self.vectors = vectors
+        self.scales = scales
+        self.hashes = hashes
+        self._row_at = row_at
+        self._count = count
+
+    @classmethod
+    def open(cls, directory: Path, manifest: dict) -> "EmbeddingIndex":
+        """Map the index described by `manifest` (from read_manifest).
+        Raises ValueError when the files disagree with the manifest."""
+        import numpy as np
+
+        directory = directory / manifest.get("data_dir", ".")
+        count = int(manifest["rowcount"])
+        dim = int(manifest["dim"])
+        dtype_name = manifest["dtype"]
+        dtype = np.dtype(_DTYPES[dtype_name])
+        if count < 0 or dim <= 0:
+            raise ValueError(f"bad shape [{count}, {dim}] in manifest")
+        vec_path = directory / VECTORS_FILE
+        idx_path = directory / OFFSETS_FILE
+        rows_path = directory / ROWS_FILE
+        if os.path.getsize(vec_path) != count * dim * dtype.itemsize:
+            raise ValueError(f"{VECTORS_FILE} size does not match manifest")
+        if os.path.getsize(idx_path) != (count + 1) * 8:
+            raise ValueError(f"{OFFSETS_FILE} size does not match manifest")
+
+        # An index with no rows is valid (sync_index writes one for an empty
+        # table); zero-length files can't be mapped, so it lives in memory.
+        if count:
+            vectors = np.memmap(vec_path, dtype=dtype, mode="r", shape=(count, dim))
+        else:
+            vectors = np.empty((0, dim), dtype=dtype)
+        scales = None
+        if dtype_name == "int8":
+            scales_path = directory / SCALES_FILE
+            if os.path.getsize(scales_path) != count * 4:
+                raise ValueError(f"{SCALES_FILE} size does not match manifest")
+            scales = np.fromfile(scales_path, dtype="<f4")
+        hashes = None
+        hashes_path = directory / HASHES_FILE
+        if hashes_path.exists() and os.path.getsize(hashes_path) == count * 8:
+            hashes = (np.memmap(hashes_path, dtype="<u8", mode="r", shape=(count,))
+                      if count else np.empty(0, dtype="<u8"))
+        offsets = np.memmap(idx_path, dtype="<u8", mode="r", shape=(count + 1,))
+        size = os.path.getsize(rows_path)
+        if int(offsets[-1]) != size:
+            raise ValueError(f"{ROWS_FILE} size does not match {OFFSETS_FILE}")
+        if size:
+            with open(rows_path, "rb") as f:
+                blob: Any = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            blob = b""
+
+        def row_at(i: int) -> dict:
+            return json.loads(blob[int(offsets[i]):int(offsets[i + 1])].decode("utf-8"))
+
+        return cls(vectors, row_at, count, scales, hashes)
+
+    @classmethod
+    def from_memory(cls, vectors, rows: list[dict], dtype: str = "float32",
+                    hashes: list[int] | None = None) -> "EmbeddingIndex":
+        import numpy as np
+
+        arr, scales = quantize(vectors, dtype)
+        if hashes is not None:
+            hashes = np.asarray(hashes, dtype=np.uint64)
+        return cls(arr, rows.__getitem__, len(rows), scales, hashes)
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def dim(self) -> int:
+        return int(self.vectors.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes of vector storage (mapped or resident)."""
+        return int(self.vectors.nbytes) + (int(self.scales.nbytes) if self.scales is not None else 0)
+
+    def row(self, i: int) -> dict:
+        """Row `i` as a fresh dict (safe for the caller to mutate)."""
+        return dict(self._row_at(i))
+
+    def dense(self, sel):
+        """float32 rows for `sel` (slice or index array), dequantized."""
+        import numpy as np
+
+        block = np.asarray(self.vectors[sel], dtype=np.float32)
+        if self.scales is not None:
+            block *= self.scales[sel][:, None]
+        return block
+
+    def scores(self, query):
+        """float32 dot products of every row with `query`: [dim] → [N],
+        or [dim, m] (one column per query) → [N, m]."""
+        import numpy as np
+
+        q = np.asarray(query, dtype=np.float32)
+        if self.vectors.dtype == np.float32:
+            return self.vectors @ q
+        out = np.empty((self._count,) + q.shape[1:], dtype=np.float32)
+        for start in range(0, self._count, _SCORE_CHUNK):
+            sel = slice(start, start + _SCORE_CHUNK)
+            block = self.dense(sel)
+            out[start:start + len(block)] = block @ q
+        return out
+
+
+def reuse_vectors(previous: EmbeddingIndex | None, hashes: list[int], dim: int,
+                  embed) -> tuple:
+    """float32 [N, dim] vectors for rows with content `hashes`, copying every
+    vector `previous` already holds for the same hash and calling
+    `embed(positions)` → [len(positions), dim] for the rest (added or
+    edited rows; rows gone from `hashes` are simply not copied). Returns
+    (vectors, number of rows embedded). Without a usable `previous` (none,
+    no hashes, other dim) every row is embedded. Rows copied from a
+    quantized `previous` carry its quantization."""
+    import numpy as np
+
+    out = np.empty((len(hashes), dim), dtype=np.float32)
+    known: dict[int, int] = {}
+    if previous is not None and previous.hashes is not None and previous.dim == dim:
+        known = {h: i for i, h in enumerate(previous.hashes.tolist())}
+    dst, src, todo = [], [], []
+    for i, h in enumerate(hashes):
+        j = known.get(h)
+        if j is None:
+            todo.append(i)
+        else:
+            dst.append(i)
+            src.append(j)
+    if dst:
+        out[dst] = previous.dense(np.asarray(src))
+    if todo:
+        out[todo] = np.asarray(embed(todo), dtype=np.float32)
+    return out, len(todo)
+
+
+def sync_index(directory: Path, rows: list[dict], texts: list[str], manifest: dict,
+               dim: int, embed, dtype: str = "float32") -> tuple:
+    """(EmbeddingIndex, number of rows embedded) for `rows`, embedded from
+    `texts`, backed by the cache under `directory`.
+
+    `manifest` holds the fields a cache must match to be usable at all
+    (model, schema version, ...). When the stored cache also has this
+    dtype and the same `content_fingerprint`, it is mapped as-is and
+    nothing is embedded. Otherwise its vectors are reused by content hash
+    (if it's at least as precise as `dtype`), `embed(positions)` fills the
+    rest, and the result is written as a new generation. If the write
+    fails the index is kept in memory."""
+    fingerprint = content_fingerprint(rows, texts)
+    stored = read_manifest(directory)
+    usable = stored is not None and all(stored.get(k) == v for k, v in manifest.items())
+    if usable and stored.get("dtype") == dtype and stored.get("fingerprint") == fingerprint:
+        try:
+            return EmbeddingIndex.open(directory, stored), 0
+        except Exception:
+            logger.warning("embed_index: %s unreadable — rebuilding", directory, exc_info=True)
+            usable = False
+
+    previous = None
+    if usable and PRECISION.get(stored.get("dtype"), -1) >= PRECISION[dtype]:
+        try:
+            previous = EmbeddingIndex.open(directory, stored)
+        except Exception:
+            previous = None
+    hashes = [content_hash(t) for t in texts]
+    vectors, embedded = reuse_vectors(previous, hashes, dim, embed)
+    try:
+        write_index(directory, vectors, rows, dict(manifest, fingerprint=fingerprint),
+                    dtype=dtype, hashes=hashes)
+        return EmbeddingIndex.open(directory, read_manifest(directory)), embedded
+    except Exception:
+        logger.warning("embed_index: write to %s failed — index kept in memory",
+                       directory, exc_info=True)
+        return EmbeddingIndex.from_memory(vectors, rows, dtype=dtype, hashes=hashes), embedded
+
@@ -7,8 +7,12 @@ back as tag content.
 
 Index shape: each row of slot_modifiers gets a 384-dim embedding from
 BAAI/bge-small-en-v1.5 (same model bucket_search uses), CLS-pooled and
-L2-normalized so cosine == dot. Index lives in memory; rowcount-based
-hot-reload picks up DB schema changes without restart.
+L2-normalized so cosine == dot. Index is an `EmbeddingIndex` at the
+`embed_index_dtype` config precision, persisted under
+`<repo>/cache/modifier_search/` in tag_search's on-disk format
+(`embed_index.sync_index`): a restart with unchanged modifiers maps the
+cache instead of re-embedding, and an edited definition re-embeds just
+that row. Rowcount-based hot-reload picks up DB changes without restart.
 
 Threshold/top_k are calibrated against real prompts (see commit history).
 0.65 / top_k=2 catches semantic paraphrases that miss the alias scan
@@ -20,18 +24,27 @@ from __future__ import annotations
 
 import logging
 import threading
+from pathlib import Path
 from typing import Any
 
-from . import _embed_model
+from . import _embed_model, topk
+from . import config as global_config
+from .db_generation import FingerprintGate, SearchStats, tag_builder_generation
+from .embed_index import sync_index
 
 
 logger = logging.getLogger("promptchain.modifier_search")
 _dbg = logging.getLogger("promptchain.ai.debug")
 
+CACHE_DIR = Path(__file__).resolve().parent.parent / "cache" / "modifier_search"
+# Bump when the row dicts or the embedded text change shape — a mismatch
+# discards the cache.
+SCHEMA_VERSION = 1
+
 _lock = threading.RLock()
 _state: dict[str, Any] = {
-    "embeddings": None,        # torch.Tensor [N, 384]
-    "modifiers": [],           # list[dict] aligned with embeddings
+    "index": None,             # EmbeddingIndex [N, 384]
+    "modifiers": [],           # list[dict] aligned with the index rows
     "fingerprint": None,       # (max_rowid, count) — change → rebuild
 }
 
@@ -44,10 +57,6 @@ def _ensure_model_loaded() -> bool:
     return _embed_model.get() is not None
 
 
-def _embed(texts: list[str]):
-    return _embed_model.embed(texts, batch_size=64)
-
-
 def _fingerprint() -> tuple:
     from .tag_builder import get_db
     db = get_db()
@@ -60,6 +69,17 @@ def _fingerprint() -> tuple:
         return (0, 0)
 
 
+# The fingerprint query only re-runs once the DB's write generation moves
+# (db_generation.py) — a search otherwise compares a token in microseconds.
+_fp_gate = FingerprintGate(tag_builder_generation(), _fingerprint)
+_stats = SearchStats("modifier_search", extra=lambda: {"fingerprint": _fp_gate.stats()})
+
+
+def search_stats() -> dict:
+    """Mean / last per-phase search overhead (ms) and fingerprint gate counts."""
+    return _stats.snapshot()
+
+
 def _embed_text(mod: dict) -> str:
     """Text we feed to bge-small. Definition-only on purpose — calibration
     showed that mixing aliases into the embed shifts the embedding toward
@@ -83,20 +103,38 @@ def _rebuild_index() -> None:
         return
     modifiers = ai_api._load_slot_modifiers()
     if not modifiers:
-        _state["embeddings"] = None
+        _state["index"] = None
         _state["modifiers"] = []
-        _state["fingerprint"] = _fingerprint()
+        _state["fingerprint"] = _fp_gate.get()
         return
     texts = [_embed_text(m) for m in modifiers]
-    embeddings = _embed(texts)
-    _state["embeddings"] = embeddings
+
+    def embed(positions: list[int]):
+        report: dict = {}
+        out = _embed_model.embed([texts[i] for i in positions], batch_size=64, report=report)
+        if out is None:
+            raise RuntimeError("embed model not loaded")
+        logger.info("modifier_search: embed pass: %s", _embed_model.describe_report(report))
+        return out.float().cpu().numpy()
+
+    manifest = {"model_id": _embed_model.MODEL_ID, "embed_dim": _embed_model.EMBED_DIM,
+                "schema_version": SCHEMA_VERSION}
+    try:
+        index, embedded = sync_index(CACHE_DIR, modifiers, texts, manifest,
+                                     _embed_model.EMBED_DIM, embed,
+                                     dtype=global_config.embed_index_dtype())
+    except RuntimeError:
+        logger.warning("modifier_search: embed() returned None — model not loaded")
+        return
     _state["modifiers"] = list(modifiers)
-    _state["fingerprint"] = _fingerprint()
-    logger.info("modifier_search: indexed %d modifiers", len(modifiers))
+    _state["index"] = index
+    _state["fingerprint"] = _fp_gate.get()
+    logger.info("modifier_search: indexed %d modifiers (%d embedded, %d from cache)",
+                len(modifiers), embedded, len(modifiers) - embedded)
 
 
 def _ensure_index_fresh() -> None:
-    if _state["fingerprint"] == _fingerprint() and _state["embeddings"] is not None:
+    if _state["fingerprint"] == _fp_gate.get() and _state["index"] is not None:
         return
     _rebuild_index()
 
@@ -112,24 +150,33 @@ def search(user_text: str, top_k: int = 2, threshold: float = 0.65) -> list[dict
     user_text = (user_text or "").strip()
     if not user_text:
         return []
+    if not _ensure_model_loaded():
+        return []
+    run = _stats.start()
+    # Lock only for the freshness check; the query embed outside it can
+    # batch with other concurrent searches (a rebuild swaps in new
+    # objects, so the snapshot stays valid).
     with _lock:
-        if not _ensure_model_loaded():
-            return []
         _ensure_index_fresh()
-        if _state["embeddings"] is None or not _state["modifiers"]:
-            return []
-        qv = _embed([user_text])
-        scores = (_state["embeddings"] @ qv.T).squeeze(-1).tolist()
-        paired = list(zip(_state["modifiers"], scores))
-        paired.sort(key=lambda x: -x[1])
-        out: list[dict] = []
-        for mod, score in paired[:top_k]:
-            if score < threshold:
-                break
-            entry = dict(mod)
-            entry["score"] = float(score)
-            out.append(entry)
-        return out
+        index, modifiers = _state["index"], _state["modifiers"]
+    run.lap("fresh")
+    if index is None or not modifiers:
+        return []
+    qv = _embed_model.embed_cached([user_text])
+    if qv is None:
+        return []
+    q = qv[0]
+    run.lap("embed")
+    hits = topk.top_k(index.scores(q), top_k, threshold)
+    run.lap("score")
+    out: list[dict] = []
+    for i, score in hits:
+        entry = dict(modifiers[i])
+        entry["score"] = score
+        out.append(entry)
+    run.lap("hydrate")
+    _dbg.debug("modifier_search: overhead %s", run.finish())
+    return out
 
 
 def warmup() -> None:
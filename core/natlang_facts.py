@@ -1020,11 +1020,13 @@ def _semantic_pose_match(query_clean: str,
     cleaned_candidates = [_strip_pose_name_noise(n) for n in candidate_names]
     if not any(cleaned_candidates):
         return -1
-    cand_embs = _embed_model.embed(cleaned_candidates)
-    q_emb = _embed_model.embed([query_clean])
-    if cand_embs is None or q_emb is None:
+    # Through the query cache: the same pose names come back on every
+    # call for a character, so after the first only the query is new.
+    embs = _embed_model.embed_cached(cleaned_candidates + [query_clean])
+    if embs is None:
         return -1
-    scores = (q_emb @ cand_embs.T).cpu().squeeze(0).tolist()
+    cand_embs, q_emb = embs[:-1], embs[-1:]
+    scores = (q_emb @ cand_embs.T).squeeze(0).tolist()
     if not scores:
         return -1
     if isinstance(scores, float):
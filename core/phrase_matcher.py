@@ -0,0 +1,160 @@
+"""
+Multi-phrase literal matcher shared by the alias scans.
+
+tag_search.alias_scan, style_search.style_alias_scan and
+ai_api._detect_modifiers_in_text each looked for every curator alias in
+the user's text with its own `(?<!\\w)alias(?!\\w)` regex — thousands of
+patterns per request, more than `re`'s compile cache holds, so most of
+them were recompiled on every call. `PhraseMatcher` is an Aho-Corasick
+automaton over all the phrases: one pass over the text finds every
+occurrence of every phrase, with offsets.
+
+Matching is case-folded (per character, so offsets index the original
+text) and word-boundary aware: a hit must not have a word character
+immediately before or after it — the same rule as the regexes it
+replaces. `scan` returns every such occurrence, overlaps included;
+`longest` keeps leftmost-longest non-overlapping hits.
+
+`VersionedBuild` holds a matcher (or anything derived from a vocabulary)
+and rebuilds it only when a cheap version function — the DB fingerprint
+or a generation-gated signature — changes.
+"""
+from __future__ import annotations
+
+import threading
+from typing import Any, Callable, Iterable, NamedTuple
+
+
+def ascii_word_char(ch: str) -> bool:
+    """[A-Za-z0-9_] — tag_search / style_search boundaries."""
+    return ch == "_" or ("a" <= ch <= "z") or ("A" <= ch <= "Z") or ("0" <= ch <= "9")
+
+
+def unicode_word_char(ch: str) -> bool:
+    """Python's `\\w` — ai_api's modifier boundaries."""
+    return ch == "_" or ch.isalnum()
+
+
+def _fold(ch: str) -> str:
+    # Per-character lower() keeps offsets aligned with the original text;
+    # the few characters whose lowercase is longer (İ) are left as-is.
+    low = ch.lower()
+    return low if len(low) == 1 else ch
+
+
+class Hit(NamedTuple):
+    start: int
+    end: int            # exclusive
+    phrase_id: int      # index into the phrases the matcher was built from
+
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over `phrases`. Hits carry the index of the
+    phrase in the input, so duplicate phrases (one alias for two tags)
+    each get their own hit. Empty phrases never match."""
+
+    def __init__(self, phrases: Iterable[str],
+                 word_char: Callable[[str], bool] = ascii_word_char):
+        self.phrases = list(phrases)
+        self._word_char = word_char
+        goto: list[dict[str, int]] = [{}]
+        out: list[list[int]] = [[]]
+        for pid, phrase in enumerate(self.phrases):
+            if not phrase:
+                continue
+            node = 0
+            for ch in phrase:
+                ch = _fold(ch)
+                nxt = goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(goto)
+                    goto[node][ch] = nxt
+                    goto.append({})
+                    out.append([])
+                node = nxt
+            out[node].append(pid)
+        fail = [0] * len(goto)
+        queue = list(goto[0].values())      # depth 1: fail to the root
+        for node in queue:      # BFS, so fail links point at finished nodes
+            for ch, nxt in goto[node].items():
+                f = fail[node]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[nxt] = goto[f].get(ch, 0)
+                out[nxt] = out[nxt] + out[fail[nxt]]
+                queue.append(nxt)
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+        self._len = [len(p) for p in self.phrases]
+
+    def __len__(self) -> int:
+        return len(self.phrases)
+
+    def scan(self, text: str) -> list[Hit]:
+        """Every word-bounded occurrence of every phrase in `text`, ordered
+        by start offset, then longest first, then phrase id."""
+        if not text or not self.phrases:
+            return []
+        goto, fail, out, plen = self._goto, self._fail, self._out, self._len
+        word = self._word_char
+        n = len(text)
+        hits: list[Hit] = []
+        node = 0
+        for i, ch in enumerate(text):
+            ch = _fold(ch)
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if not out[node]:
+                continue
+            end = i + 1
+            if end < n and word(text[end]):
+                continue
+            for pid in out[node]:
+                start = end - plen[pid]
+                if start == 0 or not word(text[start - 1]):
+                    hits.append(Hit(start, end, pid))
+        hits.sort(key=lambda h: (h.start, -h.end, h.phrase_id))
+        return hits
+
+    def longest(self, text: str) -> list[Hit]:
+        """Leftmost-longest non-overlapping hits: at each position the
+        longest phrase wins and the scan resumes after it."""
+        picked: list[Hit] = []
+        pos = 0
+        for hit in self.scan(text):
+            if hit.start >= pos:
+                picked.append(hit)
+                pos = hit.end
+        return picked
+
+
+class VersionedBuild:
+    """`get()` returns `build()`'s result, rebuilt only when `version()`
+    returns something different from the last build's version."""
+
+    def __init__(self, version: Callable[[], Any], build: Callable[[], Any]):
+        self._version = version
+        self._build = build
+        self._lock = threading.Lock()
+        self._built_for: Any = None
+        self._value: Any = None
+        self._has_value = False
+        self.builds = 0
+
+    def get(self) -> Any:
+        version = self._version()
+        with self._lock:
+            if self._has_value and version == self._built_for:
+                return self._value
+            self._value = self._build()
+            self._built_for = version
+            self._has_value = True
+            self.builds += 1
+            return self._value
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._has_value = False
+            self._value = None
@@ -3,7 +3,7 @@ Style alias scan — curator-authored deterministic literal scan that
 maps a user's phrasing in a patch request ("make it anime", "switch to
 photography") to a canonical prompt-template id from `data/prompts/`.
 
-Mirrors `tag_search.alias_scan`: same word-boundary regex shape, same
+Mirrors `tag_search.alias_scan`: same word-boundary matcher, same
 longest-first ordering, same INSERT-OR-IGNORE seed sync semantics, same
 "alias hit always beats semantic" sentinel score. Diverges only in
 output (template_id, not Danbooru tag) and in arch-filtering (a template
@@ -19,11 +19,12 @@ from __future__ import annotations
 
 import json
 import logging
-import re
 import sqlite3
-import threading
 from pathlib import Path
 
+from .db_generation import FingerprintGate, tag_builder_generation, tag_builder_reads
+from .phrase_matcher import PhraseMatcher, VersionedBuild
+
 logger = logging.getLogger("promptchain.style_search")
 _dbg = logging.getLogger("promptchain.ai.debug")
 
@@ -48,10 +49,6 @@ DEFAULT_TEMPLATE_ID = "_default"
 # resolve via downstream lookup (grounding) rather than the prompts list.
 _SYNTHETIC_TEMPLATE_IDS = frozenset({NEUTRAL_TEMPLATE_ID, DEFAULT_TEMPLATE_ID})
 
-_lock = threading.RLock()
-_ALIAS_LOOKUP_CACHE: list[tuple[str, str]] | None = None
-
-
 def _open_db() -> sqlite3.Connection:
     conn = sqlite3.connect(str(DB_PATH))
     conn.row_factory = sqlite3.Row
@@ -155,31 +152,54 @@ def _load_aliases_by_template_id() -> dict[str, list[str]]:
     return out
 
 
-def _alias_lookup_list() -> list[tuple[str, str]]:
+def _alias_signature() -> tuple | None:
+    """Cheap signature of the style_aliases table: moves when rows are
+    added, removed or edited. None when the table can't be read. Runs on
+    the pooled read-only connection — it's re-queried after every DB
+    write, so it shouldn't pay a connect each time."""
+    try:
+        r = tag_builder_reads().get().execute(
+            "SELECT COUNT(*), COALESCE(MAX(rowid), 0), "
+            "       COALESCE(SUM(LENGTH(template_id) + LENGTH(alias)), 0) "
+            "FROM style_aliases"
+        ).fetchone()
+        return tuple(r)
+    except Exception:
+        return None
+
+
+def _build_alias_lookup() -> tuple[list[tuple[str, str]], PhraseMatcher]:
     """Flatten the per-template alias map into a single list of
-    (alias, template_id) sorted by alias length descending. Length-
+    (alias, template_id) sorted by alias length descending, plus a
+    PhraseMatcher over the aliases (phrase id = list position). Length-
     descending matters: 'anime version of cammy' should match the
     longer 'anime version' first, not bare 'anime', so curator-tuned
-    specificity wins. Cached at module level."""
-    global _ALIAS_LOOKUP_CACHE
-    with _lock:
-        if _ALIAS_LOOKUP_CACHE is not None:
-            return _ALIAS_LOOKUP_CACHE
-        pairs: list[tuple[str, str]] = []
-        for tid, aliases in _load_aliases_by_template_id().items():
-            for alias in aliases:
-                pairs.append((alias, tid))
-        pairs.sort(key=lambda p: -len(p[0]))
-        _ALIAS_LOOKUP_CACHE = pairs
-        return pairs
+    specificity wins."""
+    pairs: list[tuple[str, str]] = []
+    for tid, aliases in _load_aliases_by_template_id().items():
+        for alias in aliases:
+            pairs.append((alias, tid))
+    pairs.sort(key=lambda p: -len(p[0]))
+    return pairs, PhraseMatcher(alias for alias, _ in pairs)
+
+
+# Rebuilt when the style_aliases signature moves; the signature itself is
+# only re-queried after something writes the DB (db_generation.py).
+_signature_gate = FingerprintGate(tag_builder_generation(), _alias_signature)
+_alias_lookup = VersionedBuild(_signature_gate.get, _build_alias_lookup)
+
+
+def _alias_lookup_list() -> list[tuple[str, str]]:
+    """(alias, template_id) pairs, longest alias first. See
+    _build_alias_lookup."""
+    return _alias_lookup.get()[0]
 
 
 def invalidate_cache() -> None:
-    """Drop the module-level alias lookup cache. Call after writing new
-    rows to style_aliases (e.g. via a curator UI)."""
-    global _ALIAS_LOOKUP_CACHE
-    with _lock:
-        _ALIAS_LOOKUP_CACHE = None
+    """Drop the alias lookup cache. Writes to style_aliases are picked up
+    on their own; this forces a reload regardless."""
+    _signature_gate.invalidate()
+    _alias_lookup.invalidate()
 
 
 def style_alias_scan(user_text: str,
@@ -203,22 +223,16 @@ def style_alias_scan(user_text: str,
     text = (user_text or "").lower()
     if not text:
         return None
-    pairs = _alias_lookup_list()
+    pairs, matcher = _alias_lookup.get()
     if not pairs:
         return None
 
     valid_ids = valid_template_ids or set()
 
-    for alias, tid in pairs:
-        # Whitespace/punctuation boundary on both sides. Stops 'anime' from
-        # matching inside 'anime convention'. re.escape keeps alias literal.
-        pat = re.compile(
-            r"(?<![A-Za-z0-9_])"
-            + re.escape(alias)
-            + r"(?![A-Za-z0-9_])"
-        )
-        if not pat.search(text):
-            continue
+    # Every alias present in one automaton pass (word-bounded, so 'anime'
+    # doesn't match inside 'animes'); hit ids in order = longest first.
+    for i in sorted({hit.phrase_id for hit in matcher.scan(text)}):
+        alias, tid = pairs[i]
         is_synthetic = tid in _SYNTHETIC_TEMPLATE_IDS
         if not is_synthetic and tid not in valid_ids:
             # Alias matched but template isn't a real prompt for this
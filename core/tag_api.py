@@ -159,6 +159,20 @@ async def _api_tag_similar(request):
     return web.json_response({"tags": store.get_similar(source, tag_id=tag_id, tag_name=tag_name, limit=limit)})
 
 
+@routes.post("/promptchain/tags/lookup")
+async def _api_tag_lookup(request):
+    data, err = await parse_json(request)
+    if err: return err
+    names = data.get("names")
+    if not isinstance(names, list):
+        return error_response("names must be a list")
+    sources = data.get("sources")
+    if sources is not None and not isinstance(sources, list):
+        return error_response("sources must be a list")
+    store = get_tag_store()
+    return web.json_response({"tags": store.lookup_many([str(n) for n in names], sources)})
+
+
 @routes.get("/promptchain/tags/states")
 async def _api_tag_states(request):
     return web.json_response({"states": get_tag_file_states()})
@@ -14,7 +14,7 @@ from aiohttp import web
 import server
 
 from .api_utils import parse_json, error_response
-from . import tag_overlay
+from . import character_keys, character_search, tag_overlay
 
 # Shares the AI debug channel so `match-characters` traces sit alongside
 # the rest of the Prompt Generator pipeline in comfyui.log.
@@ -70,6 +70,8 @@ def get_db() -> sqlite3.Connection:
             _normalize_scene_locations_sort_order(conn)
             _ensure_character_appearance_chip_columns(conn)
             _reconcile_character_base_tags(conn)
+            character_search.ensure_characters_fts(conn)
+            character_keys.ensure_character_name_keys(conn)
             _schema_ready = True
             # The helpers commit, bumping the watched mtime; re-read it so
             # their own write doesn't immediately trigger another reconnect.
@@ -3427,92 +3429,39 @@ async def _api_characters(request):
     # value can't dump the whole 11.5k-row table.
     per_page = max(1, min(per_page, 200))
     search = request.query.get("search", "").strip()
-    sort = request.query.get("sort", "display")
+    # Default: relevance when searching (bm25 over the full-text index),
+    # display order when browsing. See character_search.
+    sort = request.query.get("sort", "")
     status = request.query.get("status", "")
     category = request.query.get("category", "").strip()
     natlang_status = request.query.get("natlang_status", "").strip()
+    # Keyset pagination: pass the previous page's next_cursor instead of
+    # page to continue after its last row (no OFFSET scan, no re-COUNT —
+    # total/pages come back null on those requests).
+    cursor = request.query.get("cursor", "").strip() or None
 
-    offset = (page - 1) * per_page
-
-    where_clauses = []
-    params = []
-
-    if status:
-        where_clauses.append("c.status = ?")
-        params.append(status)
-
-    # natlang_status: TagBuilder2 sends `normalized` so only fully-curated
-    # characters surface in its Subjects rail / All view. Other consumers
-    # (legacy tag builder) omit this and get every row.
-    if natlang_status:
-        where_clauses.append("c.natlang_status = ?")
-        params.append(natlang_status)
-
-    # Subjects rail filters by category — joins character_series via
-    # series_tag and filters on the category field (anime|video_game|
-    # vtuber|original|adult).
-    join_sql = ""
-    if category:
-        join_sql = " JOIN character_series cs ON cs.series_tag = c.series_tag"
-        where_clauses.append("cs.category = ?")
-        params.append(category)
-
-    if search:
-        # Normalize spaces/underscores for matching
-        normalized = search.replace("_", " ").lower()
-        words = normalized.split()
-        for word in words:
-            # Escape LIKE metacharacters in the user's query so a search
-            # for literal "_" or "%" doesn't wildcard-match everything.
-            esc = word.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
-            # Match against tag, display, AND series — searching "street
-            # fighter" should surface every Street Fighter character, not
-            # just ones with "street" or "fighter" in their own name.
-            where_clauses.append(
-                "(LOWER(REPLACE(c.tag, '_', ' ')) LIKE ? ESCAPE '\\' "
-                "OR LOWER(REPLACE(c.display, '_', ' ')) LIKE ? ESCAPE '\\' "
-                "OR LOWER(REPLACE(COALESCE(c.series, ''), '_', ' ')) LIKE ? ESCAPE '\\' "
-                "OR LOWER(REPLACE(COALESCE(c.series_tag, ''), '_', ' ')) LIKE ? ESCAPE '\\')"
-            )
-            params.append(f"%{esc}%")
-            params.append(f"%{esc}%")
-            params.append(f"%{esc}%")
-            params.append(f"%{esc}%")
-
-    where_sql = (" WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
-
-    # Sort mapping
-    sort_map = {
-        "display": "c.display ASC",
-        "tag": "c.tag ASC",
-        "post_count": "c.post_count DESC",
-        "updated_at": "c.updated_at DESC",
-        "series": "c.series ASC, c.display ASC",
-    }
-    order_sql = sort_map.get(sort, "c.display ASC")
-
-    count_row = db.execute(
-        f"SELECT COUNT(*) FROM characters c{join_sql}{where_sql}", params
-    ).fetchone()
-    total = count_row[0]
-
-    rows = db.execute(
-        f"SELECT c.* FROM characters c{join_sql}{where_sql} ORDER BY {order_sql} LIMIT ? OFFSET ?",
-        params + [per_page, offset],
-    ).fetchall()
+    try:
+        result = character_search.search_characters(
+            db, search, status=status, natlang_status=natlang_status,
+            category=category, sort=sort, per_page=per_page, page=page, cursor=cursor,
+        )
+    except ValueError:
+        return web.json_response({"error": "invalid cursor"}, status=400)
+    total = result["total"]
 
     # Merge user edits + tombstone-deletes onto this page. Adds are suppressed
     # here (include_adds=False): user-added characters live in the separate
     # "Mine" view, and injecting them into a LIMIT/OFFSET page would duplicate
     # them across pages and skew the total count.
-    merged = tag_overlay.apply_overlay("characters", [dict(r) for r in rows], include_adds=False)
+    merged = tag_overlay.apply_overlay("characters", result["rows"], include_adds=False)
 
     return web.json_response({
         "characters": merged,
         "total": total,
         "page": page,
         "per_page": per_page,
-        "pages": (total + per_page - 1) // per_page,
+        "pages": (total + per_page - 1) // per_page if total is not None else None,
+        "next_cursor": result["next_cursor"],
     })
 
 
@@ -4788,9 +4737,14 @@ def match_characters_inner(
     preference tiebreaker on stages 3 & 4).
     `node_prompt`: existing prompt body (extracts outfit names for
     patch-mode preserve)."""
-    if not isinstance(tokens, list):
-        return {"matched": []}
+    return match_characters_bulk(
+        [tokens], user_text=user_text,
+        latest_user_text=latest_user_text, node_prompt=node_prompt,
+    )[0]
 
+
+def _normalize_character_tokens(tokens: list) -> dict[str, str]:
+    """DB-shaped variants of each user token -> the original token."""
     # Generate space / underscore / hyphen variants for every user
     # token. Danbooru canonical separator varies by character: most use
     # underscores ('cammy_white'), some use hyphens ('chun-li'), and
@@ -4819,8 +4773,33 @@ def match_characters_inner(
         for variant in (bare, bare.replace(" ", "_"), bare.replace(" ", "-")):
             norm_to_original.setdefault(variant, token)
 
-    if not norm_to_original:
-        return {"matched": [], "normalized": []}
+    return norm_to_original
+
+
+def match_characters_bulk(
+    mentions: list,
+    user_text: str = "",
+    latest_user_text: str = "",
+    node_prompt: str = "",
+) -> list[dict]:
+    """`match_characters_inner` for several mentions (token lists) at
+    once, sharing the context strings. Returns one result per mention,
+    each the same as matching that mention alone; the DB lookups for all
+    of them run as one query per match stage (see character_keys)."""
+    results: list = []
+    pending: list[tuple[int, list, dict[str, str]]] = []
+    for tokens in mentions:
+        if not isinstance(tokens, list):
+            results.append({"matched": []})
+            continue
+        norm_to_original = _normalize_character_tokens(tokens)
+        if not norm_to_original:
+            results.append({"matched": [], "normalized": []})
+            continue
+        pending.append((len(results), tokens, norm_to_original))
+        results.append(None)
+    if not pending:
+        return results
 
     user_text = (user_text or "").lower()
     # Original user text (vs `user_text` which is the agent's
@@ -4835,207 +4814,41 @@ def match_characters_inner(
         node_prompt or ""
     )
 
+    # Stages 1-5: exact tag, bare-alphanumeric (`m._bison`, `c.c.`), name
+    # prefix (`cammy` -> `cammy_white`), wrong franchise suffix
+    # (`mythra_(xenoblade_chronicles_2)` -> `mythra_(xenoblade)`) and
+    # first underscore segment (`ryu_streets_fighter`). Stages 3-5 skip
+    # _NAME_PREFIX_STOPLIST words — dictionary words that happen to lead
+    # some character tag (`fighter_(7th_dragon)`, `white_rock_shooter`)
+    # — and let the franchise named in `latest_user_text` pick between
+    # `name_(franchise)` candidates. Bias toward false-negatives — the
+    # user will disambiguate by typing more specifically if it misses.
     db = get_db()
-    placeholders = ",".join(["?"] * len(norm_to_original))
-    char_rows: list = list(db.execute(
-        f"SELECT tag, display, series, base_tags, base_natlang FROM characters WHERE tag IN ({placeholders})",
-        list(norm_to_original.keys()),
-    ).fetchall())
-
-    matched_tags = [r["tag"] for r in char_rows if r["tag"] in norm_to_original]
-    # Stage 3 iterates a frozen snapshot of the user's input tokens —
-    # stages 2/3/4 push DB-matched tags back into norm_to_original, and
-    # iterating the live dict would treat those as fresh user input.
-    user_token_keys = list(norm_to_original.keys())
-
-    # Fallback: bare-alphanumeric match. Some Danbooru character tags
-    # contain literals the separator-variant generator can't produce —
-    # `m._bison` (period + underscore), `m.o.m.o.` (dotted), `c.c.`,
-    # `t.m._opera_o_(umamusume)` (mixed). Strip all of [_\-\. ()] from
-    # both sides and compare; matches only when bare form is >=3 chars
-    # to avoid 1-2 letter false positives ("j" matching every J-named
-    # character). Skipped for tokens already matched by the primary
-    # variant lookup so we don't double-count.
-    already_matched = {r["tag"] for r in char_rows}
-    bare_to_tokens: dict[str, str] = {}
-    for token, original in norm_to_original.items():
-        bare = re.sub(r"[\s_\-\.()]+", "", token).lower()
-        if len(bare) >= 3:
-            bare_to_tokens.setdefault(bare, original)
-    if bare_to_tokens:
-        bare_placeholders = ",".join(["?"] * len(bare_to_tokens))
-        bare_rows = db.execute(
-            f"SELECT tag, display, series, base_tags, base_natlang FROM characters "
-            f"WHERE tag NOT IN ({placeholders}) "
-            f"  AND LOWER(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE("
-            f"      tag, '_', ''), '-', ''), '.', ''), ' ', ''), '(', ''), ')', '')) "
-            f"      IN ({bare_placeholders})",
-            list(norm_to_original.keys()) + list(bare_to_tokens.keys()),
-        ).fetchall()
-        for r in bare_rows:
-            if r["tag"] in already_matched:
-                continue
-            bare_db = re.sub(r"[\s_\-\.()]+", "", r["tag"]).lower()
-            original = bare_to_tokens.get(bare_db)
-            if original is not None:
-                norm_to_original.setdefault(r["tag"], original)
-                char_rows.append(r)
-                matched_tags.append(r["tag"])
-                already_matched.add(r["tag"])
-
-    # Name-prefix fallback: catches the user typing just a character's
-    # first name (`mythra`, `cammy`, `ryu`) without the rest of the
-    # canonical tag (`mythra_(xenoblade)`, `cammy_white`,
-    # `ryu_(street_fighter)`). Looks for tags shaped `<name>_<anything>`
-    # where <name> equals the user's token. When multiple matches
-    # exist (e.g. `ryu_(monster_girl_encyclopedia)` AND
-    # `ryu_(street_fighter)`), prefers the candidate whose series
-    # appears in `latest_user_text` over the canonical-ness ordering
-    # — so franchise context the user typed actually disambiguates.
-    #
-    # Length floor 3 chars: catches short canonical names (`ryu`,
-    # `ada`, `ken`, `ash`). Stoplist filters generic 3-letter words
-    # (`red`, `boy`, etc.) so we don't over-match on adjectives.
-    #
-    # Stoplist: dictionary words that happen to be the leading segment
-    # of a character tag (`fighter_(7th_dragon)`, `blonde_girl_(...)`,
-    # `white_rock_shooter`, `black_star`). When the user mentions
-    # 'blonde fighter in white outfit', we don't want to inject those
-    # characters' bios. Bias toward false-negatives — user will
-    # disambiguate by typing more specifically if it misses.
-    #
-    # SQL: LIKE '<token>_%' with ESCAPE since SQLite treats bare `_` as
-    # a single-char wildcard.
-    name_prefix_candidates: dict[str, str] = {}
-    for token in user_token_keys:
-        original = norm_to_original.get(token)
-        if original is None:
-            continue
-        # Only single-name tokens — no spaces, underscores, hyphens, or
-        # parens. That's the case the user typed just a first name.
-        if re.search(r"[\s_\-()]", token):
-            continue
-        if len(token) >= 3 and token.lower() not in _NAME_PREFIX_STOPLIST:
-            name_prefix_candidates.setdefault(token.lower(), original)
-    if name_prefix_candidates:
-        for prefix, original in name_prefix_candidates.items():
-            # Escape LIKE metacharacters so a name with % or _ doesn't wildcard-match.
-            esc = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
-            like_pattern = esc + r"\_%"
-            prefix_rows = db.execute(
-                "SELECT tag, display, series, base_tags, base_natlang FROM characters "
-                "WHERE LOWER(tag) LIKE ? ESCAPE '\\' "
-                # Canonical-ness order: fewer `_(` disambiguators first,
-                # then shorter total length, then alphabetical.
-                "ORDER BY (LENGTH(tag) - LENGTH(REPLACE(tag, '_(', ''))) ASC, "
-                "         LENGTH(tag) ASC, tag ASC "
-                "LIMIT 5",
-                (like_pattern,),
-            ).fetchall()
-            chosen = _pick_franchise_preferred(prefix_rows, latest_user_text)
-            if chosen is None:
-                continue
-            if chosen["tag"] in already_matched:
-                continue
-            norm_to_original.setdefault(chosen["tag"], original)
-            char_rows.append(chosen)
-            matched_tags.append(chosen["tag"])
-            already_matched.add(chosen["tag"])
-
-    # Stage 4 — wrong-franchise-suffix fallback. When the agent (or
-    # client) constructs a canonical-shaped token like
-    # `mythra_(xenoblade_chronicles_2)` but the DB has
-    # `mythra_(xenoblade)`, stages 1-3 all miss: stage 1 wants exact
-    # match, stage 2's bare-alphanumeric form is too dissimilar
-    # (`mythraxenobladechronicles2` vs `mythraxenoblade`), and stage 3
-    # is gated to single-name tokens (`re.search(r"[\s_\-()]", token)`
-    # skips anything with `_(`). Strip the parenthetical and try
-    # both an exact match on the bare prefix (for chars whose
-    # canonical IS bare-named, like `sagat`, `cammy_white`, `cirno`)
-    # AND a name-prefix LIKE query (for chars whose canonical is
-    # franchise-suffixed, like `mythra_(xenoblade)`). Same canonical-
-    # ness ordering as stage 3 — bare matches win over suffixed via
-    # the `_(` count tiebreaker, then shortest tag length.
-    paren_suffix_candidates: dict[str, str] = {}
-    for token in user_token_keys:
-        original = norm_to_original.get(token)
-        if original is None:
-            continue
-        if "_(" not in token:
-            continue
-        bare_name = token.split("_(", 1)[0].strip()
-        if not bare_name:
-            continue
-        if len(bare_name) < 4 or bare_name.lower() in _NAME_PREFIX_STOPLIST:
-            continue
-        paren_suffix_candidates.setdefault(bare_name.lower(), original)
-    if paren_suffix_candidates:
-        for prefix, original in paren_suffix_candidates.items():
-            # Escape LIKE metacharacters so a name with % or _ doesn't wildcard-match.
-            esc = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
-            like_pattern = esc + r"\_%"
-            prefix_rows = db.execute(
-                "SELECT tag, display, series, base_tags, base_natlang FROM characters "
-                "WHERE LOWER(tag) = ? OR LOWER(tag) LIKE ? ESCAPE '\\' "
-                "ORDER BY (LENGTH(tag) - LENGTH(REPLACE(tag, '_(', ''))) ASC, "
-                "         LENGTH(tag) ASC, tag ASC "
-                "LIMIT 5",
-                (prefix, like_pattern),
-            ).fetchall()
-            chosen = _pick_franchise_preferred(prefix_rows, latest_user_text)
-            if chosen is None:
-                continue
-            if chosen["tag"] in already_matched:
-                continue
-            norm_to_original.setdefault(chosen["tag"], original)
-            char_rows.append(chosen)
-            matched_tags.append(chosen["tag"])
-            already_matched.add(chosen["tag"])
-
-    # Stage 5 — first-segment fallback for underscored typo tokens.
-    # When the chat agent paraphrases a user typo into a malformed
-    # canonical (`ryu_streets_fighter`, `mythra_xenoblade_chronicles_2`),
-    # stage 1 misses (no exact DB hit), stage 2's bare-alphanumeric form
-    # doesn't match any character (`ryustreetsfighter` etc), stage 3 skips
-    # underscored tokens, and stage 4 requires `_(`. Recover by treating
-    # the first underscore-segment as a name-prefix lookup. Stage 4's
-    # length floor and stoplist apply so generic words don't false-match.
-    first_segment_candidates: dict[str, str] = {}
-    for token in user_token_keys:
-        original = norm_to_original.get(token)
-        if original is None:
-            continue
-        if "_" not in token or "_(" in token:
-            continue
-        bare_name = token.split("_", 1)[0].strip()
-        if not bare_name:
-            continue
-        # Length floor 3 (matches stage 3) — short canonical names like
-        # `ryu`, `ada`, `ken` are exactly the case this recovers.
-        if len(bare_name) < 3 or bare_name.lower() in _NAME_PREFIX_STOPLIST:
-            continue
-        first_segment_candidates.setdefault(bare_name.lower(), original)
-    if first_segment_candidates:
-        for prefix, original in first_segment_candidates.items():
-            # Escape LIKE metacharacters so a name with % or _ doesn't wildcard-match.
-            esc = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
-            like_pattern = esc + r"\_%"
-            prefix_rows = db.execute(
-                "SELECT tag, display, series, base_tags, base_natlang FROM characters "
-                "WHERE LOWER(tag) = ? OR LOWER(tag) LIKE ? ESCAPE '\\' "
-                "ORDER BY (LENGTH(tag) - LENGTH(REPLACE(tag, '_(', ''))) ASC, "
-                "         LENGTH(tag) ASC, tag ASC "
-                "LIMIT 5",
-                (prefix, like_pattern),
-            ).fetchall()
-            chosen = _pick_franchise_preferred(prefix_rows, latest_user_text)
-            if chosen is None or chosen["tag"] in already_matched:
-                continue
-            norm_to_original.setdefault(chosen["tag"], original)
-            char_rows.append(chosen)
-            matched_tags.append(chosen["tag"])
-            already_matched.add(chosen["tag"])
+    resolved = character_keys.match_character_rows(
+        db, [norm for _, _, norm in pending],
+        latest_user_text=latest_user_text,
+        stoplist=_NAME_PREFIX_STOPLIST,
+        pick=_pick_franchise_preferred,
+    )
+    for (i, tokens, _), (norm_to_original, char_rows) in zip(pending, resolved):
+        results[i] = _match_character_entries(
+            db, tokens, norm_to_original, char_rows,
+            user_text, existing_outfit_names,
+        )
+    return results
+
 
+def _match_character_entries(
+    db: sqlite3.Connection,
+    tokens: list,
+    norm_to_original: dict[str, str],
+    char_rows: list,
+    user_text: str,
+    existing_outfit_names: list[str],
+) -> dict:
+    """One mention's response: each matched character row with its
+    chosen outfit, poses and composed natlang."""
+    matched_tags = [r["tag"] for r in char_rows]
     outfits_by_char: dict[str, list[dict]] = {}
     poses_by_char: dict[str, list[dict]] = {}
     if matched_tags:
@@ -5203,9 +5016,19 @@ def match_characters_inner(
 @routes.post("/promptchain/tag-builder/match-characters")
 async def _api_match_characters(request):
     """Thin JSON wrapper around `match_characters_inner`. Tests call the
-    inner directly to bypass aiohttp."""
+    inner directly to bypass aiohttp. A `mentions` list of token lists
+    matches them all in one go (`match_characters_bulk`) and returns
+    `{"results": [...]}`, one result per mention."""
     data, err = await parse_json(request)
     if err: return err
+    mentions = data.get("mentions")
+    if isinstance(mentions, list):
+        return web.json_response({"results": match_characters_bulk(
+            mentions,
+            user_text=data.get("user_text") or "",
+            latest_user_text=data.get("latest_user_text") or "",
+            node_prompt=data.get("node_prompt") or "",
+        )})
     result = match_characters_inner(
         tokens=data.get("tokens") or [],
         user_text=data.get("user_text") or "",
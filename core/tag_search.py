@@ -10,15 +10,34 @@ Index shape: each row of `danbooru_tag_wikis` (typically ~14k general
 tags ranked >= 200) is embedded with bge-small-en-v1.5, CLS-pooled,
 L2-normalized. Cosine == dot product on the index tensor.
 
-Diverges from `bucket_search.py` and `modifier_search.py` by persisting
-the index to disk: 14k rows × 384 floats = ~21 MB tensor; cold rebuild
-on CPU ~5–10 min. Every-restart rebuild was a development tax. Manifest
-fingerprint forces rebuild when the underlying table changes.
-
-Cache layout (under `<repo>/cache/tag_search/`):
-    manifest.json   {model_id, embed_dim, schema_version, fingerprint}
-    rows.jsonl      one tag row per line
-    index.npy       numpy float32 array [N, 384]
+The index is persisted to disk: 14k rows × 384 floats = ~21 MB; cold
+rebuild on CPU ~5–10 min. Every-restart rebuild was a development tax.
+Manifest fingerprint forces rebuild when the underlying table changes.
+(`bucket_search.py` and `modifier_search.py` share the format through
+`embed_index.sync_index`.)
+
+Cache layout (under `<repo>/cache/tag_search/`, see `embed_index.py`):
+    manifest.json   {model_id, embed_dim, schema_version, fingerprint, data_dir, ...}
+    data-<id>/      current generation: vectors.bin [N, 384] (memory-mapped),
+                    rows.bin + rows.idx (one JSON tag row per index row),
+                    hashes.bin (content hash of each row's body_full)
+
+The index is mapped, not loaded: opening it is a few mmaps shared through
+the page cache by every ComfyUI process on the host, scoring runs over the
+mapped matrix on CPU (~14k × 384 dot products), and only the returned hits
+are decoded into dicts. Caches in the previous index.npy + rows.jsonl
+layout are converted in place on first load rather than re-embedded.
+
+Vectors are stored at the `embed_index_dtype` config precision (float32
+default, float16 or per-row int8); changing it to a lower precision
+requantizes the cache in place, to a higher one re-embeds.
+
+A DB change re-embeds only the rows whose embedded text changed (per-row
+content hashes stored with the index); everything else is copied over.
+
+Past ANN_MIN_ROWS (merged booru / custom vocabularies) the brute-force
+matmul gives way to an IVF-flat index (`ann_index.py`) persisted next to
+the manifest; below it, brute force stays — exact and ~1 ms at 14k rows.
 
 Threshold/top_k calibration (Phase 0 probe + disambiguation test):
 - 0.55 threshold catches genuine semantic matches without surfacing
@@ -31,13 +50,19 @@ from __future__ import annotations
 
 import json
 import logging
-import re
 import sqlite3
 import threading
 from pathlib import Path
 from typing import Any, Callable
 
-from . import _embed_model
+from . import _embed_model, topk
+from . import config as global_config
+from .ann_index import DEFAULT_NPROBE, IVFIndex
+from .db_generation import (FingerprintGate, SearchStats, rows_by_key, tag_builder_generation,
+                            tag_builder_reads)
+from .embed_index import (PRECISION, EmbeddingIndex, content_hash, read_manifest,
+                          reuse_vectors, write_index)
+from .phrase_matcher import PhraseMatcher, VersionedBuild
 
 logger = logging.getLogger("promptchain.tag_search")
 _dbg = logging.getLogger("promptchain.ai.debug")
@@ -46,9 +71,10 @@ REPO_ROOT = Path(__file__).resolve().parent.parent
 DB_PATH = REPO_ROOT / "data" / "tag-builder" / "tag-builder.db"
 ALIASES_SEED_PATH = REPO_ROOT / "data" / "tag-builder" / "tag-aliases-seed.json"
 CACHE_DIR = REPO_ROOT / "cache" / "tag_search"
-INDEX_PATH = CACHE_DIR / "index.npy"
-ROWS_PATH = CACHE_DIR / "rows.jsonl"
 MANIFEST_PATH = CACHE_DIR / "manifest.json"
+# Pre-mmap layout; only read to migrate an existing cache.
+LEGACY_INDEX_PATH = CACHE_DIR / "index.npy"
+LEGACY_ROWS_PATH = CACHE_DIR / "rows.jsonl"
 
 # Bump this when the on-disk format changes (e.g. add fields to row
 # dicts, change pooling strategy). Mismatch → rebuild + rewrite cache.
@@ -61,20 +87,26 @@ MANIFEST_PATH = CACHE_DIR / "manifest.json"
 # phrase explicitly aliased).
 SCHEMA_VERSION = 3
 
+# ANN knobs. Row count at which search switches from brute force to the
+# IVF index; lists probed per query (recall vs latency — see
+# scripts/eval_ann_recall.py); list count (None → ~sqrt(rows)).
+ANN_MIN_ROWS = 200_000
+ANN_NPROBE = DEFAULT_NPROBE
+ANN_NLIST: int | None = None
+
 _lock = threading.RLock()
 _state: dict[str, Any] = {
-    "embeddings": None,        # torch.Tensor [N, 384]
-    "rows": [],                # list[dict] aligned with embeddings
+    "index": None,             # EmbeddingIndex over [N, 384] + N rows
+    "ann": None,               # IVFIndex over index.vectors, or None (brute force)
     "fingerprint": None,
 }
 
 # A transient DB lock made _fingerprint() return zeros, which read as
 # "table changed" and kicked off a 5–10 min CPU re-embed. Cache the last
-# good fingerprint + the DB mtime it was read at: return the cached value
-# on error (never treat a read failure as a change), and skip the recompute
-# entirely while the file is unchanged.
+# good fingerprint and return it on error (never treat a read failure as
+# a change); `_fp_gate` (below) skips the recompute entirely while the DB's
+# write generation is unchanged.
 _last_successful_fingerprint: tuple | None = None
-_last_db_mtime: float | None = None
 
 
 def _open_db() -> sqlite3.Connection:
@@ -243,73 +275,23 @@ def _read_rows() -> list[dict]:
     return out
 
 
-def _persist_index_to_disk() -> None:
-    """Atomic write — index.tmp + rename — so a crashed write doesn't
-    leave a half-written cache. Manifest goes last so its presence
-    signifies the other files are intact."""
-    if _state["embeddings"] is None or not _state["rows"]:
-        return
-    import numpy as np
-
-    CACHE_DIR.mkdir(parents=True, exist_ok=True)
-
-    arr = _state["embeddings"].cpu().numpy().astype("float32")
-    # numpy.save auto-appends .npy when the path doesn't already end in
-    # .npy. Put .tmp BEFORE the suffix so the path stays *.npy and
-    # numpy writes where we expect.
-    tmp_index = INDEX_PATH.with_name(INDEX_PATH.stem + ".tmp.npy")
-    np.save(tmp_index, arr, allow_pickle=False)
-    tmp_index.replace(INDEX_PATH)
-
-    tmp_rows = ROWS_PATH.with_name(ROWS_PATH.name + ".tmp")
-    with open(tmp_rows, "w", encoding="utf-8") as f:
-        for r in _state["rows"]:
-            f.write(json.dumps(r, ensure_ascii=False) + "\n")
-    tmp_rows.replace(ROWS_PATH)
-
-    manifest = {
+def _index_manifest(fingerprint: tuple) -> dict:
+    return {
         "model_id": _embed_model.MODEL_ID,
         "embed_dim": _embed_model.EMBED_DIM,
         "schema_version": SCHEMA_VERSION,
-        "fingerprint": list(_state["fingerprint"]),
-        "rowcount": len(_state["rows"]),
+        "fingerprint": list(fingerprint),
     }
-    tmp_manifest = MANIFEST_PATH.with_name(MANIFEST_PATH.name + ".tmp")
-    tmp_manifest.write_text(
-        json.dumps(manifest, indent=2),
-        encoding="utf-8",
-    )
-    tmp_manifest.replace(MANIFEST_PATH)
-    logger.info(
-        "tag_search: persisted %d rows to %s",
-        len(_state["rows"]), CACHE_DIR,
-    )
-
 
-def _load_index_from_disk() -> bool:
-    """Try to load the index from disk. Returns True on success and
-    state is populated. False on any mismatch (caller falls back to
-    rebuild). Mismatch reasons:
-      - any file missing
-      - manifest version != current SCHEMA_VERSION
-      - manifest model_id != current model
-      - manifest fingerprint != live DB fingerprint
-    """
-    if not (INDEX_PATH.exists() and ROWS_PATH.exists() and MANIFEST_PATH.exists()):
-        return False
-    try:
-        manifest = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
-    except Exception:
-        return False
 
+def _manifest_is_current(manifest: dict, live_fp: tuple) -> bool:
+    """Mismatch reasons (each logged): schema version, model, fingerprint."""
     if manifest.get("schema_version") != SCHEMA_VERSION:
         logger.info("tag_search: cache schema mismatch — rebuilding")
         return False
     if manifest.get("model_id") != _embed_model.MODEL_ID:
         logger.info("tag_search: cache model mismatch — rebuilding")
         return False
-
-    live_fp = _get_fingerprint_cached()
     cached_fp = tuple(manifest.get("fingerprint") or ())
     if cached_fp != live_fp:
         logger.info(
@@ -317,91 +299,258 @@ def _load_index_from_disk() -> bool:
             cached_fp, live_fp,
         )
         return False
+    return True
+
 
+def _persist_index_to_disk(embeddings, rows: list[dict], fingerprint: tuple,
+                           hashes: list[int]) -> bool:
+    """Write the mmap index as a new generation and swap the manifest to
+    it, so neither a crashed write nor a concurrent reader ever sees a mix
+    of old and new files. Returns False when the cache dir isn't writable
+    — caller keeps the index in memory for this process."""
+    try:
+        write_index(CACHE_DIR, embeddings, rows, _index_manifest(fingerprint),
+                    dtype=global_config.embed_index_dtype(), hashes=hashes)
+    except Exception:
+        logger.warning("tag_search: cache write failed — index kept in memory",
+                       exc_info=True)
+        return False
+    for path in (LEGACY_INDEX_PATH, LEGACY_ROWS_PATH):
+        path.unlink(missing_ok=True)
+    logger.info("tag_search: persisted %d rows to %s", len(rows), CACHE_DIR)
+    return True
+
+
+def _migrate_legacy_cache(live_fp: tuple) -> bool:
+    """Convert a current index.npy + rows.jsonl cache to the mmap layout
+    (same embeddings, no re-embed). False when there's nothing usable."""
+    if not (LEGACY_INDEX_PATH.exists() and LEGACY_ROWS_PATH.exists()):
+        return False
+    try:
+        manifest = json.loads(MANIFEST_PATH.read_text(encoding="utf-8"))
+    except Exception:
+        return False
+    if not _manifest_is_current(manifest, live_fp):
+        return False
     try:
         import numpy as np
-        import torch
-        arr = np.load(INDEX_PATH, allow_pickle=False)
-        # On-disk arrays are CPU float32; pin to whatever device the
-        # embed model lives on so query@index matmul doesn't hit a
-        # device-mismatch RuntimeError when the model is on CUDA.
-        loaded = _embed_model.get()
-        target_device = loaded[2] if loaded else "cpu"
-        embeddings = torch.from_numpy(arr).float().to(target_device)
+        arr = np.load(LEGACY_INDEX_PATH, allow_pickle=False)
         rows: list[dict] = []
-        with open(ROWS_PATH, encoding="utf-8") as f:
+        with open(LEGACY_ROWS_PATH, encoding="utf-8") as f:
             for line in f:
                 line = line.strip()
                 if line:
                     rows.append(json.loads(line))
     except Exception:
-        logger.warning("tag_search: cache load failed — rebuilding", exc_info=True)
+        logger.warning("tag_search: legacy cache unreadable — rebuilding", exc_info=True)
+        return False
+    hashes = [content_hash(r["body_full"]) for r in rows]
+    if arr.shape[0] != len(rows) or not _persist_index_to_disk(arr, rows, live_fp, hashes):
+        return False
+    logger.info("tag_search: converted legacy cache (%d rows) to mmap layout", len(rows))
+    return True
+
+
+def _requantize_cache(manifest: dict, dtype: str) -> bool:
+    """Rewrite the cache at `dtype` when that's no more precise than what's
+    stored (float32 → float16/int8, float16 → int8). Going up would only
+    pad the lost bits, so that returns False and the caller re-embeds."""
+    stored = manifest.get("dtype")
+    if PRECISION.get(stored, -1) < PRECISION[dtype]:
+        logger.info("tag_search: cache stored as %s, %s requested — rebuilding",
+                    stored, dtype)
+        return False
+    try:
+        index = EmbeddingIndex.open(CACHE_DIR, manifest)
+        vectors = index.dense(slice(None))
+        rows = [index.row(i) for i in range(len(index))]
+        hashes = [content_hash(r["body_full"]) for r in rows]
+    except Exception:
+        logger.warning("tag_search: cache unreadable for requantize", exc_info=True)
+        return False
+    fingerprint = tuple(manifest.get("fingerprint") or ())
+    if not _persist_index_to_disk(vectors, rows, fingerprint, hashes):
+        return False
+    logger.info("tag_search: requantized cache %s -> %s", stored, dtype)
+    return True
+
+
+def _load_index_from_disk() -> bool:
+    """Try to map the index from disk. Returns True on success and
+    state is populated. False on any mismatch (caller falls back to
+    rebuild). Mismatch reasons:
+      - any file missing / sizes disagree with the manifest
+      - manifest version != current SCHEMA_VERSION
+      - manifest model_id != current model
+      - manifest fingerprint != live DB fingerprint
+    """
+    live_fp = _get_fingerprint_cached()
+    manifest = read_manifest(CACHE_DIR)
+    if manifest is None:
+        if not _migrate_legacy_cache(live_fp):
+            return False
+        manifest = read_manifest(CACHE_DIR)
+        if manifest is None:
+            return False
+    elif not _manifest_is_current(manifest, live_fp):
         return False
+    want = global_config.embed_index_dtype()
+    if manifest.get("dtype") != want:
+        if not _requantize_cache(manifest, want):
+            return False
+        manifest = read_manifest(CACHE_DIR)
+        if manifest is None:
+            return False
 
-    if embeddings.shape[0] != len(rows):
-        logger.warning("tag_search: cache row/embedding count mismatch — rebuilding")
+    try:
+        index = EmbeddingIndex.open(CACHE_DIR, manifest)
+    except Exception:
+        logger.warning("tag_search: cache load failed — rebuilding", exc_info=True)
         return False
 
-    _state["embeddings"] = embeddings
-    _state["rows"] = rows
+    _state["index"] = index
     _state["fingerprint"] = live_fp
+    _state["ann"] = _ann_for(index, live_fp)
     logger.info(
-        "tag_search: loaded %d rows from disk cache", len(rows),
+        "tag_search: mapped %d rows from disk cache", len(index),
     )
     return True
 
 
+def _ann_for(index: EmbeddingIndex, fingerprint: tuple) -> IVFIndex | None:
+    """IVF index for `index` when it's past ANN_MIN_ROWS: the persisted one
+    if it matches, else build (seconds, vs hours to embed that many rows)
+    and persist. None below the threshold — brute force."""
+    if len(index) < ANN_MIN_ROWS:
+        return None
+    dim = index.dim
+    ann = IVFIndex.load(CACHE_DIR, len(index), dim, list(fingerprint))
+    if ann is not None and (ANN_NLIST is None or ann.nlist == ANN_NLIST):
+        return ann
+    logger.info("tag_search: building IVF index over %d rows", len(index))
+    ann = IVFIndex.build(index, nlist=ANN_NLIST)
+    try:
+        ann.save(CACHE_DIR, list(fingerprint))
+    except Exception:
+        logger.warning("tag_search: IVF index write failed — kept in memory",
+                       exc_info=True)
+    return ann
+
+
+def _previous_index() -> EmbeddingIndex | None:
+    """The index a rebuild can copy unchanged rows' vectors from: the live
+    one, else a disk cache from the same model/schema even though its
+    fingerprint is stale (that staleness is why we're rebuilding)."""
+    index = _state["index"]
+    if index is None:
+        manifest = read_manifest(CACHE_DIR)
+        if (manifest is None or manifest.get("schema_version") != SCHEMA_VERSION
+                or manifest.get("model_id") != _embed_model.MODEL_ID):
+            return None
+        try:
+            index = EmbeddingIndex.open(CACHE_DIR, manifest)
+        except Exception:
+            return None
+    if index.hashes is None:
+        # Written before per-row hashes: derive them from the stored rows
+        # (a decode pass, vs re-embedding every row).
+        import numpy as np
+        index.hashes = np.array([content_hash(index.row(i)["body_full"])
+                                 for i in range(len(index))], dtype=np.uint64)
+    return index
+
+
 def _rebuild_index(on_status: Callable[[str], None] | None = None) -> None:
+    """Bring the index in line with the DB, embedding only rows whose
+    embedded text (by content hash) the previous index doesn't have —
+    one edited wiki re-embeds one row, not 14k. Deleted rows drop out,
+    reordered ones move. The new index is written as a fresh generation
+    and swapped in whole (see embed_index.write_index)."""
     if _embed_model.get() is None:
         return
     rows = _read_rows()
     if not rows:
-        _state["embeddings"] = None
-        _state["rows"] = []
+        _state["index"] = None
+        _state["ann"] = None
         _state["fingerprint"] = _fingerprint()
         return
     # Embed body_full — gives bge-small enough surface area to
     # disambiguate. body_summary is what we surface to Qwen, but the
     # full body is the better embedding source.
     texts = [r["body_full"] for r in rows]
+    hashes = [content_hash(t) for t in texts]
     device = _embed_model.get()[2] if _embed_model.get() else "cpu"
-    eta = "~30s on GPU" if device == "cuda" else "~5-10 min on CPU"
-    logger.info("tag_search: embedding %d tag wikis on %s (%s)", len(rows), device, eta)
-    if on_status:
-        on_status(f"Rebuilding tag index ({len(rows):,} rows, {eta}, one-time)")
     # Larger batches on GPU — bge-small is small, throughput-bound.
     batch = 256 if device == "cuda" else 64
-    embeddings = _embed_model.embed(texts, batch_size=batch)
-    if embeddings is None:
+
+    def embed(positions: list[int]):
+        todo = len(positions)
+        if todo > 1000:
+            eta = "~30s on GPU" if device == "cuda" else "~5-10 min on CPU"
+            logger.info("tag_search: embedding %d of %d tag wikis on %s (%s)",
+                        todo, len(rows), device, eta)
+            if on_status:
+                on_status(f"Rebuilding tag index ({todo:,} rows, {eta}, one-time)")
+        else:
+            logger.info("tag_search: embedding %d changed tag wiki(s) of %d", todo, len(rows))
+        report: dict = {}
+
+        def progress(r: dict) -> None:
+            if todo > 1000:
+                logger.info("tag_search: embedded %d/%d (%s)", r["texts"], todo,
+                            _embed_model.describe_report(r))
+
+        out = _embed_model.embed([texts[i] for i in positions], batch_size=batch,
+                                 report=report, on_progress=progress)
+        if out is None:
+            raise RuntimeError("embed model not loaded")
+        logger.info("tag_search: embed pass: %s", _embed_model.describe_report(report))
+        return _embed_model._as_numpy(out)
+
+    try:
+        arr, embedded = reuse_vectors(_previous_index(), hashes,
+                                      _embed_model.EMBED_DIM, embed)
+    except RuntimeError:
         logger.warning("tag_search: embed() returned None — model not loaded")
         return
-    _state["embeddings"] = embeddings
-    _state["rows"] = rows
-    _state["fingerprint"] = _fingerprint()
-    logger.info("tag_search: indexed %d tag wikis", len(rows))
-    _persist_index_to_disk()
+    fingerprint = _fingerprint()
+    index = None
+    if _persist_index_to_disk(arr, rows, fingerprint, hashes):
+        manifest = read_manifest(CACHE_DIR)
+        try:
+            index = EmbeddingIndex.open(CACHE_DIR, manifest) if manifest else None
+        except Exception:
+            logger.warning("tag_search: re-open after persist failed", exc_info=True)
+    _state["index"] = index or EmbeddingIndex.from_memory(
+        arr, rows, dtype=global_config.embed_index_dtype(), hashes=hashes)
+    _state["fingerprint"] = fingerprint
+    _state["ann"] = _ann_for(_state["index"], fingerprint)
+    logger.info("tag_search: indexed %d tag wikis (%d embedded, %d reused)",
+                len(rows), embedded, len(rows) - embedded)
+
+
+_fp_gate = FingerprintGate(tag_builder_generation(), _fingerprint)
+_stats = SearchStats("tag_search", extra=lambda: {"fingerprint": _fp_gate.stats()})
 
 
 def _get_fingerprint_cached() -> tuple:
     """Gate the expensive _fingerprint() (DDL + alias seed-sync + two
-    aggregate scans) on the DB file mtime. The fingerprint only changes
-    when the file changes, so while mtime is steady — the common case for
-    a search — return the cached value and skip the query entirely."""
-    global _last_db_mtime
-    try:
-        current_mtime = DB_PATH.stat().st_mtime
-    except Exception:
-        return _fingerprint()
-    if _last_db_mtime == current_mtime and _last_successful_fingerprint is not None:
-        return _last_successful_fingerprint
-    _last_db_mtime = current_mtime
-    return _fingerprint()
+    aggregate scans) on the DB's write generation (db_generation.py). The
+    fingerprint only changes when something writes the DB, so while the
+    generation is steady — the common case for a search — return the
+    cached value and skip the query entirely."""
+    return _fp_gate.get()
+
+
+def search_stats() -> dict:
+    """Mean / last per-phase search overhead (ms) and fingerprint gate counts."""
+    return _stats.snapshot()
 
 
 def _ensure_index_fresh(on_status: Callable[[str], None] | None = None) -> None:
     """Try disk first, then rebuild. Disk load is fast; rebuild is the
     minutes-long path."""
-    if _state["embeddings"] is not None and _state["fingerprint"] == _get_fingerprint_cached():
+    if _state["index"] is not None and _state["fingerprint"] == _get_fingerprint_cached():
         return
     if _load_index_from_disk():
         return
@@ -421,47 +570,62 @@ def search(user_text: str, top_k: int = 12,
     user_text = (user_text or "").strip()
     if not user_text:
         return []
+    if _embed_model.get() is None:
+        return []
+    run = _stats.start()
+    # The lock only covers the freshness check. A rebuild swaps in a new
+    # index rather than mutating the old one, so scoring a snapshot is
+    # safe — and the query embed, outside the lock, can share a batched
+    # forward pass with other concurrent searches.
     with _lock:
-        if _embed_model.get() is None:
-            return []
         _ensure_index_fresh(on_status=on_status)
-        if _state["embeddings"] is None or not _state["rows"]:
-            return []
-        qv = _embed_model.embed([user_text])
-        if qv is None:
-            return []
-        scores = (_state["embeddings"] @ qv.T).squeeze(-1).tolist()
-        paired = list(zip(_state["rows"], scores))
-        paired.sort(key=lambda x: -x[1])
-        out: list[dict] = []
-        for row, score in paired[:top_k]:
-            if score < threshold:
-                break
-            entry = dict(row)
-            entry["score"] = float(score)
-            out.append(entry)
-        return out
-
-
-_ALIAS_LOOKUP_CACHE: list[tuple[str, str]] | None = None
+        index, ann = _state["index"], _state["ann"]
+    run.lap("fresh")
+    if index is None or not len(index):
+        return []
+    qv = _embed_model.embed_cached([user_text])
+    if qv is None:
+        return []
+    q = qv[0]
+    run.lap("embed")
+    if ann is not None:
+        hits = ann.search(index, q, top_k, threshold, nprobe=ANN_NPROBE)
+    else:
+        hits = topk.top_k(index.scores(q), top_k, threshold)
+    run.lap("score")
+    out: list[dict] = []
+    for i, score in hits:
+        entry = index.row(i)
+        entry["score"] = score
+        out.append(entry)
+    run.lap("hydrate")
+    _dbg.debug("tag_search: overhead %s", run.finish())
+    return out
 
 
-def _alias_lookup_list() -> list[tuple[str, str]]:
+def _build_alias_lookup() -> tuple[list[tuple[str, str]], PhraseMatcher]:
     """Flatten the per-tag alias map into a single list of (alias, tag)
-    sorted by alias length descending. Sorted-by-length matters: when
-    "close-up of feet" and "close up" are both aliases, the longer one
-    must match first or the shorter one wins by accident. Cached at
-    module level — invalidate by setting `_ALIAS_LOOKUP_CACHE = None`."""
-    global _ALIAS_LOOKUP_CACHE
-    if _ALIAS_LOOKUP_CACHE is not None:
-        return _ALIAS_LOOKUP_CACHE
+    sorted by alias length descending, plus a PhraseMatcher over the
+    aliases (phrase id = position in that list). Sorted-by-length matters:
+    when "close-up of feet" and "close up" are both aliases, the longer
+    one must match first or the shorter one wins by accident."""
     pairs: list[tuple[str, str]] = []
     for tag, aliases in _load_aliases_by_tag().items():
         for alias in aliases:
             pairs.append((alias, tag))
     pairs.sort(key=lambda p: -len(p[0]))
-    _ALIAS_LOOKUP_CACHE = pairs
-    return pairs
+    return pairs, PhraseMatcher(alias for alias, _ in pairs)
+
+
+# Rebuilt when the fingerprint moves — it covers the tag_aliases table,
+# and is itself gated on the DB write generation, so a steady DB costs
+# one generation check per scan.
+_alias_lookup = VersionedBuild(_get_fingerprint_cached, _build_alias_lookup)
+
+
+def _alias_lookup_list() -> list[tuple[str, str]]:
+    """(alias, tag) pairs, longest alias first. See _build_alias_lookup."""
+    return _alias_lookup.get()[0]
 
 
 def alias_scan(user_text: str) -> list[dict]:
@@ -478,57 +642,64 @@ def alias_scan(user_text: str) -> list[dict]:
     text = (user_text or "").lower()
     if not text:
         return []
-    pairs = _alias_lookup_list()
+    pairs, matcher = _alias_lookup.get()
     if not pairs:
         return []
+    # One automaton pass finds every alias present (with word boundaries,
+    # so 'close up' doesn't fire inside 'enclosed up there'); walking the
+    # hit ids in order keeps the longest-alias-first pick per tag.
     seen: set[str] = set()
-    out: list[dict] = []
-    for alias, tag in pairs:
-        if tag in seen:
-            continue
-        # Whitespace/punctuation boundary on both sides. Avoids matching
-        # 'close up' inside 'enclosed up there'. Allow alias to contain
-        # spaces, hyphens, etc. — re.escape keeps it literal.
-        pat = re.compile(r"(?<![A-Za-z0-9_])" + re.escape(alias) + r"(?![A-Za-z0-9_])")
-        if pat.search(text):
-            row = _row_for_tag(tag)
-            entry = {
-                "tag": tag,
-                "ranking": (row or {}).get("ranking", 0),
-                "score": 1.0,
-                "body_summary": (row or {}).get("body_summary", ""),
-                "body_full": (row or {}).get("body_full", ""),
-                "matched_alias": alias,
-            }
-            out.append(entry)
+    picked: list[tuple[str, str]] = []
+    for i in sorted({hit.phrase_id for hit in matcher.scan(text)}):
+        alias, tag = pairs[i]
+        if tag not in seen:
+            picked.append((tag, alias))
             seen.add(tag)
+    rows = _rows_for_tags([tag for tag, _ in picked])
+    out: list[dict] = []
+    for tag, alias in picked:
+        row = rows.get(tag) or {}
+        out.append({
+            "tag": tag,
+            "ranking": row.get("ranking", 0),
+            "score": 1.0,
+            "body_summary": row.get("body_summary", ""),
+            "body_full": row.get("body_full", ""),
+            "matched_alias": alias,
+        })
     return out
 
 
-def _row_for_tag(tag: str) -> dict | None:
-    """Lookup helper for alias_scan — pulls wiki row directly from DB
-    rather than scanning the in-memory index, so this works even when
-    the embed model is unavailable and the index isn't loaded."""
+def _rows_for_tags(tags: list[str]) -> dict[str, dict]:
+    """Hydration helper for alias_scan — pulls the wiki rows for every hit
+    straight from the DB (one IN query on the pooled read-only connection)
+    rather than the in-memory index, so this works even when the embed
+    model is unavailable and the index isn't loaded. The index rows
+    wouldn't do anyway: their body_full carries the alias augmentation.
+    Tags without a wiki row are absent; {} on DB error."""
+    if not tags:
+        return {}
     try:
-        conn = _open_db()
-        r = conn.execute(
+        rows = rows_by_key(
+            tag_builder_reads().get(),
             "SELECT t.tag, t.body_full, t.body_summary, d.ranking "
             "FROM danbooru_tag_wikis t "
             "LEFT JOIN danbooru_tags d ON d.tag = t.tag "
-            "WHERE t.tag = ?",
-            (tag,),
-        ).fetchone()
-        conn.close()
-        if not r:
-            return None
-        return {
+            "WHERE t.tag IN ({})",
+            tags,
+        )
+    except Exception:
+        logger.warning("tag_search: alias hit hydration failed", exc_info=True)
+        return {}
+    out: dict[str, dict] = {}
+    for r in rows:
+        out.setdefault(r["tag"], {
             "tag": r["tag"],
             "body_full": r["body_full"] or "",
             "body_summary": r["body_summary"] or "",
             "ranking": int(r["ranking"] or 0),
-        }
-    except Exception:
-        return None
+        })
+    return out
 
 
 def warmup() -> None:
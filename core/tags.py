@@ -19,17 +19,24 @@ import hashlib
 import json
 import os
 import shutil
+import threading
+import time
 from pathlib import Path
 from typing import Optional
 
 import folder_paths
 
 from . import config as global_config
+from .api_utils import atomic_write_json
+from .tag_index import TagSearchIndex, build_name_map, normalize_tag_name
 
 MIN_RANKING_THRESHOLD = 100
 
 _MANIFEST_FILE = "tags_manifest.json"
 
+# Curator-authored phrasings for canonical tags (shared with tag_search).
+_ALIASES_SEED = Path(__file__).parent.parent / "data" / "tag-builder" / "tag-aliases-seed.json"
+
 
 # ── paths ─────────────────────────────────────────────────────────
 
@@ -53,8 +60,45 @@ def _hash_file(path: Path) -> str:
     return h.hexdigest()[:16]
 
 
+class _StatCache:
+    """Digests keyed by path, reused while (size, mtime_ns) is unchanged.
+
+    Backs the manifest's "file_stats" map so boot only re-hashes CSVs whose
+    stat moved. `seen` collects the entries touched this pass, letting the
+    sync drop stale paths when it writes the manifest back."""
+
+    def __init__(self, stats: dict):
+        self.stats = stats
+        self.seen: dict[str, dict] = {}
+        self.hashed = 0
+
+    def digest(self, path: Path) -> str:
+        st = path.stat()
+        key = str(path)
+        entry = self.stats.get(key)
+        if not (entry and entry.get("size") == st.st_size
+                and entry.get("mtime_ns") == st.st_mtime_ns):
+            entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                     "digest": _hash_file(path)}
+            self.hashed += 1
+        self.seen[key] = entry
+        return entry["digest"]
+
+    def record(self, path: Path, digest: str):
+        """Note a digest already known (e.g. a file just copied from one we
+        hashed) without reading it again."""
+        st = path.stat()
+        self.seen[str(path)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                                "digest": digest}
+
+
 # ── manifest ──────────────────────────────────────────────────────
 
+# Held across every manifest read-modify-write: the background sync, a
+# reload's sync and restore_file can run concurrently, and each rewrites
+# the whole file (file_stats included).
+_manifest_lock = threading.RLock()
+
 
 def _manifest_path() -> Path:
     return Path(folder_paths.get_user_directory()) / "PromptChain" / _MANIFEST_FILE
@@ -74,8 +118,7 @@ def _load_manifest() -> dict:
 def _save_manifest(manifest: dict):
     path = _manifest_path()
     path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(manifest, f, indent=2)
+    atomic_write_json(path, manifest)
 
 
 # ── onboarding + sync ────────────────────────────────────────────
@@ -86,25 +129,40 @@ def sync_tag_files() -> dict[str, str]:
     Ensure user tag dir is populated and up to date.
     Returns {filename: state} where state is default/modified/removed/custom.
     """
+    return _sync_tag_files()[0]
+
+
+def _sync_tag_files() -> tuple[dict[str, str], set[str]]:
+    """sync_tag_files, also returning the names of user files it rewrote."""
+    with _manifest_lock:
+        return _sync_tag_files_locked()
+
+
+def _sync_tag_files_locked() -> tuple[dict[str, str], set[str]]:
+    started = time.perf_counter()
     system_dir = _system_tags_dir()
     user_dir = _user_tags_dir()
     user_dir.mkdir(parents=True, exist_ok=True)
 
     manifest = _load_manifest()
     system_hashes = manifest.get("system_hashes", {})
+    cache = _StatCache(manifest.get("file_stats", {}))
     onboarded = global_config.is_onboarded()
 
     system_csvs = {f.name: f for f in system_dir.glob("*.csv")} if system_dir.is_dir() else {}
 
     states: dict[str, str] = {}
+    copied: set[str] = set()
 
     for filename, system_path in system_csvs.items():
         user_path = user_dir / filename
-        current_system_hash = _hash_file(system_path)
+        current_system_hash = cache.digest(system_path)
 
         if not onboarded:
             # First boot — copy all system files
             shutil.copy2(system_path, user_path)
+            cache.record(user_path, current_system_hash)
+            copied.add(filename)
             system_hashes[filename] = current_system_hash
             states[filename] = "default"
             continue
@@ -116,7 +174,7 @@ def sync_tag_files() -> dict[str, str]:
             continue
 
         stored_system_hash = system_hashes.get(filename)
-        user_hash = _hash_file(user_path)
+        user_hash = cache.digest(user_path)
 
         system_changed = stored_system_hash != current_system_hash
         user_changed = user_hash != stored_system_hash
@@ -124,6 +182,8 @@ def sync_tag_files() -> dict[str, str]:
         if not user_changed and system_changed:
             # System updated, user hasn't touched it — auto-update
             shutil.copy2(system_path, user_path)
+            cache.record(user_path, current_system_hash)
+            copied.add(filename)
             system_hashes[filename] = current_system_hash
             states[filename] = "default"
         elif user_changed:
@@ -140,9 +200,13 @@ def sync_tag_files() -> dict[str, str]:
             states[f.name] = "custom"
 
     manifest["system_hashes"] = system_hashes
+    manifest["file_stats"] = cache.seen
     _save_manifest(manifest)
 
-    return states
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    print(f"[PromptChain] Tag sync: {len(system_csvs)} system file(s), "
+          f"{cache.hashed} hashed, {len(copied)} copied in {elapsed_ms:.0f} ms")
+    return states, copied
 
 
 def restore_file(filename: str) -> bool:
@@ -152,14 +216,20 @@ def restore_file(filename: str) -> bool:
         return False
     user_dir = _user_tags_dir()
     user_path = user_dir / filename
-    shutil.copy2(system_path, user_path)
-
-    # Update manifest
-    manifest = _load_manifest()
-    system_hashes = manifest.get("system_hashes", {})
-    system_hashes[filename] = _hash_file(system_path)
-    manifest["system_hashes"] = system_hashes
-    _save_manifest(manifest)
+    with _manifest_lock:
+        shutil.copy2(system_path, user_path)
+
+        # Update manifest
+        manifest = _load_manifest()
+        system_hashes = manifest.get("system_hashes", {})
+        stats = manifest.get("file_stats", {})
+        cache = _StatCache(stats)
+        digest = cache.digest(system_path)
+        cache.record(user_path, digest)
+        system_hashes[filename] = digest
+        manifest["system_hashes"] = system_hashes
+        manifest["file_stats"] = {**stats, **cache.seen}
+        _save_manifest(manifest)
     return True
 
 
@@ -169,6 +239,7 @@ def get_file_states() -> dict[str, str]:
     user_dir = _user_tags_dir()
     manifest = _load_manifest()
     system_hashes = manifest.get("system_hashes", {})
+    cache = _StatCache(manifest.get("file_stats", {}))
 
     system_csvs = {f.name: f for f in system_dir.glob("*.csv")} if system_dir.is_dir() else {}
     states: dict[str, str] = {}
@@ -182,7 +253,7 @@ def get_file_states() -> dict[str, str]:
         if not stored_hash:
             states[filename] = "default"
             continue
-        user_hash = _hash_file(user_path)
+        user_hash = cache.digest(user_path)
         states[filename] = "modified" if user_hash != stored_hash else "default"
 
     for f in user_dir.glob("*.csv"):
@@ -192,6 +263,30 @@ def get_file_states() -> dict[str, str]:
     return states
 
 
+# ── aliases ───────────────────────────────────────────────────────
+
+
+def _load_alias_map() -> dict[str, str]:
+    """Normalized alias -> normalized canonical name, from the alias seed.
+    An alias listed under several canonicals keeps the first. Missing or
+    unreadable seed -> {} (lookups still work by name)."""
+    try:
+        with open(_ALIASES_SEED, "r", encoding="utf-8") as f:
+            seed = json.load(f)
+    except Exception:
+        return {}
+    aliases: dict[str, str] = {}
+    for canonical, phrasings in seed.items():
+        if canonical.startswith("_") or not isinstance(phrasings, list):
+            continue
+        target = normalize_tag_name(canonical)
+        for phrase in phrasings:
+            key = normalize_tag_name(str(phrase or ""))
+            if key and key != target:
+                aliases.setdefault(key, target)
+    return aliases
+
+
 # ── tag store ─────────────────────────────────────────────────────
 
 
@@ -202,29 +297,51 @@ class TagStore:
         self.sources: dict[str, dict] = {}
         self._loaded = False
         self._file_states: dict[str, str] = {}
+        self._aliases: dict[str, str] = {}
+        self._lock = threading.RLock()
 
     def load_all(self):
         if self._loaded:
             return
-        # Sync system → user on first load
-        self._file_states = sync_tag_files()
-
-        user_dir = _user_tags_dir()
-        if not user_dir.is_dir():
+        with self._lock:
+            if self._loaded:
+                return
+            started = time.perf_counter()
+            deferred = global_config.is_tag_sync_background() and global_config.is_onboarded()
+            if not deferred:
+                # Sync system → user on first load
+                self._file_states = sync_tag_files()
+            self._aliases = _load_alias_map()
+
+            user_dir = _user_tags_dir()
+            if user_dir.is_dir():
+                for csv_path in sorted(user_dir.glob("*.csv")):
+                    self._load_source(csv_path)
+                print(f"[PromptChain] Loaded {len(self.sources)} tag source(s) from {user_dir} "
+                      f"in {(time.perf_counter() - started) * 1000:.0f} ms")
             self._loaded = True
-            return
+        if deferred:
+            threading.Thread(target=self._background_sync, daemon=True).start()
 
-        for csv_path in sorted(user_dir.glob("*.csv")):
-            self._load_source(csv_path)
-
-        self._loaded = True
-        print(f"[PromptChain] Loaded {len(self.sources)} tag source(s) from {user_dir}")
+    def _background_sync(self):
+        """Deferred sync (tag_sync_background): reload only the sources whose
+        user file the sync rewrote."""
+        try:
+            states, copied = _sync_tag_files()
+        except Exception as e:
+            print(f"[PromptChain] Background tag sync failed: {e}")
+            return
+        with self._lock:
+            self._file_states = states
+            for filename in sorted(copied):
+                self._load_source(_user_tags_dir() / filename)
 
     def reload(self):
         """Force reload — re-syncs files and reloads all sources."""
-        self.sources.clear()
-        self._loaded = False
-        self.load_all()
+        with self._lock:
+            self.sources.clear()
+            self._loaded = False
+            self.load_all()
 
     def _load_source(self, csv_path: Path):
         source_name = csv_path.stem
@@ -260,7 +377,11 @@ class TagStore:
                         continue
 
             tags.sort(key=lambda x: -x["ranking"])
-            self.sources[source_name] = {"tags": tags, "by_id": by_id, "count": len(tags)}
+            self.sources[source_name] = {
+                "tags": tags, "by_id": by_id, "count": len(tags),
+                "by_name": build_name_map(tags),
+                "index": TagSearchIndex(tags, MIN_RANKING_THRESHOLD),
+            }
             state = self._file_states.get(csv_path.name, "")
             suffix = f" [{state}]" if state == "modified" else ""
             print(f"[PromptChain]   {source_name}: {len(tags):,} tags{suffix}")
@@ -286,28 +407,11 @@ class TagStore:
         query_stripped = query_lower.rstrip("_")
         query_words = [w for w in query_stripped.replace("_", " ").split() if w]
 
-        matches = []
-        for tag in tags:
-            ranking = tag["ranking"]
-            if ranking > 0 and MIN_RANKING_THRESHOLD > 0 and ranking < MIN_RANKING_THRESHOLD:
-                continue
-
-            sk = tag["_search"]
-            contiguous = query_lower in sk or query_stripped in sk
-            multi = False
-            if not contiguous and len(query_words) > 1:
-                multi = all(w in sk for w in query_words)
-            if not contiguous and not multi:
-                continue
-
-            if ranking > 0:
-                sort_key = (0, -ranking, "")
-            else:
-                sort_key = (1, 0, sk)
-            matches.append((sort_key, tag))
-
-        matches.sort(key=lambda x: x[0])
-        return [_format(m[1]) for m in matches[:limit]]
+        # Ranked matches by post count, then unranked by name — the index's
+        # position order, so the first `limit` hits are the answer.
+        index = self.sources[source_name]["index"]
+        return [_format(t) for t in index.search(query_lower, query_stripped,
+                                                 query_words, limit)]
 
     def search_stacked(self, source_names: list[str], query: str, limit: int = 20) -> list[dict]:
         self.load_all()
@@ -337,15 +441,48 @@ class TagStore:
         if tag_id is not None:
             tag = by_id.get(tag_id)
         elif tag_name:
-            needle = tag_name.lower().replace(" ", "_")
-            for t in source["tags"]:
-                if t["_search"] == needle:
-                    tag = t
-                    break
+            tag = self._resolve(source, tag_name)
         if not tag:
             return []
         return [_format(by_id[sid]) for sid in tag.get("similar", [])[:limit] if sid in by_id]
 
+    def lookup_many(self, names: list[str],
+                    source_names: list[str] | None = None) -> list[dict | None]:
+        """Resolve a batch of tag names (or curated aliases) in one call.
+
+        Returns one entry per input name, in order: the formatted tag plus
+        "source", or None when no source knows it. Sources are tried in
+        `source_names` order (default: every loaded source), first hit wins —
+        the same stacking rule as search_stacked."""
+        self.load_all()
+        if source_names is None:
+            sources = list(self.sources.items())
+        else:
+            sources = [(n, self.sources[n]) for n in source_names if n in self.sources]
+        results: list[dict | None] = []
+        for name in names:
+            hit = None
+            for source_name, source in sources:
+                tag = self._resolve(source, name)
+                if tag is not None:
+                    hit = _format(tag)
+                    hit["source"] = source_name
+                    break
+            results.append(hit)
+        return results
+
+    def _resolve(self, source: dict, name: str) -> dict | None:
+        """Exact tag for `name` in one source: by normalized name, then via
+        the alias map."""
+        key = normalize_tag_name(name or "")
+        if not key:
+            return None
+        by_name = source["by_name"]
+        tag = by_name.get(key)
+        if tag is None and key in self._aliases:
+            tag = by_name.get(self._aliases[key])
+        return tag
+
 
 def _format(tag: dict) -> dict:
     return {"id": tag["id"], "tag": tag["tag"], "category": tag["category"], "ranking": tag["ranking"]}
@@ -0,0 +1,68 @@
+"""
+Top-k selection shared by the embedding searches.
+
+tag_search, bucket_search and modifier_search each score every index row
+and then only ever use the best 2–150. The old path turned all N scores
+into Python floats and sorted them; `top_k` selects on the array instead
+(np.argpartition, or torch.topk when handed a tensor) and converts just
+the k winners. Masks and thresholds are applied on the array too, before
+anything becomes a Python object.
+
+Order matches a stable sort on -score: best first, equal scores by lower
+row index — so swapping a `sorted(...)[:k]` for `top_k` changes nothing
+but the cost. (Tensors go through torch.topk and keep its tie order.)
+"""
+from __future__ import annotations
+
+
+def top_k(scores, k: int, threshold: float | None = None,
+          mask=None) -> list[tuple[int, float]]:
+    """[(row index, score)] for the `k` highest `scores`, best first.
+
+    `scores` is a 1-D numpy array or torch tensor. `mask` (same length,
+    bool, same library) keeps only rows where it's True. `threshold` drops
+    scores below it. Either may leave fewer than `k` results."""
+    if k <= 0:
+        return []
+    if hasattr(scores, "topk"):
+        return _top_k_torch(scores, k, threshold, mask)
+    import numpy as np
+
+    s = np.asarray(scores, dtype=np.float32).reshape(-1)
+    if mask is not None:
+        s = np.where(mask, s, np.float32(-np.inf))
+    n = s.shape[0]
+    if n == 0:
+        return []
+    if k < n:
+        kth = s[np.argpartition(-s, k - 1)[:k]].min()
+        above = np.flatnonzero(s > kth)
+        ties = np.flatnonzero(s == kth)[:k - len(above)]
+        picked = np.concatenate([above, ties])
+    else:
+        picked = np.arange(n)
+    picked = picked[np.lexsort((picked, -s[picked]))]
+    out: list[tuple[int, float]] = []
+    for i, score in zip(picked.tolist(), s[picked].tolist()):
+        if score == float("-inf") or (threshold is not None and score < threshold):
+            break
+        out.append((i, score))
+    return out
+
+
+def _top_k_torch(scores, k, threshold, mask) -> list[tuple[int, float]]:
+    import torch
+
+    s = scores.reshape(-1)
+    if mask is not None:
+        s = s.masked_fill(~mask, float("-inf"))
+    k = min(k, s.shape[0])
+    if k == 0:
+        return []
+    values, indices = torch.topk(s, k)
+    out: list[tuple[int, float]] = []
+    for i, score in zip(indices.tolist(), values.tolist()):
+        if score == float("-inf") or (threshold is not None and score < threshold):
+            break
+        out.append((i, score))
+    return out
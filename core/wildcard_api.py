@@ -9,9 +9,11 @@ from .compiler import (
     add_wildcard_path,
     get_wildcard_info,
     get_wildcard_paths,
+    invalidate_wildcard_cache,
     parse_wildcard_file,
     remove_wildcard_path,
     resolve_wildcard_name,
+    wildcard_cache_stats,
 )
 
 routes = server.PromptServer.instance.routes
@@ -108,7 +110,9 @@ async def _api_wildcard_content_write(request):
     except Exception as e:
         return web.json_response({"error": f"write_error: {e}"}, status=500)
 
-    # invalidate wildcard list cache so changes are picked up
+    # invalidate wildcard list cache so changes are picked up (the parsed-file
+    # cache would catch the new mtime anyway; dropping it is just explicit)
+    invalidate_wildcard_cache(found_path)
     global _wildcard_list_cache, _wildcard_list_mtime
     _wildcard_list_cache = None
     _wildcard_list_mtime = 0.0
@@ -184,6 +188,11 @@ async def _api_list_wildcards(request):
         return web.json_response({"wildcards": wildcards})
 
 
+@routes.get("/promptchain/wildcard/cache")
+async def _api_wildcard_cache_stats(request):
+    return web.json_response(wildcard_cache_stats())
+
+
 # ── wildcard path management ─────────────────────────────────────
 
 @routes.post("/promptchain/wildcard/paths")
@@ -200,6 +209,7 @@ async def _api_wildcard_paths(request):
         add_wildcard_path(path)
     elif action == "remove" and path:
         remove_wildcard_path(path)
+        invalidate_wildcard_cache()
     paths = [str(p) for p in get_wildcard_paths()]
     return web.json_response({"status": "ok", "paths": paths})
 
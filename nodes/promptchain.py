@@ -1,10 +1,15 @@
 import json
 import re
-import random
 
 from comfy_api.latest import io
 from ..core.bundle import make_bundle, parse_bundle
-from ..core.compiler import compile_prompt, compile_regions, combine_tags, deduplicate
+from ..core.compiler import (
+    combine_tags,
+    compile_prompt_cached as compile_prompt,
+    compile_prompt_regions_cached as compile_prompt_regions,
+    deduplicate,
+    make_rng,
+)
 from ..core.load_image_prompts import resolve_load_image_keywords
 from ..core.iterate_state import (
     content_hash,
@@ -75,6 +80,9 @@ class PromptChainNode(io.ComfyNode):
     @classmethod
     def fingerprint_inputs(cls, **kwargs):
         # Force re-execution so wildcards reshuffle and roll mode re-rolls.
+        # Deterministic chains don't pay for it: compile_prompt(_regions) goes
+        # through the compiler's compile cache, which only stores results
+        # that drew no randomness and re-validates the wildcard files they read.
         return float("nan")
 
     @classmethod
@@ -122,9 +130,10 @@ class PromptChainNode(io.ComfyNode):
                                  ui={"text": [pos], "neg_text": [neg],
                                      "regions": [regions_out]})
 
-        # re-seed from OS entropy so wildcards reshuffle even if something
-        # upstream (e.g. a reproducibility plugin) set a fixed seed
-        random.seed()
+        # Own RNG from OS entropy so wildcards reshuffle even if something
+        # upstream (e.g. a reproducibility plugin) set a fixed seed — and so no
+        # other node's use of the global `random` module can perturb ours.
+        rng = make_rng()
 
         # resolve __LoadImagePositive__ / __LoadImageNegative__ keywords
         load_image_prompts = resolve_load_image_keywords(prompt, cls.hidden.prompt)
@@ -153,6 +162,7 @@ class PromptChainNode(io.ComfyNode):
                 unique_id, subordinate,
                 load_image_prompts=load_image_prompts,
                 wildcard_modes=_wc_modes,
+                rng=rng,
             )
 
         # ── standard modes (combine, roll, switch) ─────────────
@@ -166,10 +176,13 @@ class PromptChainNode(io.ComfyNode):
             compile_mode = "combine"
             # remove ::Label:: lines entirely so they don't leak into output
             compile_text = re.sub(r"^::([^:]+)::.*$", "", prompt, flags=re.MULTILINE)
-        processed_pos, processed_neg, _metadata = compile_prompt(
+        # Regional split rides the same compile: the flat prompt and the
+        # global/$name{} pieces share one comment strip + span scan, and a
+        # prompt without groups is compiled once for both (same wildcard picks).
+        processed_pos, processed_neg, _metadata, regions_obj = compile_prompt_regions(
             compile_text, mode=compile_mode, switch_index=switch_index,
             load_image_prompts=load_image_prompts,
-            wildcard_modes=_wc_modes)
+            wildcard_modes=_wc_modes, rng=rng)
 
         pos_inputs = [b[0] for b in input_bundles if b[0]]
         neg_inputs = [b[1] for b in input_bundles if b[1]]
@@ -188,7 +201,7 @@ class PromptChainNode(io.ComfyNode):
             negative_output = ", ".join(neg_parts) if neg_parts else ""
 
         elif mode == "roll" and input_bundles:
-            selected_idx = random.randint(0, len(input_bundles) - 1)
+            selected_idx = rng.randint(0, len(input_bundles) - 1)
             roll_selected = selected_idx + 1  # 1-based for UI
             selected_pos, selected_neg = input_bundles[selected_idx]
 
@@ -211,9 +224,6 @@ class PromptChainNode(io.ComfyNode):
         # empty string there meant a $block-less prompt sampled with EMPTY
         # positive AND negative. Consumers branch on the regions LIST, so an
         # empty list still means "not regional" everywhere.
-        regions_obj = compile_regions(
-            compile_text, mode=compile_mode, switch_index=switch_index,
-            load_image_prompts=load_image_prompts, wildcard_modes=_wc_modes)
         regions_json = json.dumps(regions_obj)
 
         cls._stamp_workflow_metadata(positive_output, negative_output)
@@ -228,13 +238,15 @@ class PromptChainNode(io.ComfyNode):
             ui["roll_selected"] = [_metadata["roll_selected"]]
         if _metadata.get("wildcard_results"):
             ui["wildcard_results"] = [json.dumps(_metadata["wildcard_results"])]
+        if _metadata.get("unresolved_wildcards"):
+            ui["unresolved_wildcards"] = [json.dumps(_metadata["unresolved_wildcards"])]
         return io.NodeOutput(out_bundle, positive_output, negative_output,
                              regions_json, ui=ui)
 
     @classmethod
     def _execute_iterate(cls, prompt, input_bundles, has_children,
                          client_index, client_cycle, unique_id, subordinate,
-                         load_image_prompts=None, wildcard_modes=None):
+                         load_image_prompts=None, wildcard_modes=None, rng=None):
         if has_children:
             # ── parent iterate: cycle through connected inputs ──
             active_bundles = [(p, n) for p, n in input_bundles if p or n]
@@ -255,7 +267,7 @@ class PromptChainNode(io.ComfyNode):
             stripped = re.sub(r"^::([^:]+)::.*$", "", prompt, flags=re.MULTILINE)
             processed_pos, processed_neg, _iter_meta = compile_prompt(
                 stripped, mode="combine", load_image_prompts=load_image_prompts,
-                wildcard_modes=wildcard_modes)
+                wildcard_modes=wildcard_modes, rng=rng)
 
             pos_parts = [p for p in [processed_pos, selected_pos] if p]
             neg_parts = [p for p in [processed_neg, selected_neg] if p]
@@ -273,7 +285,7 @@ class PromptChainNode(io.ComfyNode):
         # ── own-content iterate: cycle through ::Label:: lines ──
         processed_pos, processed_neg, _ = compile_prompt(
             prompt, mode="combine", load_image_prompts=load_image_prompts,
-            wildcard_modes=wildcard_modes)
+            wildcard_modes=wildcard_modes, rng=rng)
 
         # count labeled lines in the positive section
         labeled_lines = []
@@ -302,7 +314,7 @@ class PromptChainNode(io.ComfyNode):
         positive_output, negative_output, _sel_meta = compile_prompt(
             prompt, mode="switch", switch_index=current_idx + 1,
             load_image_prompts=load_image_prompts,
-            wildcard_modes=wildcard_modes)
+            wildcard_modes=wildcard_modes, rng=rng)
 
         positive_output = deduplicate(positive_output)
         negative_output = deduplicate(negative_output)
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""Benchmark: tag_search.alias_scan's literal pass, the old per-alias
+regex loop vs the PhraseMatcher automaton (core/phrase_matcher.py).
+
+The vocabulary is the tag-alias seed plus synthetic curator aliases up to
+--aliases (the live tag_aliases table grows well past the seed), sorted
+longest-first like _alias_lookup_list. Requests are patch-request-sized
+sentences that mention a few aliases. Both paths must pick the same
+(tag, alias) hits in the same order; only the scan itself is timed (the
+DB row hydration after it is the same either way).
+
+    python scripts/bench_alias_scan.py [--aliases 3000] [--requests 200]
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import json
+import os
+import random
+import re
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "phrase_matcher", os.path.join(_HERE, "core", "phrase_matcher.py"))
+_pm = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_pm)
+
+_WORDS = ("pose standing sitting kneeling looking back over shoulder arms up hands on hips "
+          "legs crossed from above below side view close up feet soles toes barefoot wet "
+          "hair glowing eyes smile open mouth wink lying on back stomach spread").split()
+
+
+def _vocabulary(n: int, rng: random.Random) -> list[tuple[str, str]]:
+    with open(os.path.join(_HERE, "data", "tag-builder", "tag-aliases-seed.json"),
+              encoding="utf-8") as f:
+        seed = json.load(f)
+    pairs = [(a.strip().lower(), tag) for tag, aliases in seed.items()
+             if isinstance(aliases, list) for a in aliases if a.strip()]
+    seen = {a for a, _ in pairs}
+    while len(pairs) < n:
+        alias = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(1, 4)))
+        if alias not in seen:
+            seen.add(alias)
+            pairs.append((alias, f"tag_{len(pairs) % (n // 3 + 1)}"))
+    pairs.sort(key=lambda p: -len(p[0]))
+    return pairs
+
+
+def _scan_regex(pairs, text):
+    """The loop alias_scan ran before (minus row hydration)."""
+    seen, out = set(), []
+    for alias, tag in pairs:
+        if tag in seen:
+            continue
+        pat = re.compile(r"(?<![A-Za-z0-9_])" + re.escape(alias) + r"(?![A-Za-z0-9_])")
+        if pat.search(text):
+            out.append((tag, alias))
+            seen.add(tag)
+    return out
+
+
+def _scan_matcher(pairs, matcher, text):
+    seen, out = set(), []
+    for i in sorted({hit.phrase_id for hit in matcher.scan(text)}):
+        alias, tag = pairs[i]
+        if tag not in seen:
+            out.append((tag, alias))
+            seen.add(tag)
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--aliases", type=int, default=3000)
+    ap.add_argument("--requests", type=int, default=200)
+    args = ap.parse_args()
+    rng = random.Random(0)
+    pairs = _vocabulary(args.aliases, rng)
+    requests = []
+    for _ in range(args.requests):
+        words = [rng.choice(pairs)[0] if rng.random() < 0.15 else rng.choice(_WORDS)
+                 for _ in range(rng.randint(8, 30))]
+        requests.append("make her " + " ".join(words))
+
+    t0 = time.perf_counter()
+    matcher = _pm.PhraseMatcher(alias for alias, _ in pairs)
+    build_ms = (time.perf_counter() - t0) * 1000
+
+    re.purge()
+    t0 = time.perf_counter()
+    before = [_scan_regex(pairs, t) for t in requests]
+    regex_ms = (time.perf_counter() - t0) * 1000 / len(requests)
+    t0 = time.perf_counter()
+    after = [_scan_matcher(pairs, matcher, t) for t in requests]
+    matcher_ms = (time.perf_counter() - t0) * 1000 / len(requests)
+
+    hits = sum(len(h) for h in after) / len(requests)
+    print(f"{len(pairs)} aliases, {len(requests)} requests ({hits:.1f} tag hits each)\n")
+    print(f"  regex per alias (before): {regex_ms:9.3f} ms/request")
+    print(f"  PhraseMatcher   (after):  {matcher_ms:9.3f} ms/request  "
+          f"({regex_ms / matcher_ms:.0f}x; automaton build {build_ms:.1f} ms, "
+          f"once per vocabulary version)")
+    same = before == after
+    print(f"\n  identical hits: {'PASS' if same else 'FAIL'}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
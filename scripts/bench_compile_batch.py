@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Benchmark: batch prompt compilation throughput (core/compiler.py compile_batch).
+
+Compiles N variants of a few representative templates and prints variants/sec,
+against the per-execution path the node takes for every queue item (a fresh
+compile_prompt_regions per variant with the template memos cleared, i.e. what a
+cold process pays). torch-free; run anywhere:
+
+    python scripts/bench_compile_batch.py [N]
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "pc_compiler", os.path.join(_HERE, "core", "compiler.py"))
+_c = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_c)
+
+TEMPLATES = {
+    "tags": "masterpiece, best quality, 1girl, {red|blue|green|black} hair, "
+            "{smile|frown|open mouth}, {standing|sitting|{running|jumping}}, "
+            "outdoors, {day|night|sunset}\nNegative Prompt: {lowres|blurry}, bad hands",
+    "regional": "a park, {day|dusk}\n$mannequin1{ a knight in {silver|gold} armor }\n"
+                "$mannequin2{ a wizard, {red|blue} robe, {staff|wand} }\n"
+                "$mannequin3{ a {cat|dog} }\n$mannequin4{ a {small|large} dragon }",
+    "labels": "\n".join(f"::Look {i}:: {{red|blue}} outfit {i}, {{hat|cap}}" for i in range(12)),
+    "long": ", ".join(f"{{tag{i}a|tag{i}b|{{tag{i}c|tag{i}d}}}}" for i in range(400)),
+}
+
+
+def _clear_memos():
+    _c._prepare_part.cache_clear()
+    _c._split_regions.cache_clear()
+    _c._brace_template.cache_clear()
+    _c._mark_regions.cache_clear()
+    _c._wildcard_refs.cache_clear()
+
+
+def bench(name: str, text: str, n: int) -> None:
+    iterate = list(range(12)) if name == "labels" else None
+    seeds = range(n // 12 if iterate else n)
+    count = len(seeds) * (12 if iterate else 1)
+
+    t0 = time.perf_counter()
+    for seed in seeds:
+        for idx in (iterate or [None]):
+            _clear_memos()
+            kw = {"mode": "switch", "switch_index": idx + 1} if idx is not None else {}
+            _c.compile_prompt_regions(text, rng=_c.make_rng(seed, "bench", idx), **kw)
+    cold = time.perf_counter() - t0
+
+    _clear_memos()
+    t0 = time.perf_counter()
+    out = list(_c.compile_batch(text, seeds=seeds, iterate=iterate, stream="bench"))
+    batch = time.perf_counter() - t0
+    assert len(out) == count
+
+    print(f"  {name:<9} {count:>6} variants   per-execution {count / cold:>9.0f}/s"
+          f"   batch {count / batch:>9.0f}/s   ({cold / batch:.1f}x)")
+
+
+def main() -> int:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    print(f"compile_batch throughput (N={n})")
+    for name, text in TEMPLATES.items():
+        bench(name, text, n)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
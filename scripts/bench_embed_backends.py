@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""Throughput benchmark: the bge-small encoder on torch vs ONNX Runtime
+(fp32 and dynamically quantized int8), through the same length-bucketed
+embed path the index rebuilds and query searches use.
+
+Two workloads: an index-rebuild-like mix (short tag names plus longer
+wiki-style bodies, batch 64, MAX_LENGTH) and single short queries
+(batch 1, QUERY_MAX_LENGTH — the latency a cache miss pays). torch runs
+on CUDA when available; the ONNX backends are CPU-only, so compare
+against torch with --cpu for the like-for-like number.
+
+Needs torch, transformers and onnxruntime.
+
+    python scripts/bench_embed_backends.py [--rows 2000] [--queries 200] [--cpu]
+"""
+
+from __future__ import annotations
+
+import argparse
+import importlib.util
+import os
+import random
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "_embed_model", os.path.join(_HERE, "core", "_embed_model.py"))
+_em = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_em)
+
+_WORDS = ("girl hair eyes skirt uniform smile standing sitting looking viewer outdoors "
+          "sword pose arm hand leg light shadow sky flower tree window room night "
+          "character subject usually often wearing holding from above below").split()
+
+
+def _corpus(rows: int, rng: random.Random) -> list[str]:
+    out = []
+    for i in range(rows):
+        n = rng.randint(1, 4) if i % 3 else int(min(300, rng.lognormvariate(3.5, 0.8)))
+        out.append(" ".join(rng.choice(_WORDS) for _ in range(n)))
+    return out
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=2000, help="rows in the rebuild workload")
+    ap.add_argument("--queries", type=int, default=200, help="single-query calls")
+    ap.add_argument("--cpu", action="store_true", help="run the torch backend on CPU")
+    args = ap.parse_args()
+    missing = [m for m in ("torch", "transformers", "onnxruntime")
+               if importlib.util.find_spec(m) is None]
+    if missing:
+        print(f"needs torch, transformers and onnxruntime ({', '.join(missing)} missing)")
+        return 1
+    if args.cpu:
+        import torch
+        torch.cuda.is_available = lambda: False
+
+    rng = random.Random(0)
+    corpus = _corpus(args.rows, rng)
+    queries = [" ".join(rng.choice(_WORDS) for _ in range(rng.randint(2, 8)))
+               for _ in range(args.queries)]
+    print(f"{_em.MODEL_ID}: rebuild {args.rows} rows (batch 64), "
+          f"{args.queries} single queries\n")
+
+    base = None
+    for name in ("torch", "onnx", "onnx-int8"):
+        loaded = _em.load_backend(name)
+        if name != "torch" and not isinstance(loaded[0], _em._OnnxEncoder):
+            print(f"  {name:<10} failed to load (see log)")
+            continue
+        _em._embed_with(loaded, corpus[:64], batch_size=64)          # warm-up
+        report: dict = {}
+        _em._embed_with(loaded, corpus, batch_size=64, report=report)
+        rate = report["texts"] / report["seconds"]
+        t0 = time.perf_counter()
+        for q in queries:
+            _em._embed_with(loaded, [q], batch_size=1, max_length=_em.QUERY_MAX_LENGTH)
+        q_ms = (time.perf_counter() - t0) * 1000 / len(queries)
+        base = base or rate
+        print(f"  {name:<10} on {loaded[2]:<4}  {rate:8.0f} texts/s ({rate / base:.2f}x)  "
+              f"query {q_ms:6.2f} ms   [{_em.describe_report(report)}]")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Load test: query-embedding throughput under 16 concurrent searchers,
+one embed call per search vs the micro-batcher in core/_embed_model.py.
+
+Each searcher embeds a stream of distinct queries (cache misses — the
+worst case for the batcher, which only earns its keep by coalescing).
+By default the encoder is a stand-in that costs what a CPU bge-small call
+does in shape: a fixed per-call dispatch plus a per-text cost, one call at
+a time (one shared model). With --model the real encoder is loaded
+(needs torch + transformers) and both runs use it.
+
+Also checks every searcher got its own rows back, from threads and from
+asyncio tasks.
+
+    python scripts/bench_embed_batcher.py [--model] [--searchers 16]
+        [--queries 40] [--window-ms 2]
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import importlib.util
+import os
+import sys
+import threading
+import time
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "_embed_model", os.path.join(_HERE, "core", "_embed_model.py"))
+_em = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_em)
+
+DISPATCH_MS = 6.0     # stand-in: tokenize + forward launch per call
+PER_TEXT_MS = 0.25    # stand-in: marginal cost of one more short text
+
+_model_lock = threading.Lock()
+
+
+def _fake_vec(text: str) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), "little")
+    v = np.random.default_rng(seed).standard_normal(_em.EMBED_DIM)
+    return (v / np.linalg.norm(v)).astype(np.float32)
+
+
+def _fake_embed(texts, batch_size=32, **_):
+    with _model_lock:
+        time.sleep((DISPATCH_MS + PER_TEXT_MS * len(texts)) / 1000.0)
+        return np.stack([_fake_vec(t) for t in texts])
+
+
+def _queries(searcher: int, n: int) -> list[str]:
+    return [f"searcher {searcher} query {i} pointing her feet at the viewer" for i in range(n)]
+
+
+def _run_threads(searchers: int, queries: int, call) -> tuple[float, list]:
+    results: list = [None] * searchers
+    barrier = threading.Barrier(searchers)
+
+    def worker(s):
+        barrier.wait()
+        results[s] = [call(q) for q in _queries(s, queries)]
+
+    threads = [threading.Thread(target=worker, args=(s,)) for s in range(searchers)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return time.perf_counter() - t0, results
+
+
+async def _run_async(searchers: int, queries: int) -> tuple[float, list]:
+    async def worker(s):
+        return [(await _em.embed_cached_async([q]))[0] for q in _queries(s, queries)]
+
+    t0 = time.perf_counter()
+    results = await asyncio.gather(*(worker(s) for s in range(searchers)))
+    return time.perf_counter() - t0, results
+
+
+def _correct(results, searchers: int, queries: int, reference) -> bool:
+    return all(np.allclose(results[s][i], reference(q), atol=1e-5)
+               for s in range(searchers) for i, q in enumerate(_queries(s, queries)))
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--model", action="store_true", help="use the real bge-small encoder")
+    ap.add_argument("--searchers", type=int, default=16)
+    ap.add_argument("--queries", type=int, default=40, help="queries per searcher")
+    ap.add_argument("--window-ms", type=float, default=_em.BATCH_WINDOW_MS)
+    args = ap.parse_args()
+
+    if args.model:
+        if _em.get() is None:
+            print(f"model unavailable: {_em.get_load_error()}")
+            return 1
+        direct = _em.embed
+        reference = lambda q: _em._as_numpy(direct([q]))[0]  # noqa: E731
+        label = f"{_em.MODEL_ID} on {_em.get()[2]}"
+    else:
+        _em.get = lambda: ("model", "tokenizer", "cpu")
+        _em.embed = direct = _fake_embed
+        reference = _fake_vec
+        label = f"stand-in encoder ({DISPATCH_MS} ms/call + {PER_TEXT_MS} ms/text, serialized)"
+    _em.QUERY_CACHE_MAX_BYTES = 0       # every query a miss: measure the batcher alone
+    _em.BATCH_WINDOW_MS = args.window_ms
+    total = args.searchers * args.queries
+    print(f"{args.searchers} concurrent searchers x {args.queries} queries, {label}\n")
+
+    t, res = _run_threads(args.searchers, args.queries,
+                          lambda q: _em._as_numpy(direct([q]))[0])
+    ok_direct = _correct(res, args.searchers, args.queries, reference)
+    print(f"  one embed call per search: {total / t:8.0f} queries/s  ({t * 1000 / total:.2f} ms/query)")
+
+    t_b, res = _run_threads(args.searchers, args.queries, lambda q: _em.embed_cached([q])[0])
+    ok_batched = _correct(res, args.searchers, args.queries, reference)
+    stats = _em.batcher_stats()
+    print(f"  micro-batched (threads):   {total / t_b:8.0f} queries/s  ({t_b * 1000 / total:.2f} ms/query)"
+          f"  {stats['requests_per_batch']} requests/batch, max {stats['max_requests']}")
+
+    t_a, res = asyncio.run(_run_async(args.searchers, args.queries))
+    ok_async = _correct(res, args.searchers, args.queries, reference)
+    print(f"  micro-batched (asyncio):   {total / t_a:8.0f} queries/s  ({t_a * 1000 / total:.2f} ms/query)")
+    print(f"\n  speedup (threads): {t / t_b:.1f}x")
+
+    lone = []
+    for q in _queries(99, 20):
+        t0 = time.perf_counter()
+        _em.embed_cached([q])
+        lone.append((time.perf_counter() - t0) * 1000)
+    print(f"  lone caller latency: {np.median(lone):.2f} ms median "
+          f"(window {_em.BATCH_WINDOW_MS} ms)")
+
+    ok = ok_direct and ok_batched and ok_async
+    print(f"\n  every searcher got its own rows back: {'PASS' if ok else 'FAIL'}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""Microbenchmark: TagStore autocomplete search, linear scan vs TagSearchIndex.
+
+Times typical keystroke queries (1-12 chars, single and multi-word) against the
+bundled data/tags CSVs and prints per-query latency for the old scan-and-sort
+and the index, plus the index build time. torch-free; run anywhere:
+
+    python scripts/bench_tag_search.py [source.csv]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_tag_index import (MIN_RANKING_THRESHOLD, _ti, index_search,  # noqa: E402
+                            legacy_search, load_tags)
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# what typing "long hair" / "blue eyes" / "fox" produces, keystroke by keystroke
+QUERIES = ["l", "lo", "lon", "long", "long ", "long h", "long ha", "long hai", "long hair",
+           "b", "bl", "blu", "blue", "blue e", "blue ey", "blue eyes", "f", "fo", "fox",
+           "standing on one leg", "smile open"]
+
+
+def _time(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main() -> int:
+    name = sys.argv[1] if len(sys.argv) > 1 else "E621.csv"
+    tags = load_tags(os.path.join(_HERE, "data", "tags", name))
+    t0 = time.perf_counter()
+    index = _ti.TagSearchIndex(tags, MIN_RANKING_THRESHOLD)
+    build = (time.perf_counter() - t0) * 1000
+    print(f"{name}: {len(tags):,} tags, {len(index):,} searchable, "
+          f"{len(index.grams):,} trigrams, index build {build:.0f} ms\n")
+    print(f"  {'query':<22}{'scan ms':>10}{'index ms':>10}{'speedup':>10}")
+    total_scan = total_index = 0.0
+    for q in QUERIES:
+        scan = _time(lambda: legacy_search(tags, q, 20), repeat=3)
+        idx = _time(lambda: index_search(index, q, 20))
+        total_scan += scan
+        total_index += idx
+        print(f"  {q!r:<22}{scan:>10.2f}{idx:>10.3f}{scan / max(idx, 1e-6):>9.0f}x")
+    print(f"\n  mean per keystroke: scan {total_scan / len(QUERIES):.2f} ms, "
+          f"index {total_index / len(QUERIES):.3f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Microbenchmark: embedding search selection, full sort vs shared top_k.
+
+Scores a random L2-normalized [N, 384] float32 index against one query at
+14k (today's tag-wiki index), 100k and 1M rows, then times the old
+selection (tolist + sort over every row) against core/topk.top_k for the
+top_k values the searches use. The matmul is timed separately so the
+selection cost can be read against it. numpy only:
+
+    python scripts/bench_topk.py [rows ...]
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from test_topk import _tk, legacy_top_k  # noqa: E402
+
+DIM = 384
+TOP_KS = (12, 30, 150)
+
+
+def _time(fn, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main() -> int:
+    sizes = [int(a) for a in sys.argv[1:]] or [14_000, 100_000, 1_000_000]
+    rng = np.random.default_rng(0)
+    print(f"  {'rows':>9}{'matmul ms':>11}{'k':>6}{'sort ms':>10}{'top_k ms':>10}{'speedup':>9}")
+    for n in sizes:
+        index = rng.standard_normal((n, DIM), dtype=np.float32)
+        index /= np.linalg.norm(index, axis=1, keepdims=True)
+        query = index[n // 2]
+        matmul = _time(lambda index=index: index @ query)
+        scores = index @ query
+        for k in TOP_KS:
+            assert _tk.top_k(scores, k, 0.0) == legacy_top_k(scores, k, 0.0)
+            repeat = 2 if n >= 1_000_000 else 5
+            old = _time(lambda: legacy_top_k(scores, k, 0.0), repeat)
+            new = _time(lambda: _tk.top_k(scores, k, 0.0))
+            print(f"  {n:>9,}{matmul:>11.2f}{k:>6}{old:>10.2f}{new:>10.3f}{old / new:>8.0f}x")
+        del index
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
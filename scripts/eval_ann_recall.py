@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""recall@k / latency evaluation: IVF-flat ANN (core/ann_index.py) vs brute force.
+
+For each nprobe setting, runs the same queries through brute force
+(`topk.top_k` over every row) and the IVF index, and prints mean recall@k
+(fraction of the exact top-k the ANN returned) and mean latency of both.
+Use it to pick tag_search.ANN_NPROBE / ANN_NLIST for a vocabulary size.
+
+Data: a synthetic clustered set (bge embeddings are clustered by topic, so
+uniform random vectors would understate IVF recall), or a real tag_search
+cache dir with --index. numpy only:
+
+    python scripts/eval_ann_recall.py --rows 500000
+    python scripts/eval_ann_recall.py --index cache/tag_search --nprobe 4 8 16 32
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _HERE)
+from core import ann_index, embed_index, topk  # noqa: E402
+
+DIM = 384
+
+
+def synthetic(rows: int, clusters: int, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, DIM), dtype=np.float32)
+    centers /= np.linalg.norm(centers, axis=1, keepdims=True)
+    vectors = np.empty((rows, DIM), dtype=np.float32)
+    for start in range(0, rows, 65536):
+        n = min(65536, rows - start)
+        block = centers[rng.integers(0, clusters, n)]
+        block += rng.standard_normal((n, DIM), dtype=np.float32) * 0.06
+        vectors[start:start + n] = block / np.linalg.norm(block, axis=1, keepdims=True)
+    return vectors
+
+
+def queries_for(vectors, count: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    q = vectors[rng.integers(0, vectors.shape[0], count)].astype(np.float32)
+    q += rng.standard_normal(q.shape, dtype=np.float32) * 0.04
+    return q / np.linalg.norm(q, axis=1, keepdims=True)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=500_000)
+    ap.add_argument("--clusters", type=int, default=2000)
+    ap.add_argument("--index", type=Path, help="tag_search cache dir instead of synthetic data")
+    ap.add_argument("--nlist", type=int, default=None)
+    ap.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    ap.add_argument("-k", type=int, default=12)
+    ap.add_argument("--queries", type=int, default=200)
+    args = ap.parse_args()
+
+    if args.index:
+        manifest = embed_index.read_manifest(args.index)
+        if manifest is None:
+            print(f"no mmap embedding index in {args.index}")
+            return 1
+        vectors = embed_index.EmbeddingIndex.open(args.index, manifest).vectors
+        label = f"{args.index} ({vectors.shape[0]:,} rows)"
+    else:
+        vectors = synthetic(args.rows, args.clusters)
+        label = f"synthetic {args.rows:,} rows / {args.clusters} clusters"
+    queries = queries_for(vectors, args.queries)
+
+    t0 = time.perf_counter()
+    ivf = ann_index.IVFIndex.build(vectors, nlist=args.nlist)
+    print(f"{label}: IVF build {time.perf_counter() - t0:.1f} s, nlist={ivf.nlist}, k={args.k}\n")
+
+    exact, brute_ms = [], 0.0
+    for q in queries:
+        t0 = time.perf_counter()
+        exact.append({i for i, _ in topk.top_k(vectors @ q, args.k)})
+        brute_ms += time.perf_counter() - t0
+    brute_ms = brute_ms * 1000 / len(queries)
+
+    print(f"  {'nprobe':>7}{'recall@k':>10}{'ann ms':>9}{'brute ms':>10}{'speedup':>9}")
+    for nprobe in args.nprobe:
+        recall, ann_ms = 0.0, 0.0
+        for q, truth in zip(queries, exact):
+            t0 = time.perf_counter()
+            got = ivf.search(vectors, q, args.k, nprobe=nprobe)
+            ann_ms += time.perf_counter() - t0
+            recall += len(truth & {i for i, _ in got}) / len(truth)
+        ann_ms = ann_ms * 1000 / len(queries)
+        print(f"  {nprobe:>7}{recall / len(queries):>10.3f}{ann_ms:>9.2f}{brute_ms:>10.2f}"
+              f"{brute_ms / ann_ms:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
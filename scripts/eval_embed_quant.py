@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""Rank agreement of quantized embedding storage (float16 / int8) vs float32.
+
+Scores the probe queries the search modules were calibrated on against a
+float32 index and against the same index stored as float16 and per-row int8
+(core/embed_index.quantize), then reports, per dtype: top-1 agreement, mean
+overlap@k, share of queries whose top-k comes back in the identical order,
+the largest score error, and vector memory.
+
+Real data: the tag_search cache (cache/tag_search, or --index DIR) with the
+probes embedded by the shared bge-small model — needs torch + transformers.
+Without them, or with --synthetic N, it uses a clustered random index and
+perturbed rows as queries. numpy only otherwise:
+
+    python scripts/eval_embed_quant.py
+    python scripts/eval_embed_quant.py --synthetic 100000 -k 30
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, _HERE)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from core import embed_index, topk  # noqa: E402
+from eval_ann_recall import queries_for, synthetic  # noqa: E402
+
+# Calibration phrases from the tag_search / bucket_search / modifier_search
+# threshold notes, plus the paraphrase cases their aliases were added for.
+PROBE_QUERIES = [
+    "girl walking through forest",
+    "close up on feet",
+    "her soles aimed at the camera",
+    "the foot is pointed at viewer",
+    "holding a sword",
+    "pointing red socks at viewer",
+    "sitting with legs up pointing socks at viewer",
+    "fully nude sitting with legs up",
+    "showing the bottoms of her foot at the viewer",
+    "pointing a gun",
+    "presenting feet",
+    "feet zoomed in",
+]
+
+
+def _embed_probes():
+    try:
+        from core import _embed_model
+        qv = _embed_model.embed(PROBE_QUERIES)
+    except Exception:
+        return None
+    return None if qv is None else _embed_model._as_numpy(qv)
+
+
+def main() -> int:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--index", type=Path, default=Path(_HERE) / "cache" / "tag_search")
+    ap.add_argument("--synthetic", type=int, default=0, metavar="ROWS")
+    ap.add_argument("-k", type=int, default=12)
+    args = ap.parse_args()
+
+    vectors = queries = None
+    if not args.synthetic:
+        manifest = embed_index.read_manifest(args.index)
+        if manifest and manifest.get("dtype") == "float32":
+            queries = _embed_probes()
+            if queries is not None:
+                vectors = np.asarray(embed_index.EmbeddingIndex.open(args.index, manifest).vectors)
+                label = f"{args.index} ({len(vectors):,} rows), {len(queries)} probe queries"
+    if vectors is None:
+        rows = args.synthetic or 14_000
+        vectors = synthetic(rows, max(50, rows // 250))
+        queries = queries_for(vectors, 200)
+        label = f"synthetic {rows:,} rows, {len(queries)} perturbed-row queries"
+
+    k = args.k
+    base = embed_index.EmbeddingIndex.from_memory(vectors, [{}] * len(vectors))
+    truth = [topk.top_k(base.scores(q), k) for q in queries]
+    print(f"{label}, k={k}\n")
+    print(f"  {'dtype':<9}{'MB':>8}{'top-1':>8}{'overlap@k':>11}{'same order':>12}{'max |dscore|':>14}")
+    print(f"  {'float32':<9}{base.nbytes / 2**20:>8.1f}{1:>8.3f}{1:>11.3f}{1:>12.3f}{0:>14.1e}")
+    for dtype in ("float16", "int8"):
+        index = embed_index.EmbeddingIndex.from_memory(vectors, [{}] * len(vectors), dtype=dtype)
+        top1 = overlap = same = 0.0
+        err = 0.0
+        for q, exact in zip(queries, truth):
+            scores = index.scores(q)
+            got = topk.top_k(scores, k)
+            top1 += got[0][0] == exact[0][0]
+            overlap += len({i for i, _ in got} & {i for i, _ in exact}) / k
+            same += [i for i, _ in got] == [i for i, _ in exact]
+            err = max(err, float(np.max(np.abs(scores - base.scores(q)))))
+        n = len(queries)
+        print(f"  {dtype:<9}{index.nbytes / 2**20:>8.1f}{top1 / n:>8.3f}{overlap / n:>11.3f}"
+              f"{same / n:>12.3f}{err:>14.1e}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""Tests for the character matcher's name keys (core/character_keys.py).
+
+On a synthetic 11.5k-row `characters` table (Danbooru-shaped tags plus the
+awkward real ones: `m._bison`, `c.c.`, `chun-li`, `ryu_(street_fighter)`
+next to `ryu_(monster_girl_encyclopedia)`, `100%_orange_juice`, ...):
+
+  * for a few hundred generated mentions, the keyed stages return exactly
+    the rows, in order, of a verbatim copy of the per-row queries they
+    replace (the pre-key match_characters_inner stages 1-5), with and
+    without a franchise hint;
+  * one bulk call over every mention == each mention matched alone;
+  * the migration adds and backfills the keys, is a no-op on re-run,
+    the triggers keep them in sync on insert / tag update / INSERT OR
+    REPLACE, and a table without the columns falls back to the per-row
+    queries;
+  * the stage 2 and prefix lookups are index searches.
+
+Prints per-mention vs bulk latency. sqlite3 only.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import random
+import re
+import sqlite3
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "character_keys", os.path.join(_HERE, "core", "character_keys.py"))
+_ck = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_ck)
+
+ROWS = 11_500
+SERIES = [("street_fighter", "Street Fighter"), ("genshin_impact", "Genshin Impact"),
+          ("xenoblade", "Xenoblade"), ("monster_girl_encyclopedia", "Monster Girl Encyclopedia"),
+          ("one_piece", "One Piece"), ("touhou", "Touhou"), ("umamusume", "Umamusume")]
+_SYL = ["ka", "mi", "ya", "to", "ri", "sa", "chun", "li", "cam", "my", "ne", "ro", "zu",
+        "ryu", "el", "ai", "ko", "an", "na", "ju", "x", "c.", "m.", "o-"]
+SPECIAL = ["m._bison", "c.c.", "m.o.m.o.", "t.m._opera_o_(umamusume)", "chun-li",
+           "cammy_white", "ryu_(street_fighter)", "ryu_(monster_girl_encyclopedia)",
+           "mythra_(xenoblade)", "sagat", "ken_masters", "100%_orange_juice",
+           "back\\slash_(x)", "red_(pokemon)", "fighter_(7th_dragon)", "Upper_Case_(touhou)",
+           "élise_(touhou)", "ryu", "a_b", "_leading", "trailing_"]
+STOPLIST = frozenset({"red", "blue", "fighter", "girl", "white", "hair"})
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _make_db(rng: random.Random) -> tuple[sqlite3.Connection, list[str]]:
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.execute("CREATE TABLE characters (tag TEXT PRIMARY KEY, display TEXT, series TEXT, "
+                 "base_tags TEXT, base_natlang TEXT, post_count INTEGER)")
+    tags, seen = list(SPECIAL), set(SPECIAL)
+    while len(tags) < ROWS:
+        name = "_".join("".join(rng.choice(_SYL) for _ in range(rng.randint(1, 2)))
+                        for _ in range(rng.randint(1, 3)))
+        tag = f"{name}_({rng.choice(SERIES)[0]})" if rng.random() < 0.6 else name
+        if tag not in seen:
+            seen.add(tag)
+            tags.append(tag)
+    rng.shuffle(tags)
+    series = dict(SERIES)
+    rows = []
+    for tag in tags:
+        m = re.search(r"_\((.+)\)$", tag)
+        rows.append((tag, tag.title(), series.get(m.group(1)) if m else None,
+                     tag, None, rng.randint(0, 5000)))
+    conn.executemany("INSERT INTO characters VALUES (?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return conn, tags
+
+
+def _normalize(tokens: list) -> dict[str, str]:
+    # tag_builder._normalize_character_tokens
+    norm_to_original: dict[str, str] = {}
+    for raw in tokens:
+        token = raw.strip()
+        base = token.lower().replace("\\(", "(").replace("\\)", ")")
+        bare = re.sub(r"[\s_\-]+", " ", base).strip()
+        if not bare:
+            continue
+        for variant in (bare, bare.replace(" ", "_"), bare.replace(" ", "-")):
+            norm_to_original.setdefault(variant, token)
+    return norm_to_original
+
+
+def _pick(rows, latest_user_text):
+    # tag_builder._pick_franchise_preferred
+    if not rows:
+        return None
+    if latest_user_text:
+        for r in rows:
+            series_lc = (r["series"] or "").lower().strip()
+            if series_lc and series_lc in latest_user_text:
+                return r
+    return rows[0]
+
+
+def _reference(db, norm_to_original: dict, latest_user_text: str):
+    """Stages 1-5 of match_characters_inner before the name keys, verbatim
+    apart from the shared stage 3-5 loop."""
+    placeholders = ",".join(["?"] * len(norm_to_original))
+    char_rows = list(db.execute(
+        f"SELECT tag, display, series, base_tags, base_natlang FROM characters WHERE tag IN ({placeholders})",
+        list(norm_to_original.keys()),
+    ).fetchall())
+    user_token_keys = list(norm_to_original.keys())
+    already_matched = {r["tag"] for r in char_rows}
+    bare_to_tokens: dict[str, str] = {}
+    for token, original in norm_to_original.items():
+        bare = re.sub(r"[\s_\-\.()]+", "", token).lower()
+        if len(bare) >= 3:
+            bare_to_tokens.setdefault(bare, original)
+    if bare_to_tokens:
+        bare_placeholders = ",".join(["?"] * len(bare_to_tokens))
+        bare_rows = db.execute(
+            f"SELECT tag, display, series, base_tags, base_natlang FROM characters "
+            f"WHERE tag NOT IN ({placeholders}) "
+            f"  AND LOWER(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE("
+            f"      tag, '_', ''), '-', ''), '.', ''), ' ', ''), '(', ''), ')', '')) "
+            f"      IN ({bare_placeholders})",
+            list(norm_to_original.keys()) + list(bare_to_tokens.keys()),
+        ).fetchall()
+        for r in bare_rows:
+            if r["tag"] in already_matched:
+                continue
+            bare_db = re.sub(r"[\s_\-\.()]+", "", r["tag"]).lower()
+            original = bare_to_tokens.get(bare_db)
+            if original is not None:
+                norm_to_original.setdefault(r["tag"], original)
+                char_rows.append(r)
+                already_matched.add(r["tag"])
+
+    stage3: dict[str, str] = {}
+    stage4: dict[str, str] = {}
+    stage5: dict[str, str] = {}
+    for token in user_token_keys:
+        original = norm_to_original[token]
+        if not re.search(r"[\s_\-()]", token):
+            if len(token) >= 3 and token.lower() not in STOPLIST:
+                stage3.setdefault(token.lower(), original)
+        if "_(" in token:
+            bare_name = token.split("_(", 1)[0].strip()
+            if bare_name and len(bare_name) >= 4 and bare_name.lower() not in STOPLIST:
+                stage4.setdefault(bare_name.lower(), original)
+        if "_" in token and "_(" not in token:
+            bare_name = token.split("_", 1)[0].strip()
+            if bare_name and len(bare_name) >= 3 and bare_name.lower() not in STOPLIST:
+                stage5.setdefault(bare_name.lower(), original)
+    for with_exact, candidates in ((False, stage3), (True, stage4), (True, stage5)):
+        for prefix, original in candidates.items():
+            esc = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            like_pattern = esc + r"\_%"
+            where = ("LOWER(tag) = ? OR LOWER(tag) LIKE ? ESCAPE '\\' " if with_exact
+                     else "LOWER(tag) LIKE ? ESCAPE '\\' ")
+            prefix_rows = db.execute(
+                "SELECT tag, display, series, base_tags, base_natlang FROM characters "
+                "WHERE " + where +
+                "ORDER BY (LENGTH(tag) - LENGTH(REPLACE(tag, '_(', ''))) ASC, "
+                "         LENGTH(tag) ASC, tag ASC "
+                "LIMIT 5",
+                (prefix, like_pattern) if with_exact else (like_pattern,),
+            ).fetchall()
+            chosen = _pick(prefix_rows, latest_user_text)
+            if chosen is None or chosen["tag"] in already_matched:
+                continue
+            norm_to_original.setdefault(chosen["tag"], original)
+            char_rows.append(chosen)
+            already_matched.add(chosen["tag"])
+    return norm_to_original, char_rows
+
+
+def _mention(rng: random.Random, tags: list[str]) -> list[str]:
+    """Tokens the agent might send for one mention of a character."""
+    out = []
+    for _ in range(rng.randint(1, 4)):
+        tag = rng.choice(tags if rng.random() < 0.8 else SPECIAL)
+        first = re.split(r"_", tag, 1)[0]
+        out.append(rng.choice([
+            tag, tag.replace("_", " "), tag.upper(), tag.replace("(", "\\(").replace(")", "\\)"),
+            tag.replace(".", ""), tag.replace("_", ""), first, first + "_(wrong_series)",
+            first + "_stret_fightr", re.sub(r"_\(.*", "", tag), tag[:-1], "ryu", "m. bison",
+            "cc", "chun li", "mythra_(xenoblade_chronicles_2)", "red hair", "100%", "a",
+        ]))
+    return out
+
+
+def _key(result) -> tuple:
+    norm, rows = result
+    return tuple(norm.items()), tuple(r["tag"] for r in rows)
+
+
+def _ms(fn, repeat=5) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def main() -> int:
+    rng = random.Random(7)
+    conn, tags = _make_db(rng)
+    mentions = [_normalize(_mention(rng, tags)) for _ in range(300)]
+    mentions = [m for m in mentions if m]
+    hints = ["", "cammy and ryu from street fighter", "ryu from monster girl encyclopedia"]
+
+    check("migration builds keys for every row", _ck.ensure_character_name_keys(conn)
+          and conn.execute("SELECT COUNT(*) FROM characters WHERE name_key IS NULL").fetchone()[0] == 0)
+    before = conn.total_changes
+    check("migration re-run writes nothing",
+          _ck.ensure_character_name_keys(conn) and conn.total_changes == before)
+    check("keys of awkward tags",
+          [tuple(conn.execute("SELECT name_key, name_prefix FROM characters WHERE tag = ?",
+                              (t,)).fetchone())
+           for t in ("m._bison", "c.c.", "Upper_Case_(touhou)", "sagat", "_leading")]
+          == [("mbison", "m."), ("cc", None), ("uppercasetouhou", "upper"), ("sagat", None),
+              ("leading", "")])
+
+    for hint in hints:
+        bad = 0
+        for m in mentions:
+            ref = _key(_reference(conn, dict(m), hint))
+            # The per-row path is the reference's own queries; once is enough.
+            for use_keys in ((True, False) if not hint else (True,)):
+                got = _ck.match_character_rows(conn, [m], latest_user_text=hint,
+                                               stoplist=STOPLIST, pick=_pick,
+                                               use_keys=use_keys)[0]
+                if _key(got) != ref:
+                    bad += 1
+                    if bad <= 3:
+                        print(f"    mismatch (hint={hint!r}, keys={use_keys}): {list(m)}\n"
+                              f"      ref {ref[1]}\n      got {_key(got)[1]}")
+        check(f"keyed and per-row stages == reference, {len(mentions)} mentions, hint={hint!r}",
+              bad == 0)
+    matched = sum(bool(r[1]) for r in _ck.match_character_rows(conn, mentions, stoplist=STOPLIST))
+    check(f"the mentions exercise the matcher ({matched} with matches)",
+          len(mentions) // 2 < matched < len(mentions))
+    got = [r["tag"] for r in _ck.match_character_rows(
+        conn, [_normalize(["mbison", "ryu", "mythra_(xenoblade_2)"])],
+        stoplist=STOPLIST, pick=_pick)[0][1]]
+    check("stage 1, 2, 3 and 4 hits in stage order",
+          got[:2] == ["ryu", "m._bison"] and got[2].startswith("ryu_")
+          and got[3:] == ["mythra_(xenoblade)"])
+
+    snapshot = [dict(m) for m in mentions]
+    bulk = _ck.match_character_rows(conn, mentions, latest_user_text=hints[1],
+                                    stoplist=STOPLIST, pick=_pick)
+    check("the callers' dicts are left alone", mentions == snapshot)
+    check("bulk == each mention alone",
+          [_key(r) for r in bulk]
+          == [_key(_ck.match_character_rows(conn, [m], latest_user_text=hints[1],
+                                            stoplist=STOPLIST, pick=_pick)[0])
+              for m in mentions])
+
+    plans = {}
+    for name, sql in (("bare", "SELECT tag FROM characters WHERE name_key IN ('mbison', 'cc')"),
+                      ("prefix", "SELECT tag FROM characters WHERE name_prefix = 'ryu'"),
+                      ("exact", "SELECT tag FROM characters WHERE LOWER(tag) = 'sagat'")):
+        plans[name] = " ".join(r[-1] for r in conn.execute("EXPLAIN QUERY PLAN " + sql))
+    check("key lookups use their indexes",
+          "idx_characters_name_key" in plans["bare"]
+          and "idx_characters_name_prefix" in plans["prefix"]
+          and "idx_characters_tag_lower" in plans["exact"])
+
+    batch = mentions[:20]
+    per = _ms(lambda: [_reference(conn, dict(m), hints[1]) for m in batch])
+    keyed = _ms(lambda: _ck.match_character_rows(conn, batch, latest_user_text=hints[1],
+                                                 stoplist=STOPLIST, pick=_pick))
+    print(f"\n  20 mentions: per-row per-mention {per:7.2f} ms   keyed bulk {keyed:6.2f} ms\n")
+    check("keyed bulk at least 5x faster than per-row per-mention", keyed * 5 < per)
+
+    conn.execute("INSERT INTO characters (tag, series) VALUES ('zz._new-one_(touhou)', 'Touhou')")
+    conn.execute("UPDATE characters SET tag = 'renamed_(x)' WHERE tag = 'sagat'")
+    conn.execute("INSERT OR REPLACE INTO characters (tag, series) VALUES ('cammy_white', 'SF')")
+    conn.commit()
+    check("triggers keep keys in sync on insert / tag update / replace",
+          conn.execute(
+              f"SELECT COUNT(*) FROM characters WHERE name_key IS NOT {_ck._bare_sql('tag')} "
+              f"OR name_prefix IS NOT {_ck._prefix_sql('tag')}").fetchone()[0] == 0
+          and [r["tag"] for r in _ck.match_character_rows(
+              conn, [_normalize(["zznewonetouhou", "renamed"])], stoplist=STOPLIST)[0][1]]
+          == ["zz._new-one_(touhou)", "renamed_(x)"])
+
+    fresh, _ = _make_db(random.Random(7))
+    sample = mentions[:100]
+    check("no key columns: per-row fallback, same rows",
+          [_key(r) for r in _ck.match_character_rows(fresh, sample, stoplist=STOPLIST, pick=_pick)]
+          == [_key(_reference(fresh, dict(m), "")) for m in sample])
+    check("no characters table: migration reports unavailable",
+          not _ck.ensure_character_name_keys(sqlite3.connect(":memory:")))
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,203 @@
+#!/usr/bin/env python3
+"""Tests for the character picker search (core/character_search.py).
+
+On a synthetic 11.5k-row `characters` table (tag / display / series /
+series_tag shaped like the real ones, plus character_series categories):
+
+  * the FTS5 trigram path returns exactly the rows and order of the LIKE
+    path, for every sort and filter combination, short words included;
+  * walking next_cursor yields the same rows as one big page, and as
+    page/per_page;
+  * the triggers keep the shadow table in sync on insert / update /
+    delete / INSERT OR REPLACE, and a missing table falls back to LIKE;
+  * relevance ranks name hits above series-only hits.
+
+Prints per-query picker latency for both paths. sqlite3 only.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import random
+import sqlite3
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "character_search", os.path.join(_HERE, "core", "character_search.py"))
+_cs = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_cs)
+
+ROWS = 11_500
+SERIES = [("street_fighter", "Street Fighter", "video_game"),
+          ("genshin_impact", "Genshin Impact", "video_game"),
+          ("hololive", "hololive", "vtuber"), ("one_piece", "One Piece", "anime"),
+          ("original", "original", "original"), ("fate/grand_order", "Fate/Grand Order", "video_game"),
+          ("touhou", "Touhou", "video_game"), ("pokemon", "Pokemon", "anime")]
+_SYL = ["ka", "mi", "ya", "to", "ri", "sa", "chun", "li", "cam", "my", "ne", "ro", "zu", "ha",
+        "ru", "el", "ai", "ko", "an", "na", "ju", "ri", "x"]
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _make_db() -> sqlite3.Connection:
+    rng = random.Random(3)
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    conn.executescript("""
+    CREATE TABLE characters (tag TEXT PRIMARY KEY, display TEXT, series TEXT, series_tag TEXT,
+                             status TEXT, natlang_status TEXT, post_count INTEGER, updated_at TEXT);
+    CREATE TABLE character_series (series_tag TEXT PRIMARY KEY, category TEXT);
+    """)
+    conn.executemany("INSERT INTO character_series VALUES (?, ?)",
+                     [(t, cat) for t, _, cat in SERIES])
+    rows, seen = [], set()
+    while len(rows) < ROWS:
+        name = "_".join("".join(rng.choice(_SYL) for _ in range(rng.randint(1, 3)))
+                        for _ in range(rng.randint(1, 2)))
+        st, sname, _ = rng.choice(SERIES)
+        tag = f"{name}_({st})" if rng.random() < 0.7 else name
+        if tag in seen:
+            continue
+        seen.add(tag)
+        rows.append((tag, name.replace("_", " ").title(),
+                     sname if rng.random() < 0.9 else None,
+                     st if rng.random() < 0.95 else None,
+                     rng.choice(["active", "hidden"]),
+                     rng.choice(["normalized", "unprocessed"]),
+                     rng.choice([None, rng.randint(0, 50000)]),
+                     rng.choice([None, f"2026-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}"])))
+    conn.executemany("INSERT INTO characters VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+    conn.commit()
+    return conn
+
+
+def _tags(result) -> list[str]:
+    return [r["tag"] for r in result["rows"]]
+
+
+def _walk(conn, per_page, **kw) -> list[str]:
+    out, cursor = [], None
+    while True:
+        res = _cs.search_characters(conn, per_page=per_page, cursor=cursor, **kw)
+        out += _tags(res)
+        cursor = res["next_cursor"]
+        if not cursor:
+            return out
+
+
+def _ms(fn, repeat=20) -> float:
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return sorted(times)[len(times) // 2] * 1000
+
+
+def main() -> int:
+    conn = _make_db()
+    check("shadow table built", _cs.ensure_characters_fts(conn)
+          and conn.execute("SELECT COUNT(*) FROM characters_fts").fetchone()[0] == ROWS)
+
+    queries = ["cam", "chun li", "street fighter", "kam", "ri", "a", "my_(street", "Fate/Grand",
+               "zuru hololive", "ne ro", "x", "100%", "li_", "nonexistent", "KA MI", "'\"", ""]
+    sorts = ["", "relevance", "display", "tag", "post_count", "updated_at", "series"]
+    same = True
+    for q in queries:
+        for sort in sorts:
+            for kw in ({}, {"natlang_status": "normalized"}, {"category": "video_game"},
+                       {"status": "active", "category": "anime"}):
+                a = _cs.search_characters(conn, q, sort=sort, per_page=20000, **kw)
+                b = _cs.search_characters(conn, q, sort=sort, per_page=20000, use_fts=False, **kw)
+                if sort in ("", "relevance") and any(len(w) >= 3 for w in q.split()):
+                    ok = sorted(_tags(a)) == sorted(_tags(b))   # bm25 vs post_count order
+                else:
+                    ok = _tags(a) == _tags(b)
+                if not ok or a["total"] != b["total"]:
+                    same = False
+                    print(f"    mismatch: {q!r} sort={sort!r} {kw}")
+    check("FTS path == LIKE path (rows, order, total) for every query/sort/filter", same)
+
+    full = _tags(_cs.search_characters(conn, "ka", sort="post_count", per_page=100000))
+    check("keyset walk == one big page (post_count, NULLs included)",
+          _walk(conn, 37, search="ka", sort="post_count") == full and len(full) > 100)
+    check("keyset walk == one big page (series, relevance)",
+          _walk(conn, 50, search="", sort="series")
+          == _tags(_cs.search_characters(conn, "", sort="series", per_page=100000))
+          and _walk(conn, 25, search="cam street")
+          == _tags(_cs.search_characters(conn, "cam street", per_page=100000)))
+    check("page/per_page == keyset pages",
+          sum((_tags(_cs.search_characters(conn, "ka", sort="post_count", per_page=37, page=p))
+               for p in range(1, len(full) // 37 + 2)), []) == full)
+    first = _cs.search_characters(conn, "ka", sort="updated_at", per_page=10)
+    later = _cs.search_characters(conn, "ka", sort="updated_at", per_page=10,
+                                  cursor=first["next_cursor"])
+    check("cursor pages skip the COUNT", first["total"] > 10 and later["total"] is None)
+    try:
+        _cs.search_characters(conn, "ka", sort="tag", cursor=first["next_cursor"])
+        bad = False
+    except ValueError:
+        bad = True
+    check("cursor from another sort rejected", bad)
+
+    conn.execute("INSERT INTO characters (tag, display, post_count) "
+                 "VALUES ('street_urchin', 'Street Urchin', 0)")
+    ranked = _tags(_cs.search_characters(conn, "street", per_page=5))
+    check("relevance: a name hit ranks above series-only hits",
+          ranked[0] == "street_urchin" and len(ranked) == 5)
+    conn.execute("DELETE FROM characters WHERE tag = 'street_urchin'")
+
+    conn.execute("INSERT INTO characters (tag, display, series, series_tag, post_count) "
+                 "VALUES ('zzqx_new', 'Zzqx New', 'Street Fighter', 'street_fighter', 5)")
+    conn.execute("UPDATE characters SET display = 'Qqwv Renamed' WHERE tag = ?", (full[0],))
+    conn.execute("DELETE FROM characters WHERE tag = ?", (full[1],))
+    conn.execute("INSERT OR REPLACE INTO characters (tag, display, post_count) "
+                 "VALUES ('zzqx_new', 'Zzqx Replaced', 6)")
+    conn.execute("INSERT INTO characters (tag, display, post_count) VALUES ('yyqx', 'Yyqx', 1)")
+    conn.commit()
+    check("triggers: insert / update / delete / replace stay in sync",
+          _tags(_cs.search_characters(conn, "zzqx replaced")) == ["zzqx_new"]
+          and "zzqx_new" not in _tags(_cs.search_characters(conn, "street", per_page=100000))
+          and _tags(_cs.search_characters(conn, "qqwv")) == [full[0]]
+          and full[1] not in _tags(_cs.search_characters(conn, "ka", per_page=100000))
+          and _tags(_cs.search_characters(conn, "yyqx")) == ["yyqx"]
+          and conn.execute("SELECT COUNT(*) FROM characters_fts").fetchone()[0]
+          == conn.execute("SELECT COUNT(*) FROM characters").fetchone()[0])
+
+    queries = ["cam", "chun li", "street fighter", "kamiya", "mi"]
+    print("\n  picker query (per_page 60, natlang_status=normalized), median ms:")
+    fts_ms, like_ms = [], []
+    for q in queries:
+        kw = dict(per_page=60, sort="post_count", natlang_status="normalized")
+        f = _ms(lambda: _cs.search_characters(conn, q, **kw))
+        like = _ms(lambda: _cs.search_characters(conn, q, use_fts=False, **kw))
+        if any(len(w) >= 3 for w in q.split()):
+            fts_ms.append(f)
+            like_ms.append(like)
+        print(f"    {q!r:<18} LIKE {like:6.2f}   FTS {f:6.2f}")
+    print()
+    check("3+ char picker queries at least 3x faster on the FTS path",
+          sum(fts_ms) * 3 < sum(like_ms))
+
+    conn.execute("DROP TABLE characters_fts")
+    for t in ("bi", "ai", "ad", "au"):
+        conn.execute(f"DROP TRIGGER characters_fts_{t}")
+    check("missing shadow table: LIKE fallback, same rows",
+          _tags(_cs.search_characters(conn, "cam", sort="tag"))
+          == _tags(_cs.search_characters(conn, "cam", sort="tag", use_fts=False)))
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,462 @@
+#!/usr/bin/env python3
+"""Regression tests for the prompt compiler's caches (core/compiler.py).
+
+Locks the compile cache contract: a deterministic chain is served from cache,
+anything that drew randomness is never stored, and editing a wildcard file the
+compile read invalidates the cached result. Also the parsed-wildcard file
+cache: one parse per file version, re-parse on edit, LRU cap. And the
+namespace index: resolution matches the old per-reference filesystem probe.
+And the single-pass lexers/parsers (comments, $name{} regions, __name__
+references, braces): differential against the old char loops and regex-rescan
+passes over generated corpora, same seed -> byte-identical output. Plus the explicit RNG streams: a seeded compile ignores
+the global `random` module, and interleaved/threaded compiles match serial ones.
+Uses a throwaway wildcard folder.
+torch-free; run anywhere.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "pc_compiler", os.path.join(_HERE, "core", "compiler.py"))
+_c = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_c)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _write(path, text):
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    # bump mtime explicitly — coarse filesystem clocks can otherwise hide a
+    # same-second rewrite from the (mtime_ns, size) check
+    t = time.time() + 5
+    os.utime(path, (t, t))
+
+
+def _probe_resolve(name):
+    """The pre-index resolver: stat every candidate path (reference)."""
+    if ".." in name:
+        return None, None
+    parts = name.split("/")
+    for split_at in range(len(parts), 0, -1):
+        stem = "/".join(parts[:split_at])
+        key = "/".join(parts[split_at:]) or None
+        for base in _c.get_wildcard_paths():
+            segs = stem.split("/")
+            parent = "/".join(segs[:-1])
+            for variant in _c._dash_underscore_variants(segs[-1]):
+                rel = f"{parent}/{variant}" if parent else variant
+                for ext in _c.WILDCARD_EXTENSIONS:
+                    if ext == ".txt" and key:
+                        continue
+                    cand = (base / f"{rel}{ext}").resolve()
+                    try:
+                        cand.relative_to(base)
+                    except ValueError:
+                        continue
+                    if cand.is_file():
+                        return cand, (None if ext == ".txt" else key)
+    return None, None
+
+
+def _legacy_strip_comments(text):
+    """The pre-lexer char loop (reference)."""
+    if not text:
+        return ""
+    result, cursor, in_block = [], 0, False
+    while cursor < len(text):
+        if not in_block and text[cursor:cursor+2] == "/*":
+            in_block, cursor = True, cursor + 2
+            continue
+        if in_block and text[cursor:cursor+2] == "*/":
+            in_block, cursor = False, cursor + 2
+            continue
+        if in_block:
+            cursor += 1
+            continue
+        if text[cursor:cursor+2] == "//":
+            while cursor < len(text) and text[cursor] != "\n":
+                cursor += 1
+            continue
+        if text[cursor] == "#":
+            is_line_start = cursor == 0 or text[cursor-1] == "\n"
+            if not is_line_start:
+                scan = cursor - 1
+                while scan >= 0 and text[scan] in " \t":
+                    scan -= 1
+                is_line_start = scan < 0 or text[scan] == "\n"
+            if is_line_start:
+                while cursor < len(text) and text[cursor] != "\n":
+                    cursor += 1
+                continue
+        result.append(text[cursor])
+        cursor += 1
+    return "".join(result)
+
+
+def _legacy_resolve_braces(text, rng=None):
+    """The pre-parser regex-rescan resolver (reference)."""
+    rng = rng or random
+    for _ in range(100):
+        match = re.search(r"\{([^{}]+)\}", text)
+        if not match:
+            break
+        options = [o for o in (opt.strip(" \t\r\n,") for opt in match.group(1).split("|")) if o]
+        replacement = rng.choice(options) if options else ""
+        text = text[:match.start()] + replacement + text[match.end():]
+    return text.strip()
+
+
+def _legacy_iter_region_spans(text):
+    """The pre-lexer region scanner: regex search + char-loop depth (reference)."""
+    if not text or "$" not in text:
+        return
+    pos = 0
+    while True:
+        m = re.compile(r"\$(\w+)\s*\{").search(text, pos)
+        if not m:
+            return
+        depth, i = 1, m.end()
+        while i < len(text) and depth > 0:
+            if text[i] == "{":
+                depth += 1
+            elif text[i] == "}":
+                depth -= 1
+            i += 1
+        if depth != 0:
+            yield m.group(1), text[m.end():], m.start(), len(text)
+            return
+        yield m.group(1), text[m.end():i - 1], m.start(), i
+        pos = i
+
+
+def _legacy_expand_wildcard_files(text, rng=None):
+    """The pre-lexer whole-string substitution passes (reference)."""
+    rng = rng or random
+    if not text or "__" not in text:
+        return text
+
+    def replace(match):
+        path, key = _c.resolve_wildcard_name(match.group(1))
+        options = _c.parse_wildcard_file(path, key) if path is not None else []
+        if not options:
+            return match.group(0)
+        return options[rng.randint(0, len(options) - 1)]
+
+    for _ in range(10):
+        expanded = _c.WILDCARD_PATTERN.sub(replace, text)
+        if expanded == text:
+            break
+        text = expanded
+    return text
+
+
+# Wildcard files for the reference corpus: nesting, self-reference, and
+# options whose underscores sit against neighbouring text.
+_WC_FILES = {
+    "wc_color.txt": "red\nblue\n__wc_shade__ green\n",
+    "wc_shade.txt": "dark\nlight\n__wc_color__\n",
+    "wc_self.txt": "__wc_self__\nend\n",
+    "wc_edge.txt": "__\nwc_\n_color__\n__wc\n__wc_self__x\nx__wc_color__\n",
+}
+_WC_FRAGMENTS = ["__wc_color__", "__wc_shade__", "__wc_self__", "__wc_edge__", "__missing__",
+                 "__", "_", "___", "wc", "wc_", "_color", "_color__", "x", " ", ", ",
+                 "{a|b}", "/", "\n"]
+_REGION_FRAGMENTS = ["$m1{", "$hero {", "$", "$x", "{", "}", "{a|b}", " ", "tag", "\n",
+                     "$m2{ body }", "}}", "{{"]
+
+
+def _fragment_corpus(fragments, n, seed):
+    rng = random.Random(seed)
+    return ["".join(rng.choice(fragments) for _ in range(rng.randint(1, 30)))
+            for _ in range(n)]
+
+
+_FRAGMENTS = ["a", "red hat", " ", ", ", "\n", "|", "||", "{", "}", "{}", "{|}",
+              "{ }", "/*", "*/", "//", "#", " # ", "\n#", "(tag:1.2)", "BREAK",
+              "::Label:: ", "Negative Prompt: ", "$m1{", "\t", "cat", "dog,"]
+
+
+def _corpus(n, seed=1234):
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        out.append("".join(rng.choice(_FRAGMENTS) for _ in range(rng.randint(1, 40))))
+    # balanced nesting, including more groups than the 100-resolution cap
+    out.append("{a|{b|{c|d}}|e} " * 3)
+    out.append(", ".join("{x%d|y%d}" % (i, i) for i in range(130)))
+    out.append("{" * 50 + "deep" + "}" * 50)
+    return out
+
+
+def main() -> int:
+    tmp = tempfile.mkdtemp(prefix="pc_wc_")
+    _c.WILDCARDS_FOLDER = tmp
+    _c.invalidate_wildcard_index()
+
+    # ── compile cache ────────────────────────────────────────────────────────
+    _c.clear_compile_cache()
+    a = _c.compile_prompt_cached("masterpiece, a cat, a cat\nNegative Prompt: blurry")
+    b = _c.compile_prompt_cached("masterpiece, a cat, a cat\nNegative Prompt: blurry")
+    stats = _c.compile_cache_stats()
+    check("deterministic prompt: second compile is a hit",
+          stats["hits"] == 1 and stats["misses"] == 1)
+    check("cached result equals a fresh compile",
+          a == b == _c.compile_prompt("masterpiece, a cat, a cat\nNegative Prompt: blurry"))
+
+    b[2]["poked"] = True
+    c = _c.compile_prompt_cached("masterpiece, a cat, a cat\nNegative Prompt: blurry")
+    check("cached result is a copy (caller mutation doesn't leak)", "poked" not in c[2])
+
+    _c.clear_compile_cache()
+    for _ in range(3):
+        _c.compile_prompt_cached("a {red|blue} dress")
+    stats = _c.compile_cache_stats()
+    check("randomized prompt never stored",
+          stats["hits"] == 0 and stats["uncacheable"] == 3 and stats["size"] == 0)
+
+    _c.compile_prompt_cached("a {red} dress")
+    _c.compile_prompt_cached("a {red} dress")
+    check("single-option brace is deterministic", _c.compile_cache_stats()["hits"] == 1)
+
+    # wildcard file: switch mode is deterministic, editing the file invalidates
+    _c.clear_compile_cache()
+    wc = os.path.join(tmp, "colors.txt")
+    _write(wc, "red\nblue\n")
+    modes = {"colors": {"mode": "switch", "index": 2}}
+    p1 = _c.compile_prompt_cached("a __colors__ hat", wildcard_modes=modes)[0]
+    p2 = _c.compile_prompt_cached("a __colors__ hat", wildcard_modes=modes)[0]
+    check("switch-mode wildcard cached", p1 == p2 == "a blue hat"
+          and _c.compile_cache_stats()["hits"] == 1)
+    _write(wc, "red\ngreen\n")
+    p3 = _c.compile_prompt_cached("a __colors__ hat", wildcard_modes=modes)[0]
+    check("editing the wildcard file invalidates the entry", p3 == "a green hat")
+
+    _c.compile_prompt_cached("a __colors__ hat")
+    check("randomize-mode wildcard not stored",
+          _c.compile_cache_stats()["uncacheable"] == 1)
+
+    _c.compile_prompt_cached("a __missing__ hat")
+    check("unresolved wildcard not stored (a file may appear later)",
+          _c.compile_cache_stats()["uncacheable"] == 2)
+
+    r1 = _c.compile_regions_cached("a park $m1{ red hat } $m2{ blue hat }")
+    r2 = _c.compile_regions_cached("a park $m1{ red hat } $m2{ blue hat }")
+    check("compile_regions cached", r1 == r2 and [r["text"] for r in r2["regions"]]
+          == ["red hat", "blue hat"])
+
+    # ── parsed-wildcard file cache ───────────────────────────────────────────
+    _c.invalidate_wildcard_cache()
+    yml = os.path.join(tmp, "chars.yaml")
+    _write(yml, "root:\n  hair: [red hair, blue hair]\n  eyes: [green eyes]\n")
+    _c.invalidate_wildcard_index()  # new file inside the recheck window
+    before = _c.wildcard_cache_stats()
+    for _ in range(5):
+        _c.compile_prompt("__chars/hair__, __chars/eyes__", wildcard_modes={
+            "chars/hair": {"mode": "combine"}, "chars/eyes": {"mode": "combine"}})
+    after = _c.wildcard_cache_stats()
+    check("yaml parsed once across references and compiles",
+          after["misses"] - before["misses"] == 1 and after["hits"] > before["hits"])
+    opts = _c.parse_wildcard_file(_c.Path(yml).resolve(), "hair")
+    opts.append("mutated")
+    check("returned options are a copy",
+          _c.parse_wildcard_file(_c.Path(yml).resolve(), "hair") == ["red hair", "blue hair"])
+    _write(yml, "root:\n  hair: [white hair]\n")
+    check("edited yaml re-parsed",
+          _c.parse_wildcard_file(_c.Path(yml).resolve(), "hair") == ["white hair"])
+    check("sections come from the same cached parse",
+          _c.get_wildcard_sections(_c.Path(yml).resolve()) == ["hair"])
+
+    old_max = _c._WILDCARD_CACHE_MAX
+    _c._WILDCARD_CACHE_MAX = 2
+    for i in range(4):
+        f = os.path.join(tmp, f"cap{i}.txt")
+        _write(f, f"opt{i}\n")
+        _c.parse_wildcard_file(_c.Path(f).resolve())
+    check("cache respects its size cap", _c.wildcard_cache_stats()["size"] == 2)
+    _c._WILDCARD_CACHE_MAX = old_max
+
+    # ── namespace index vs the old filesystem probe ─────────────────────────
+    for rel, body in [("anime/gkr-anime.yaml", "race: [elf]\nhair: {long: [a]}\n"),
+                      ("anime/gkr_anime.txt", "x\n"),
+                      ("styles.txt", "s\n"), ("styles.json", '{"k": ["j"]}'),
+                      ("deep/a/b.yml", "c: [d]\n"), ("my-things.txt", "t\n")]:
+        os.makedirs(os.path.dirname(os.path.join(tmp, rel)), exist_ok=True)
+        _write(os.path.join(tmp, rel), body)
+    _c.invalidate_wildcard_index()
+    names = ["anime/gkr-anime", "anime/gkr_anime", "anime/gkr-anime/race",
+             "anime/gkr-anime/hair/long", "styles", "styles/k", "deep/a/b/c",
+             "deep/a/b", "my_things", "my-things", "nope", "anime/nope/x",
+             "../etc/passwd", "/styles", "deep//a/b", "./styles"]
+    check("index resolution == filesystem probe for every name",
+          all(_c.resolve_wildcard_name(n) == _probe_resolve(n) for n in names))
+
+    meta = _c.compile_prompt("a __nope__ and __nope__ and __styles__")[2]
+    check("unresolved names reported once", meta.get("unresolved_wildcards") == ["nope"])
+
+    os.remove(os.path.join(tmp, "my-things.txt"))
+    _write(os.path.join(tmp, "my_things.txt"), "u\n")
+    t = _c.time.monotonic
+    _c.time.monotonic = lambda: t() + 60  # step past the recheck window
+    try:
+        got = _c.resolve_wildcard_name("my-things")[0]
+    finally:
+        _c.time.monotonic = t
+    check("directory mtime change refreshes the index",
+          got is not None and got.name == "my_things.txt")
+
+    # ── single-pass lexer/parser vs the old pipeline ────────────────────────
+    corpus = _corpus(2000)
+    check("strip_comments == legacy char loop",
+          all(_c.strip_comments(t) == _legacy_strip_comments(t) for t in corpus))
+    mismatch = []
+    for i, t in enumerate(corpus):
+        random.seed(i)
+        new = _c._resolve_braces(t)
+        random.seed(i)
+        if new != _legacy_resolve_braces(t):
+            mismatch.append(t)
+    check("brace resolution byte-identical per seed", not mismatch)
+
+    new_strip, new_braces = _c.strip_comments, _c._resolve_braces
+    mismatch = []
+    for mode in ("combine", "roll", "switch"):
+        for i, t in enumerate(corpus[:600]):
+            random.seed(i)
+            try:
+                new = _c.compile_prompt(t, mode=mode, switch_index=2)
+            except ValueError as e:  # empty-label roll: same failure both ways
+                new = repr(e)
+            _c.strip_comments, _c._resolve_braces = _legacy_strip_comments, _legacy_resolve_braces
+            random.seed(i)
+            try:
+                old = _c.compile_prompt(t, mode=mode, switch_index=2)
+            except ValueError as e:
+                old = repr(e)
+            _c.strip_comments, _c._resolve_braces = new_strip, new_braces
+            if new != old:
+                mismatch.append((mode, t))
+    check("compile_prompt byte-identical per seed (all modes)", not mismatch)
+
+    regions = _fragment_corpus(_REGION_FRAGMENTS, 2000, 77) + corpus
+    check("region spans == legacy regex + char-loop scanner",
+          all(list(_c._iter_region_spans(t)) == list(_legacy_iter_region_spans(t))
+              for t in regions))
+
+    for name, body in _WC_FILES.items():
+        _write(os.path.join(tmp, name), body)
+    _c.invalidate_wildcard_index()
+    mismatch = [t for i, t in enumerate(_fragment_corpus(_WC_FRAGMENTS, 4000, 91))
+                if _c.expand_wildcard_files(t, rng=random.Random(i))
+                != _legacy_expand_wildcard_files(t, rng=random.Random(i))]
+    check("__name__ expansion byte-identical per seed", not mismatch)
+
+    for i in range(9):
+        _write(os.path.join(tmp, f"chain{i}.txt"), f"__chain{i + 1}__ link{i}\n")
+    _write(os.path.join(tmp, "chain9.txt"), "end\n")
+    _c.invalidate_wildcard_index()
+    long_text = ", ".join(f"tag{i}" for i in range(20000)) + ", __chain0__"
+    scanned = []
+    wildcard_refs = _c._wildcard_refs
+    _c._wildcard_refs = lambda text: scanned.append(len(text)) or wildcard_refs(text)
+    try:
+        expanded = _c.expand_wildcard_files(long_text)
+    finally:
+        _c._wildcard_refs = wildcard_refs
+    check("long prompt, reference nested 10 deep: prompt lexed once, not once per level",
+          expanded == _legacy_expand_wildcard_files(long_text)
+          and scanned and sum(scanned) < len(long_text) + 200)
+
+    long_text = ", ".join("{a%d|b%d|{c|d}}" % (i, i) for i in range(20000))
+    t0 = time.perf_counter()
+    _c.BraceTemplate(long_text).render()
+    check("20k-group template parses+renders in linear time (<1s)",
+          time.perf_counter() - t0 < 1.0)
+
+    # ── isolated RNG streams ─────────────────────────────────────────────────
+    _write(os.path.join(tmp, "mood.txt"), "happy\nsad\nangry\nbored\n")
+    _c.invalidate_wildcard_index()
+    templates = ["a {red|blue|green} {hat|cap|{tiny|huge} crown}, __mood__ face",
+                 "::A:: {x|y}\n::B:: {p|q}\n::C:: z",
+                 "{1|2|3|4|5|6|7|8|9}, {1|2|3|4|5|6|7|8|9}, __mood__"]
+    jobs = [(t, mode, seed) for t in templates for mode in ("combine", "roll")
+            for seed in range(25)]
+
+    def run(job):
+        t, mode, seed = job
+        return _c.compile_prompt(t, mode=mode, rng=_c.make_rng(seed, "node7", 0))
+
+    serial = [run(j) for j in jobs]
+    random.seed(99)
+    perturbed = []
+    for j in jobs:
+        random.random()  # another node drawing from the global module
+        perturbed.append(run(j))
+    check("seeded compile unaffected by global random use", perturbed == serial)
+
+    # interleaved on one thread: two compiles advance their own streams
+    # alternately (one wildcard pick each), results still equal serial ones
+    rng_a, rng_b = _c.make_rng(5, "a"), _c.make_rng(5, "b")
+    inter = []
+    for _ in range(30):
+        inter.append(_c.compile_prompt(templates[0], rng=rng_a)[0])
+        inter.append(_c.compile_prompt(templates[2], rng=rng_b)[0])
+    rng_a, rng_b = _c.make_rng(5, "a"), _c.make_rng(5, "b")
+    want = [_c.compile_prompt(templates[0], rng=rng_a)[0] for _ in range(30)]
+    want_b = [_c.compile_prompt(templates[2], rng=rng_b)[0] for _ in range(30)]
+    check("interleaved compiles == serial", inter[0::2] == want and inter[1::2] == want_b)
+
+    threaded = [None] * len(jobs)
+
+    def worker(offset):
+        for i in range(offset, len(jobs), 4):
+            threaded[i] = run(jobs[i])
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    check("4-thread concurrent compiles == serial", threaded == serial)
+    check("streams differ per node id",
+          run(("{1|2|3|4|5|6|7|8|9}" * 4, "combine", 1))
+          != _c.compile_prompt("{1|2|3|4|5|6|7|8|9}" * 4, rng=_c.make_rng(1, "node8", 0)))
+
+    # ── batch compile ────────────────────────────────────────────────────────
+    tpl = "a {red|blue} hat $m1{ {tall|short} man }\n::One:: {x|y}\n::Two:: z"
+    batch = list(_c.compile_batch(tpl, seeds=range(20)))
+    single = [_c.compile_prompt_regions(tpl, rng=_c.make_rng(s, "batch", ""))
+              for s in range(20)]
+    check("batch variant == single compile with the same stream",
+          [(v["positive"], v["negative"], v["regions"]) for v in batch]
+          == [(p, n, r) for p, n, _m, r in single])
+    labels = list(_c.compile_batch("::A:: apple\n::B:: banana", seeds=[1, 2],
+                                   iterate=[0, 1], regions=False))
+    check("iterate indices select labels (switch mode), seeds x indices",
+          [v["positive"] for v in labels] == ["apple", "banana", "apple", "banana"]
+          and "regions" not in labels[0])
+
+    shutil.rmtree(tmp, ignore_errors=True)
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Tests for the DB write-generation counter (core/db_generation.py).
+
+Checks the token holds still while nothing writes, moves on a commit from
+another connection (rollback-journal and WAL mode), moves when the file is
+replaced underneath it, and that FingerprintGate only recomputes when it
+moves. Prints the per-call cost of the token vs a fingerprint-style
+aggregate query.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "db_generation", os.path.join(_HERE, "core", "db_generation.py"))
+_dg = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_dg)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _make_db(path: Path, wal: bool = False) -> None:
+    conn = sqlite3.connect(path)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE items (item_tag TEXT)")
+    conn.executemany("INSERT INTO items VALUES (?)", [(f"t{i}",) for i in range(2000)])
+    conn.commit()
+    conn.close()
+
+
+def _check_mode(d: Path, wal: bool) -> None:
+    label = "wal" if wal else "journal"
+    path = d / f"{label}.db"
+    _make_db(path, wal)
+    gen = _dg.DBGeneration(path)
+    t0 = gen.current()
+    check(f"{label}: token stable without writes", t0 is not None and gen.current() == t0)
+
+    writer = sqlite3.connect(path)
+    writer.execute("INSERT INTO items VALUES ('new')")
+    writer.commit()
+    t1 = gen.current()
+    check(f"{label}: commit moves the token", t1 != t0)
+    check(f"{label}: stable again after the commit", gen.current() == t1)
+    writer.execute("SELECT COUNT(*) FROM items").fetchone()
+    check(f"{label}: reads don't move it", gen.current() == t1)
+    writer.execute("UPDATE items SET item_tag = 'edited' WHERE rowid = 5")
+    writer.commit()
+    check(f"{label}: in-place edit moves it", gen.current() != t1)
+    writer.close()
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        d = Path(tmp)
+        _check_mode(d, wal=False)
+        _check_mode(d, wal=True)
+
+        path = d / "swap.db"
+        _make_db(path)
+        gen = _dg.DBGeneration(path)
+        t0 = gen.current()
+        _make_db(d / "replacement.db")
+        os.replace(d / "replacement.db", path)
+        t1 = gen.current()
+        check("replaced file moves the token", t1 != t0 and t1 is not None)
+        w = sqlite3.connect(path)
+        w.execute("INSERT INTO items VALUES ('x')")
+        w.commit()
+        w.close()
+        check("writes to the replacement still seen", gen.current() != t1)
+        check("missing DB gives None", _dg.DBGeneration(d / "nope.db").current() is None)
+
+        calls = []
+
+        def fingerprint():
+            calls.append(1)
+            conn = sqlite3.connect(path)
+            row = conn.execute("SELECT MAX(rowid), COUNT(*) FROM items").fetchone()
+            conn.close()
+            return tuple(row)
+
+        gate = _dg.FingerprintGate(gen, fingerprint)
+        fp = gate.get()
+        for _ in range(100):
+            gate.get()
+        check("gate: 101 checks, 1 fingerprint query", len(calls) == 1 and gate.stats()
+              == {"checks": 101, "recomputes": 1})
+        w = sqlite3.connect(path)
+        w.execute("DELETE FROM items WHERE rowid = 3")
+        w.commit()
+        w.close()
+        check("gate: recomputes after a write", gate.get() != fp and len(calls) == 2)
+
+        stats = _dg.SearchStats("test_search", extra=lambda: {"fingerprint": gate.stats()})
+        for _ in range(3):
+            run = stats.start()
+            gate.get()
+            run.lap("fresh")
+            time.sleep(0.002)
+            run.lap("score")
+            laps = run.finish()
+        snap = _dg.all_search_stats()["test_search"]
+        check("stats: runs counted with per-phase means",
+              snap["searches"] == 3 and set(snap["mean_ms"]) == {"fresh", "score", "total"}
+              and snap["mean_ms"]["score"] >= 1.5 and "checks" in snap["fingerprint"])
+        check("stats: total is the sum of the laps",
+              abs(laps["total"] - laps["fresh"] - laps["score"]) < 1e-9)
+
+        n = 2000
+        t = time.perf_counter()
+        for _ in range(n):
+            gen.current()
+        token_us = (time.perf_counter() - t) / n * 1e6
+        t = time.perf_counter()
+        for _ in range(200):
+            fingerprint()
+        fp_us = (time.perf_counter() - t) / 200 * 1e6
+        print(f"\n  generation token {token_us:.1f} us/call, "
+              f"fingerprint query {fp_us:.1f} us/call")
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
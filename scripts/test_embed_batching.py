@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""Tests for length-bucketed batching in core/_embed_model.embed.
+
+`_length_batches` decides which texts share a forward pass; every batch
+pads to its own longest member. Checks the plan covers each position
+exactly once, groups by length, and on a tag-wiki-like length mix (a few
+long wiki bodies among short tag names) cuts padding against the old
+input-order batching. `describe_report` formatting too. torch-free: the
+token lengths are synthetic.
+
+Concurrency: a MAX_LENGTH index build and QUERY_MAX_LENGTH queries through
+the micro-batcher run at once against a stand-in for the HF fast tokenizer
+(one shared truncation setting, "Already borrowed" on overlapping calls).
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import random
+import sys
+import threading
+import time
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "_embed_model", os.path.join(_HERE, "core", "_embed_model.py"))
+_em = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_em)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _padded(lengths, batches):
+    return sum(len(b) * max(lengths[i] for i in b) for b in batches)
+
+
+def _input_order(n, batch_size):
+    return [list(range(i, min(i + batch_size, n))) for i in range(0, n, batch_size)]
+
+
+class _Input:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Session:
+    """Stand-in onnxruntime session: the CLS row is a function of the ids."""
+
+    def get_inputs(self):
+        return [_Input(n) for n in ("input_ids", "attention_mask")]
+
+    def run(self, _outputs, feed):
+        return [np.stack([_cls_row([i for i in row if i]) for row in feed["input_ids"]])]
+
+
+def _cls_row(ids):
+    return (np.cos(np.arange(_em.EMBED_DIM) * (sum(ids) % 997 + 1)) * len(ids)).astype(np.float32)
+
+
+class _SharedTokenizer:
+    """Stand-in for the HF fast tokenizer: one truncation setting shared by
+    every caller, rewritten when a call's max_length differs from the last
+    call's, and a call that enters while another is running fails the way
+    the Rust backend's borrow check does."""
+
+    def __init__(self):
+        self.max_length = None
+        self.busy = False
+
+    def __call__(self, texts, truncation=True, max_length=None):
+        if self.busy:
+            raise RuntimeError("Already borrowed")
+        self.busy = True
+        try:
+            if max_length != self.max_length:
+                self.max_length = max_length
+                time.sleep(0.002)           # set_truncation_and_padding
+            ids = []
+            for text in texts:
+                ids.append([len(w) + 1 for w in text.split()][:self.max_length])
+                time.sleep(0)
+            return {"input_ids": ids, "attention_mask": [[1] * len(r) for r in ids]}
+        finally:
+            self.busy = False
+
+    def pad(self, enc, padding=True, return_tensors=None):
+        width = max(len(r) for r in enc["input_ids"])
+        return {k: np.array([r + [0] * (width - len(r)) for r in rows], dtype=np.int64)
+                for k, rows in enc.items()}
+
+
+def _expected(texts, max_length):
+    rows = np.stack([_cls_row([len(w) + 1 for w in t.split()][:max_length]) for t in texts])
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+def _check_concurrent():
+    rng = random.Random(3)
+    words = ["a", "red", "hat", "standing", "in", "the", "rain", "wizard", "of", "oz"]
+    build = [" ".join(rng.choice(words) for _ in range(rng.randint(200, 600)))
+             for _ in range(300)]
+    queries = [[" ".join(rng.choice(words) for _ in range(rng.randint(5, 200)))
+                for _ in range(3)] for _ in range(120)]
+    loaded = (_em._OnnxEncoder(_Session(), "onnx"), _SharedTokenizer(), "cpu")
+    _em.get = lambda: loaded
+    _em.QUERY_CACHE_MAX_BYTES = 0           # every query goes through the batcher
+
+    errors: list[BaseException] = []
+    built: list = []
+    answered: list = [None] * len(queries)
+
+    def run_build():
+        try:
+            for _ in range(3):
+                built.append(_em._embed_with(loaded, build, batch_size=16))
+        except BaseException as e:    # noqa: BLE001 — reported below
+            errors.append(e)
+
+    def run_queries(offset):
+        try:
+            for i in range(offset, len(queries), 4):
+                answered[i] = _em.embed_cached(queries[i])
+        except BaseException as e:    # noqa: BLE001 — reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=run_build)] + [
+        threading.Thread(target=run_queries, args=(k,)) for k in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    check(f"concurrent build + batched queries: no tokenizer errors ({errors[:1]})",
+          not errors)
+    check("concurrent build: every row truncated at MAX_LENGTH",
+          len(built) == 3 and all(np.allclose(b, _expected(build, _em.MAX_LENGTH), atol=1e-5)
+                                  for b in built))
+    check("concurrent queries: every row truncated at QUERY_MAX_LENGTH",
+          all(a is not None and np.allclose(a, _expected(q, _em.QUERY_MAX_LENGTH), atol=1e-5)
+              for q, a in zip(queries, answered)))
+
+    # callers with different caps, concurrently vs one after another
+    jobs = [(build[i * 20:(i + 1) * 20], cap) for i in range(12)
+            for cap in (32, _em.QUERY_MAX_LENGTH, 300, _em.MAX_LENGTH)]
+    serial = [_em._embed_with(loaded, texts, batch_size=8, max_length=cap)
+              for texts, cap in jobs]
+    concurrent: list = [None] * len(jobs)
+
+    def run_jobs(offset):
+        try:
+            for i in range(offset, len(jobs), 6):
+                texts, cap = jobs[i]
+                concurrent[i] = _em._embed_with(loaded, texts, batch_size=8, max_length=cap)
+        except BaseException as e:    # noqa: BLE001 — reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=run_jobs, args=(k,)) for k in range(6)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    check("mixed max_length callers: concurrent results identical to serial ones",
+          not errors and all(c is not None and np.array_equal(c, s)
+                             for c, s in zip(concurrent, serial)))
+
+
+def main() -> int:
+    lengths = [400] + [5] * 63
+    batches = _em._length_batches(lengths, 32)
+    check("every position exactly once",
+          sorted(i for b in batches for i in b) == list(range(64)))
+    check("one long text no longer pads 63 short ones",
+          _padded(lengths, batches) == 32 * 5 + 31 * 5 + 400
+          and _padded(lengths, _input_order(64, 32)) == 32 * 400 + 32 * 5)
+    check("equal lengths keep input order (stable)",
+          _em._length_batches([3, 1, 3, 1], 4) == [[1, 3, 0, 2]])
+    check("empty input", _em._length_batches([], 8) == [])
+
+    rng = random.Random(0)
+    # ~14k rows: mostly short-to-medium wiki bodies, a long tail to 512.
+    mix = [min(512, int(rng.lognormvariate(4.2, 0.8)) + 2) for _ in range(14000)]
+    tokens = sum(mix)
+    before = _padded(mix, _input_order(len(mix), 64))
+    after = sum(_padded(mix[w:w + _em._SORT_WINDOW],
+                        _em._length_batches(mix[w:w + _em._SORT_WINDOW], 64))
+                for w in range(0, len(mix), _em._SORT_WINDOW))
+    pad_before = (before - tokens) / before
+    pad_after = (after - tokens) / after
+    print(f"\n  wiki-like mix, batch 64: padding {pad_before:.0%} input order -> "
+          f"{pad_after:.0%} length-bucketed ({before / after:.1f}x fewer token slots)\n")
+    check("length bucketing cuts padded token slots by more than half", after * 2 < before)
+    check("padding under 5% after bucketing", pad_after < 0.05)
+
+    report = {"texts": 100, "tokens": 9000, "padded_tokens": 10000, "seconds": 2.0}
+    check("describe_report", _em.describe_report(report)
+          == "100 texts, 4,500 tokens/s, padding 10%")
+    check("describe_report on an empty pass", _em.describe_report({})
+          == "0 texts, 0 tokens/s, padding 0%")
+    check("query cap below the index cap", 0 < _em.QUERY_MAX_LENGTH < _em.MAX_LENGTH)
+
+    _check_concurrent()
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""Round-trip tests for the memory-mapped embedding index (core/embed_index.py).
+
+Writes a random index to a temp dir, maps it back and checks the mapped
+vectors, scores and lazily decoded rows match the in-memory originals; that
+float16 and int8 storage score within quantization error; that a truncated
+or mismatched file is refused instead of mapped; that an incremental
+rebuild (reuse_vectors + generation swap) equals a rebuild from scratch;
+that pruning spares generations other processes are writing or have just
+published; and that sync_index maps an unchanged cache without embedding anything.
+numpy only; torch-free.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import logging
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "embed_index", os.path.join(_HERE, "core", "embed_index.py"))
+_ei = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_ei)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _random_index(n, dim, seed=0):
+    rng = np.random.default_rng(seed)
+    vecs = rng.standard_normal((n, dim)).astype(np.float32)
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    rows = [{"tag": f"tag_{i}", "body_summary": "é" * (i % 5), "ranking": n - i}
+            for i in range(n)]
+    return vecs, rows
+
+
+def _file(d, name):
+    """Path of a data file in the index generation `d`'s manifest points at."""
+    return d / _ei.read_manifest(d)["data_dir"] / name
+
+
+def _backdate(gen, seconds):
+    """Make generation dir `gen` look last written `seconds` ago."""
+    t = time.time() - seconds
+    for path in [gen, *gen.iterdir()]:
+        os.utime(path, (t, t))
+
+
+def _fake_embed(texts):
+    """Deterministic stand-in for the encoder: a unit vector seeded by the
+    text's content hash, so equal text always embeds equally."""
+    out = np.empty((len(texts), 384), dtype=np.float32)
+    for i, t in enumerate(texts):
+        v = np.random.default_rng(_ei.content_hash(t)).standard_normal(384)
+        out[i] = v / np.linalg.norm(v)
+    return out
+
+
+def _check_incremental(d):
+    texts = [f"wiki body {i}" for i in range(500)]
+    rows = [{"tag": f"t{i}", "body_full": t} for i, t in enumerate(texts)]
+    hashes = [_ei.content_hash(t) for t in texts]
+    _ei.write_index(d, _fake_embed(texts), rows, {}, hashes=hashes)
+    previous = _ei.EmbeddingIndex.open(d, _ei.read_manifest(d))
+    first_gen = _ei.read_manifest(d)["data_dir"]
+
+    # one edit, two deletes, one insert, and a reorder (ranking change)
+    new_rows = [dict(r) for r in rows if r["tag"] not in ("t3", "t400")]
+    new_rows[10]["body_full"] = "edited wiki body"
+    new_rows.insert(0, {"tag": "new", "body_full": "brand new tag"})
+    new_rows[5], new_rows[6] = new_rows[6], new_rows[5]
+    new_texts = [r["body_full"] for r in new_rows]
+    new_hashes = [_ei.content_hash(t) for t in new_texts]
+
+    embedded = []
+    diff, n = _ei.reuse_vectors(previous, new_hashes, 384,
+                                lambda pos: (embedded.extend(pos),
+                                             _fake_embed([new_texts[i] for i in pos]))[1])
+    scratch = _fake_embed(new_texts)
+    check(f"diff embeds only the edited + inserted rows ({n})",
+          n == 2 and sorted(new_texts[i] for i in embedded) == ["brand new tag", "edited wiki body"])
+    check("rebuild-by-diff vectors equal rebuild-from-scratch", np.array_equal(diff, scratch))
+
+    _backdate(d / first_gen, 2 * _ei._PRUNE_GRACE_S)
+    _ei.write_index(d, diff, new_rows, {}, hashes=new_hashes)
+    patched = _ei.EmbeddingIndex.open(d, _ei.read_manifest(d))
+    fresh = _ei.EmbeddingIndex.from_memory(scratch, new_rows, hashes=new_hashes)
+    q = scratch[42]
+    check("patched index equals scratch index (scores, rows, hashes)",
+          np.array_equal(patched.scores(q), fresh.scores(q))
+          and all(patched.row(i) == new_rows[i] for i in range(len(new_rows)))
+          and np.array_equal(np.asarray(patched.hashes), fresh.hashes))
+    check("old generation pruned after the swap",
+          not (d / first_gen).exists() and len(list(d.glob("data-*"))) == 1)
+    check("still-open old mapping keeps reading its own generation",
+          previous.row(3) == rows[3])
+    _, n = _ei.reuse_vectors(None, new_hashes, 384, lambda pos: _fake_embed(["x"] * len(pos)))
+    check("no previous index: every row embedded", n == len(new_hashes))
+
+
+def _check_shared(d):
+    """Several processes writing one cache dir: pruning must spare what
+    another process is writing or has only just published."""
+    vecs, rows = _random_index(50, 384)
+    _ei.write_index(d, vecs, rows, {})
+    gen_a = _ei.read_manifest(d)["data_dir"]
+    peer = d / "data-peerwriting"             # another process mid-write
+    peer.mkdir()
+    (peer / _ei.VECTORS_FILE).write_bytes(b"partial")
+    _ei.write_index(d, vecs, rows, {})
+    gen_b = _ei.read_manifest(d)["data_dir"]
+    check("shared dir: a peer's in-progress generation survives a write",
+          (peer / _ei.VECTORS_FILE).exists())
+    check("shared dir: a just-superseded generation survives the grace period",
+          (d / gen_a).exists())
+
+    _backdate(d / gen_a, 2 * _ei._PRUNE_GRACE_S)
+    _backdate(peer, 2 * _ei._PRUNE_GRACE_S)
+    _ei.write_index(d, vecs, rows, {})
+    gen_c = _ei.read_manifest(d)["data_dir"]
+    check("shared dir: idle superseded generations pruned on a later write",
+          not (d / gen_a).exists() and not peer.exists()
+          and (d / gen_b).exists() and (d / gen_c).exists())
+
+    _backdate(d / gen_c, 2 * _ei._PRUNE_GRACE_S)
+    _backdate(d / gen_b, 3 * _ei._PRUNE_GRACE_S)
+    _ei._prune_generations(d)
+    check("shared dir: the generation the manifest points at is never pruned",
+          sorted(p.name for p in d.glob("data-*")) == [gen_c]
+          and len(_ei.EmbeddingIndex.open(d, _ei.read_manifest(d))) == 50)
+
+
+def _check_sync(d):
+    rows = [{"bucket": "pose", "item_tag": f"p{i}", "base_natlang": ""} for i in range(200)]
+    texts = [f"pose: item {i}" for i in range(200)]
+    manifest = {"model_id": "m", "schema_version": 1}
+    calls = []
+
+    def embed(pos):
+        calls.append(len(pos))
+        return _fake_embed([texts[i] for i in pos])
+
+    index, n = _ei.sync_index(d, rows, texts, manifest, 384, embed)
+    check("sync: cold start embeds every row", n == 200 and calls == [200])
+    gen = _ei.read_manifest(d)["data_dir"]
+    index, n = _ei.sync_index(d, rows, texts, manifest, 384, embed)
+    check("sync: unchanged rows map the cache, embed nothing",
+          n == 0 and len(calls) == 1 and isinstance(index.vectors, np.memmap)
+          and _ei.read_manifest(d)["data_dir"] == gen)
+    check("sync: mapped cache scores like a fresh embed",
+          np.array_equal(index.scores(_fake_embed(texts[7:8])[0]),
+                         _fake_embed(texts) @ _fake_embed(texts[7:8])[0]))
+
+    rows[3] = dict(rows[3], base_natlang="edited prose")    # row-only edit
+    index, n = _ei.sync_index(d, rows, texts, manifest, 384, embed)
+    check("sync: row-only edit rewrites rows, embeds nothing",
+          n == 0 and index.row(3)["base_natlang"] == "edited prose"
+          and _ei.read_manifest(d)["data_dir"] != gen)
+    texts[5] = "pose: edited item"
+    _, n = _ei.sync_index(d, rows, texts, manifest, 384, embed)
+    check("sync: text edit embeds one row", n == 1 and calls[-1] == 1)
+
+    _, n = _ei.sync_index(d, rows, texts, manifest, 384, embed, dtype="int8")
+    check("sync: requantize to int8 reuses every vector",
+          n == 0 and _ei.read_manifest(d)["dtype"] == "int8")
+    _, n = _ei.sync_index(d, rows, texts, manifest, 384, embed)
+    check("sync: back up to float32 re-embeds", n == 200)
+    _, n = _ei.sync_index(d, rows, texts, dict(manifest, model_id="other"), 384, embed)
+    check("sync: other model discards the cache", n == 200)
+
+    warnings = []
+    handler = logging.Handler(logging.WARNING)
+    handler.emit = warnings.append
+    _ei.logger.addHandler(handler)
+    try:
+        empty = d / "empty"
+        for dtype in ("float32", "int8"):
+            first, n1 = _ei.sync_index(empty, [], [], manifest, 384, embed, dtype=dtype)
+            again, n2 = _ei.sync_index(empty, [], [], manifest, 384, embed, dtype=dtype)
+            check(f"sync: empty {dtype} index is written and reopened",
+                  len(first) == len(again) == 0 and n1 == n2 == 0
+                  and first.scores(_fake_embed(["q"])[0]).shape == (0,)
+                  and _ei.read_manifest(empty)["rowcount"] == 0)
+    finally:
+        _ei.logger.removeHandler(handler)
+    check("sync: empty index logs no warning", not warnings)
+
+    blocked = d / "blocked"
+    blocked.write_text("not a directory", encoding="utf-8")
+    index, n = _ei.sync_index(blocked / "cache", rows, texts, manifest, 384, embed)
+    check("sync: unwritable cache dir falls back to memory",
+          n == 200 and not isinstance(index.vectors, np.memmap) and len(index) == 200)
+
+
+def main() -> int:
+    vecs, rows = _random_index(1000, 384)
+    query = vecs[17]
+    with tempfile.TemporaryDirectory() as tmp:
+        d = Path(tmp)
+        _ei.write_index(d, vecs, rows, {"fingerprint": [1, 2, 3]})
+        manifest = _ei.read_manifest(d)
+        check("manifest keeps caller fields + format fields",
+              manifest["fingerprint"] == [1, 2, 3] and manifest["rowcount"] == 1000
+              and manifest["dim"] == 384 and manifest["dtype"] == "float32")
+        index = _ei.EmbeddingIndex.open(d, manifest)
+        check("vectors are memory-mapped", isinstance(index.vectors, np.memmap))
+        check("mapped vectors identical", np.array_equal(np.asarray(index.vectors), vecs))
+        check("scores identical to in-memory matmul",
+              np.array_equal(index.scores(query), vecs @ query))
+        check("rows decode lazily to the originals",
+              all(index.row(i) == rows[i] for i in (0, 1, 17, 999)))
+        hit = index.row(3)
+        hit["score"] = 1.0
+        check("row() returns a fresh dict", "score" not in index.row(3))
+
+        mem = _ei.EmbeddingIndex.from_memory(vecs, rows)
+        check("from_memory: same scores and rows",
+              np.array_equal(mem.scores(query), index.scores(query))
+              and mem.row(999) == rows[999] and len(mem) == len(index))
+
+        d16 = d / "f16"
+        _ei.write_index(d16, vecs, rows, {}, dtype="float16")
+        i16 = _ei.EmbeddingIndex.open(d16, _ei.read_manifest(d16))
+        check("float16 file is half the size",
+              os.path.getsize(_file(d16, _ei.VECTORS_FILE)) * 2
+              == os.path.getsize(_file(d, _ei.VECTORS_FILE)))
+        err = float(np.max(np.abs(i16.scores(query) - vecs @ query)))
+        check(f"float16 scores within 1e-2 (max err {err:.1e})", err < 1e-2)
+        check("float16 top hit unchanged", int(np.argmax(i16.scores(query))) == 17)
+
+        d8 = d / "i8"
+        _ei.write_index(d8, vecs, rows, {}, dtype="int8")
+        i8 = _ei.EmbeddingIndex.open(d8, _ei.read_manifest(d8))
+        check("int8 file is a quarter the size",
+              os.path.getsize(_file(d8, _ei.VECTORS_FILE)) * 4
+              == os.path.getsize(_file(d, _ei.VECTORS_FILE)))
+        err = float(np.max(np.abs(i8.scores(query) - vecs @ query)))
+        check(f"int8 scores within 1e-2 (max err {err:.1e})", err < 1e-2)
+        check("int8 top hit unchanged", int(np.argmax(i8.scores(query))) == 17)
+        check("int8 dense() dequantizes rows",
+              float(np.max(np.abs(i8.dense(np.array([5, 9])) - vecs[[5, 9]]))) < 1e-2)
+        multi = vecs[[1, 2, 3]].T
+        check("[dim, m] query scores every column",
+              i8.scores(multi).shape == (1000, 3)
+              and np.allclose(i8.scores(multi)[:, 1], i8.scores(vecs[2]), atol=1e-4))
+        mem8 = _ei.EmbeddingIndex.from_memory(vecs, rows, dtype="int8")
+        check("from_memory int8 scores like the mapped file",
+              np.array_equal(mem8.scores(query), i8.scores(query)))
+
+        with open(_file(d, _ei.VECTORS_FILE), "r+b") as f:
+            f.truncate(384 * 4 * 999)
+        try:
+            _ei.EmbeddingIndex.open(d, manifest)
+            refused = False
+        except ValueError:
+            refused = True
+        check("truncated vectors file refused", refused)
+
+        (d / _ei.MANIFEST_FILE).write_text('{"schema_version": 3}', encoding="utf-8")
+        check("manifest without the mmap format is ignored", _ei.read_manifest(d) is None)
+
+        _check_incremental(d / "incremental")
+        _check_shared(d / "shared")
+        _check_sync(d / "sync")
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
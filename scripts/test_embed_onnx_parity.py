@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+"""Parity test: the ONNX Runtime backends in core/_embed_model.py against
+the torch encoder on a fixed corpus (tag names, wiki-style sentences,
+search queries — the three kinds of text the indexes and searches embed).
+
+  * "onnx" (fp32 graph): cosine > 0.999 to torch on every row.
+  * "onnx-int8" (dynamic quantization): cosine > 0.99 on every row, and
+    each query's nearest corpus row is the same one torch picks.
+
+Needs torch, transformers and onnxruntime (the first run exports the graph
+into cache/embed_onnx/); skips with a note when they aren't installed.
+
+Always run, with `torch` made unimportable: `_embed_with` over an
+_OnnxEncoder (on a stand-in session and tokenizer) returns unit-norm
+numpy rows in input order, and with the graph already exported (and
+transformers + onnxruntime installed) load_backend("onnx") loads too.
+
+    python scripts/test_embed_onnx_parity.py
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "_embed_model", os.path.join(_HERE, "core", "_embed_model.py"))
+_em = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_em)
+
+_failures = []
+
+TAGS = [
+    "1girl", "long hair", "looking at viewer", "smile", "blue eyes",
+    "school uniform", "pleated skirt", "thighhighs", "outdoors", "cherry blossoms",
+    "from above", "dutch angle", "holding sword", "victory pose", "fighting stance",
+]
+WIKI = [
+    "A character extending one arm forward with the index and middle fingers raised.",
+    "The subject is viewed from a position higher than their head, looking down at them.",
+    "Trees of the genus Prunus in bloom, usually pink or white, common in spring scenes.",
+    "A skirt with a series of folds around the waist, often part of a school uniform.",
+    "Long stockings that end above the knee; distinct from pantyhose and kneehighs.",
+    "An unarmed combat posture with the knees bent and the fists raised to guard the face.",
+]
+QUERIES = [
+    "girl doing a peace sign",
+    "camera looking down at her",
+    "pink flowers on trees in spring",
+    "ready to fight with fists up",
+    "samurai holding a katana",
+]
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _vectors(loaded, texts):
+    return _em._as_numpy(_em._embed_with(loaded, texts, batch_size=8))
+
+
+class _Input:
+    def __init__(self, name):
+        self.name = name
+
+
+class _Session:
+    """Stand-in onnxruntime session: the CLS row is a function of the ids."""
+
+    def get_inputs(self):
+        return [_Input(n) for n in ("input_ids", "attention_mask", "token_type_ids")]
+
+    def run(self, _outputs, feed):
+        ids = feed["input_ids"]
+        return [np.stack([_cls_row(row) for row in ids]).astype(np.float32)]
+
+
+def _cls_row(ids):
+    ids = [i for i in ids if i]
+    return np.cos(np.arange(_em.EMBED_DIM) * (sum(ids) % 97 + 1)) * len(ids)
+
+
+class _Tokenizer:
+    """Stand-in tokenizer: one id per word, 0-padded."""
+
+    def __call__(self, texts, truncation=True, max_length=None):
+        ids = [[len(w) + 1 for w in t.split()][:max_length] for t in texts]
+        return {"input_ids": ids, "attention_mask": [[1] * len(r) for r in ids],
+                "token_type_ids": [[0] * len(r) for r in ids]}
+
+    def pad(self, enc, padding=True, return_tensors=None):
+        assert return_tensors == "np", return_tensors
+        width = max(len(r) for r in enc["input_ids"])
+        return {k: np.array([r + [0] * (width - len(r)) for r in rows], dtype=np.int64)
+                for k, rows in enc.items()}
+
+
+def _check_without_torch():
+    saved = sys.modules.get("torch")
+    sys.modules["torch"] = None             # `import torch` now raises ImportError
+    try:
+        texts = TAGS + WIKI + QUERIES
+        encoder = _em._OnnxEncoder(_Session(), "onnx")
+        got = _em._embed_with((encoder, _Tokenizer(), "cpu"), texts, batch_size=4)
+        want = np.stack([_cls_row([len(w) + 1 for w in t.split()]) for t in texts])
+        want /= np.linalg.norm(want, axis=1, keepdims=True)
+        check("without torch: ONNX _embed_with returns float32 numpy",
+              isinstance(got, np.ndarray) and got.dtype == np.float32
+              and got.shape == (len(texts), _em.EMBED_DIM))
+        check("without torch: rows unit-norm, in input order",
+              np.allclose(got, want, atol=1e-5))
+        check("without torch: _as_numpy passes ONNX output through",
+              np.array_equal(_em._as_numpy(got), got))
+        ready = (_em._onnx_path("onnx").exists()
+                 and all(importlib.util.find_spec(m) for m in ("transformers", "onnxruntime")))
+        if ready:
+            loaded = _em.load_backend("onnx")
+            check("without torch: load_backend('onnx') loads the exported graph",
+                  isinstance(loaded[0], _em._OnnxEncoder))
+        else:
+            print("  (load_backend without torch not checked: needs transformers, "
+                  "onnxruntime and an exported graph)")
+    finally:
+        if saved is None:
+            del sys.modules["torch"]
+        else:
+            sys.modules["torch"] = saved
+
+
+def main() -> int:
+    _check_without_torch()
+
+    missing = [m for m in ("torch", "transformers", "onnxruntime")
+               if importlib.util.find_spec(m) is None]
+    if missing:
+        print(f"\nparity skipped: {', '.join(missing)} not installed "
+              "(needs torch, transformers and onnxruntime)")
+        print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+        return 1 if _failures else 0
+
+    corpus = TAGS + WIKI
+    texts = corpus + QUERIES
+    ref_loaded = _em.load_backend("torch")
+    ref = _vectors(ref_loaded, texts)
+    ref_top = (ref[len(corpus):] @ ref[:len(corpus)].T).argmax(axis=1)
+
+    for name, floor in (("onnx", 0.999), ("onnx-int8", 0.99)):
+        loaded = _em.load_backend(name)
+        if not isinstance(loaded[0], _em._OnnxEncoder):
+            check(f"{name}: backend loaded (fell back to torch — see log)", False)
+            continue
+        got = _vectors(loaded, texts)
+        cos = (got * ref).sum(axis=1)
+        print(f"\n  {name}: cosine to torch min {cos.min():.5f}, mean {cos.mean():.5f}")
+        check(f"{name}: unit-norm rows", np.allclose(np.linalg.norm(got, axis=1), 1.0, atol=1e-4))
+        check(f"{name}: cosine > {floor} on every row", bool(cos.min() > floor))
+        top = (got[len(corpus):] @ got[:len(corpus)].T).argmax(axis=1)
+        check(f"{name}: every query's nearest row matches torch", np.array_equal(top, ref_top))
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""Tests for the query-embedding LRU in core/_embed_model.py.
+
+The encoder is swapped for a deterministic numpy stand-in (a unit vector
+seeded by the text), so this checks the cache itself: repeats skip the
+model, only misses are embedded (once per distinct text), results equal
+the uncached embed, the byte cap evicts least-recently-used entries, and
+the stats add up. numpy only; torch-free.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "_embed_model", os.path.join(_HERE, "core", "_embed_model.py"))
+_em = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_em)
+
+_failures = []
+_calls: list[list[str]] = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _fake_embed(texts, batch_size=32, **_):
+    _calls.append(list(texts))
+    out = np.empty((len(texts), _em.EMBED_DIM), dtype=np.float32)
+    for i, t in enumerate(texts):
+        seed = int.from_bytes(hashlib.blake2b(t.encode(), digest_size=8).digest(), "little")
+        v = np.random.default_rng(seed).standard_normal(_em.EMBED_DIM)
+        out[i] = v / np.linalg.norm(v)
+    return out
+
+
+def main() -> int:
+    _em.get = lambda: ("model", "tokenizer", "cpu")
+    _em.embed = _fake_embed
+
+    names = ["victory pose", "fighting stance", "spinning bird kick"]
+    first = _em.embed_cached(names + ["doing her victory pose"])
+    check("first call embeds every text once, in one batch",
+          len(_calls) == 1 and len(_calls[0]) == 4)
+    check("result equals the uncached embed",
+          first.dtype == np.float32 and first.shape == (4, 384)
+          and np.array_equal(first, _fake_embed(names + ["doing her victory pose"])))
+    _calls.clear()
+
+    again = _em.embed_cached(names + ["a different query"])
+    check("repeat names skip the model; only the new query is embedded",
+          _calls == [["a different query"]])
+    check("cached rows identical to the first call", np.array_equal(again[:3], first[:3]))
+
+    _calls.clear()
+    dup = _em.embed_cached(["new text", "new text", "victory pose"])
+    check("duplicate misses in one call embedded once",
+          _calls == [["new text"]] and np.array_equal(dup[0], dup[1]))
+    dup[0, :] = 0
+    check("callers can't corrupt the cache through the result",
+          np.array_equal(_em.embed_cached(["new text"])[0], _fake_embed(["new text"])[0]))
+
+    stats = _em.query_cache_stats()
+    check(f"stats count hits and misses (hit rate {stats['hit_rate']})",
+          stats["misses"] == 6 and stats["hits"] == 5 and stats["entries"] == 6
+          and stats["bytes"] > 6 * 384 * 4)
+    check("empty input", _em.embed_cached([]).shape == (0, 384))
+
+    _em.clear_query_cache()
+    entry = 384 * 4 + len("q000") + _em._ENTRY_OVERHEAD
+    _em.QUERY_CACHE_MAX_BYTES = entry * 10
+    for i in range(10):
+        _em.embed_cached([f"q{i:03d}"])
+    _em.embed_cached(["q000"])              # refresh: q001 is now the oldest
+    _em.embed_cached(["q010"])
+    stats = _em.query_cache_stats()
+    check("byte cap holds the entry count", stats["entries"] == 10
+          and stats["evictions"] == 1 and stats["bytes"] <= _em.QUERY_CACHE_MAX_BYTES)
+    _calls.clear()
+    _em.embed_cached(["q000"])
+    kept = not _calls
+    _em.embed_cached(["q001"])
+    check("least recently used evicted first", kept and _calls == [["q001"]])
+
+    _em.QUERY_CACHE_MAX_BYTES = 0
+    _calls.clear()
+    _em.embed_cached(["q002"])
+    _em.embed_cached(["q002"])
+    check("cap 0 disables the cache", len(_calls) == 2)
+
+    _em.get = lambda: None
+    check("model not loaded: None", _em.embed_cached(["x"]) is None)
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""Tests for the Aho-Corasick alias matcher (core/phrase_matcher.py).
+
+The reference is the per-alias regex the alias scans used before,
+`(?<![A-Za-z0-9_])alias(?![A-Za-z0-9_])` (tag / style) and
+`(?<!\\w)alias(?!\\w)` with IGNORECASE (modifiers): on the seed aliases
+plus overlapping / nested / duplicate phrases, and on random texts built
+from them, the matcher must find exactly the aliases the regexes find, at
+the same first offsets. Also leftmost-longest selection, case folding,
+and VersionedBuild's rebuild-on-version-change. Pure Python.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+import random
+import re
+import sys
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "phrase_matcher", os.path.join(_HERE, "core", "phrase_matcher.py"))
+_pm = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_pm)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _seed_aliases() -> list[str]:
+    out = []
+    for name in ("tag-aliases-seed.json", "style-aliases-seed.json"):
+        with open(os.path.join(_HERE, "data", "tag-builder", name), encoding="utf-8") as f:
+            for aliases in json.load(f).values():
+                if isinstance(aliases, list):
+                    out.extend(a.strip().lower() for a in aliases if a and a.strip())
+    return out
+
+
+def _regex_first(phrases, text, unicode_bounds):
+    """{phrase id: first start} the old per-alias regex loop would find."""
+    found = {}
+    for pid, p in enumerate(phrases):
+        if unicode_bounds:
+            m = re.search(r"(?<!\w)" + re.escape(p) + r"(?!\w)", text, re.IGNORECASE)
+        else:
+            m = re.search(r"(?<![A-Za-z0-9_])" + re.escape(p) + r"(?![A-Za-z0-9_])", text)
+        if m:
+            found[pid] = m.start()
+    return found
+
+
+def _matcher_first(matcher, text):
+    found = {}
+    for hit in matcher.scan(text):
+        found.setdefault(hit.phrase_id, hit.start)
+    return found
+
+
+def main() -> int:
+    extra = ["close up", "close-up of feet", "feet", "up", "anime", "anime version",
+             "on her knees", "knees", "her knees", "a", "aa", "aaa", "x-ray", "feet"]
+    phrases = _seed_aliases() + extra
+    rng = random.Random(7)
+    fillers = ["the", "her", "enclosed", "anime_style", "animes", "feet!", "up,", "x",
+               "Close", "UP", "-", "(", ")", "aaaa", "on", "knees.", "été", "2"]
+    texts = ["make it anime", "enclosed up there", "close-up of feet please",
+             "she is on her knees", "aaaa aaa", "ANIME Version of cammy", "", "x-ray vision"]
+    for _ in range(400):
+        words = [rng.choice(phrases) if rng.random() < 0.4 else rng.choice(fillers)
+                 for _ in range(rng.randint(1, 14))]
+        texts.append(rng.choice([" ", "  ", ", "]).join(words))
+
+    ascii_m = _pm.PhraseMatcher(phrases)
+    uni_m = _pm.PhraseMatcher(phrases, word_char=_pm.unicode_word_char)
+    ok_ascii = all(_matcher_first(ascii_m, t.lower()) == _regex_first(phrases, t.lower(), False)
+                   for t in texts)
+    ok_uni = all(_matcher_first(uni_m, t) == _regex_first(phrases, t, True) for t in texts)
+    check(f"same aliases and first offsets as the ascii-boundary regexes "
+          f"({len(phrases)} phrases, {len(texts)} texts)", ok_ascii)
+    check("same as the \\w / IGNORECASE regexes", ok_uni)
+
+    m = _pm.PhraseMatcher(["close up", "close-up of feet", "feet", "up"])
+    hits = m.scan("a close-up of feet, close up")
+    check("scan: every occurrence with offsets, overlaps included",
+          [(h.start, h.end, m.phrases[h.phrase_id]) for h in hits]
+          == [(2, 18, "close-up of feet"), (8, 10, "up"), (14, 18, "feet"),
+              (20, 28, "close up"), (26, 28, "up")])
+    check("longest: leftmost-longest, non-overlapping",
+          [m.phrases[h.phrase_id] for h in m.longest("a close-up of feet, close up")]
+          == ["close-up of feet", "close up"])
+    check("word boundaries: no hit inside a word",
+          m.scan("feetless closeup upward") == [])
+    check("case-folded, offsets into the original text",
+          [(h.start, h.end) for h in m.scan("Close Up")] == [(0, 8), (6, 8)])
+    dup = _pm.PhraseMatcher(["barefoot", "barefoot", ""])
+    check("duplicate phrases each hit; empty phrases never do",
+          [h.phrase_id for h in dup.scan("barefoot")] == [0, 1])
+    check("empty matcher / empty text", _pm.PhraseMatcher([]).scan("x") == [] and m.scan("") == [])
+
+    version = [1]
+    builds = []
+    vb = _pm.VersionedBuild(lambda: version[0], lambda: builds.append(1) or len(builds))
+    first = vb.get()
+    vb.get()
+    check("VersionedBuild: built once per version", first == 1 and len(builds) == 1)
+    version[0] = 2
+    check("VersionedBuild: rebuilt when the version moves", vb.get() == 2 and vb.builds == 2)
+    vb.invalidate()
+    check("VersionedBuild: invalidate forces a rebuild", vb.get() == 3)
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -14,7 +14,10 @@ from __future__ import annotations
 
 import importlib.util
 import os
+import random
+import shutil
 import sys
+import tempfile
 
 _HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 _spec = importlib.util.spec_from_file_location(
@@ -95,6 +98,106 @@ def main() -> int:
     check("comment-scaffold global is the real global",
           obj["global"] == "a grassy field")
 
+    # ── compile_prompt_regions: one call for the flat + regional outputs ─────
+    same = True
+    for _ in range(40):
+        pos, neg, _m, reg = _c.compile_prompt_regions(
+            "a {red|blue|green} {cat|dog}\nNegative Prompt: {ugly|bad}")
+        same = same and reg == {"global": pos, "regions": [], "negative": neg}
+    check("no $blocks: global IS the flat compile (same wildcard picks)", same)
+    # with $blocks: one pass, cut at the region markers — every output shows
+    # the same picks, and draw-free prompts match the per-piece compiles
+    text = "// $x{ nope }\na {cat|dog} $m1{ red {hat|cap} } $m2{\n{tall|short}\nman } park"
+    same = True
+    for seed in range(40):
+        pos, _n, _m, reg = _c.compile_prompt_regions(text, rng=_c.make_rng(seed))
+        hat, man = (r["text"] for r in reg["regions"])
+        animal = reg["global"].split()[1]
+        same = same and pos == f"a {animal} {hat}, {man.split()[0]}, man park" \
+            and hat in ("red hat", "red cap") and man in ("tall man", "short man")
+    check("with $blocks: flat, global and regions show the same picks", same)
+    fixed = [
+        "a cat $m1{ red hat } in a park",
+        "// $x{ nope }\na cat $m1{ red {hat} } $m2{\n{tall}\nman } park",
+        "masterpiece\n$m1{\nred dress\nlong hair\n}\n$m2{ blue suit, blue suit }\n"
+        "forest, forest\nNegative Prompt: ugly, blurry",
+        "a$m1{x}b",
+        "$m1{ a {b|} c }, scene BREAK $m2{ d } BREAK e",
+        "x $m1{ y Negative Prompt: z } w\nNegative Prompt: bad",
+        "$m1{ } $m2{\n\n} only global",
+        "$m1{ unclosed body",
+        "tags, $m1{ one, two }, three\n\n\n$hero{x}",
+    ]
+    check("with $blocks, no draws: same outputs as compile_prompt + compile_regions",
+          all(_c.compile_prompt_regions(t) == _c.compile_prompt(t) + (_c.compile_regions(t),)
+              for t in fixed))
+    check("nested $name{} inside a body: flat keeps only the body, like the region",
+          _c.compile_prompt_regions("$m1{ $inner{ a } } x")[0] == "a x")
+    # ::Label:: lines, <SCRIPT> and a region inside {a|b} take the per-piece path
+    fallback = ["::A:: $m1{ red } x\n::B:: $m1{ blue } y",
+                "<SCRIPT>a {PROMPT} b</SCRIPT>\n$m1{ hat } c",
+                "a {b\n$m1{c}\n} d", "{a $m1{ b } |c} d"]
+    same = True
+    for t in fallback:
+        for seed in range(10):
+            random.seed(seed)
+            got = _c.compile_prompt_regions(t)
+            random.seed(seed)
+            same = same and got == _c.compile_prompt(t) + (_c.compile_regions(t),)
+    check("labels / script / region inside a wildcard: per-piece results", same)
+    # The flat and global prompts join text across a region's edge: a
+    # __name__ reference or a bare a|b part running into one reads differently
+    # there than in the region, so these take the per-piece path too — with
+    # the draws the marked-up pass made rewound.
+    tmp = tempfile.mkdtemp(prefix="pc_wc_")
+    for name, body in (("hair", "long hair\nshort hair\n"), ("eyes", "blue eyes\n"),
+                       ("eyes__x", "ex\n")):
+        with open(os.path.join(tmp, name + ".txt"), "w", encoding="utf-8") as f:
+            f.write(body)
+    folder, _c.WILDCARDS_FOLDER = _c.WILDCARDS_FOLDER, tmp
+    _c.invalidate_wildcard_index()
+    try:
+        edges = ["__hair__$face{__eyes__} park", "$face{__eyes__}__hair__",
+                 "__eyes__$m1{x__} y", "{a|b} __hair__$m1{c}__eyes__",
+                 "x, a|b$m1{c|d}, e", "$m1{a|b\nc} d, {e|f}"]
+        same = True
+        for t in edges:
+            for seed in range(10):
+                random.seed(seed)
+                got = _c.compile_prompt_regions(t)
+                random.seed(seed)
+                same = same and got == _c.compile_prompt(t) + (_c.compile_regions(t),)
+        check("__name__ / bare a|b against a region edge: per-piece results", same)
+        pos, _n, meta, reg = _c.compile_prompt_regions("__hair__$face{__eyes__} park")
+        check("flat keeps the baseline read of __hair____eyes__",
+              pos == "__hair____eyes__ park"
+              and meta == {"unresolved_wildcards": ["hair____eyes"]}
+              and reg["regions"][0]["text"] == "blue eyes")
+    finally:
+        _c.WILDCARDS_FOLDER = folder
+        _c.invalidate_wildcard_index()
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    originals = {name: getattr(_c, name) for name in ("compile_prompt", "expand_wildcard_files")}
+    calls = dict.fromkeys(originals, 0)
+
+    def counting(name):
+        def wrapper(*args, **kwargs):
+            calls[name] += 1
+            return originals[name](*args, **kwargs)
+        return wrapper
+
+    for name in originals:
+        setattr(_c, name, counting(name))
+    try:
+        _c.compile_prompt_regions("a {cat|dog} " + " ".join(
+            f"$m{i}{{ {{red|blue}} hat }}" for i in range(1, 9)) + " park")
+    finally:
+        for name, fn in originals.items():
+            setattr(_c, name, fn)
+    check(f"8 regions: one compile pass ({calls})",
+          calls == {"compile_prompt": 0, "expand_wildcard_files": 1})
+
     # ── non-object pose JSON guard (the LOW fix) ─────────────────────────────
     for payload in ("42", "[]", "null", '"x"', "3.14"):
         try:
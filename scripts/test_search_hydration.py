@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""Tests for pooled read-only connections and batched hit hydration
+(core/db_generation.py: ReadConnections, rows_by_key), as used by
+tag_search.alias_scan.
+
+On a tag-builder-shaped DB (20k wiki rows), hydrating a search's hits the
+old way (connect + one query + close per hit) and the new way (one reused
+read-only connection, one IN query per 500 hits) must give the same rows;
+per-search wall time is printed for top_k 30 and a large top_k. Also
+checks connection reuse per thread, visibility of later commits, reopen
+after the file is replaced, and that the pool can't write.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "db_generation", os.path.join(_HERE, "core", "db_generation.py"))
+_dg = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_dg)
+
+ROWS = 20_000
+# tag_search._rows_for_tags
+HYDRATE_SQL = ("SELECT t.tag, t.body_full, t.body_summary, d.ranking "
+               "FROM danbooru_tag_wikis t "
+               "LEFT JOIN danbooru_tags d ON d.tag = t.tag "
+               "WHERE t.tag IN ({})")
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _make_db(path: Path, rows: int = ROWS) -> None:
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+    CREATE TABLE danbooru_tag_wikis (tag TEXT PRIMARY KEY, body_full TEXT, body_summary TEXT);
+    CREATE TABLE danbooru_tags (tag TEXT PRIMARY KEY, ranking INTEGER);
+    """)
+    conn.executemany("INSERT INTO danbooru_tag_wikis VALUES (?, ?, ?)",
+                     [(f"tag_{i}", f"wiki body for tag {i} " * 12, f"summary {i}")
+                      for i in range(rows)])
+    conn.executemany("INSERT INTO danbooru_tags VALUES (?, ?)",
+                     [(f"tag_{i}", rows - i) for i in range(0, rows, 2)])
+    conn.commit()
+    conn.close()
+
+
+def _as_dict(r) -> dict:
+    return {"tag": r["tag"], "body_full": r["body_full"] or "",
+            "body_summary": r["body_summary"] or "", "ranking": int(r["ranking"] or 0)}
+
+
+def _hydrate_per_hit(path: Path, tags: list[str]) -> list[dict | None]:
+    """The old tag_search._row_for_tag, once per hit."""
+    out = []
+    for tag in tags:
+        conn = sqlite3.connect(str(path))
+        conn.row_factory = sqlite3.Row
+        conn.text_factory = lambda b: b.decode("utf-8", "replace")
+        r = conn.execute(HYDRATE_SQL.format("?"), (tag,)).fetchone()
+        conn.close()
+        out.append(_as_dict(r) if r else None)
+    return out
+
+
+def _hydrate_batched(reads, tags: list[str]) -> list[dict | None]:
+    rows: dict[str, dict] = {}
+    for r in _dg.rows_by_key(reads.get(), HYDRATE_SQL, tags):
+        rows.setdefault(r["tag"], _as_dict(r))
+    return [rows.get(t) for t in tags]
+
+
+def _best_ms(fn, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1000
+
+
+def main() -> int:
+    with tempfile.TemporaryDirectory() as tmp:
+        d = Path(tmp)
+        path = d / "tag-builder.db"
+        _make_db(path)
+        reads = _dg.ReadConnections(path)
+
+        print(f"\n  per-search hydration, {ROWS:,} wiki rows:")
+        for top_k in (30, 150, 1200):
+            tags = [f"tag_{(i * 7919) % ROWS}" for i in range(top_k - 1)] + ["no_such_tag"]
+            same = _hydrate_per_hit(path, tags) == _hydrate_batched(reads, tags)
+            before = _best_ms(lambda: _hydrate_per_hit(path, tags))
+            after = _best_ms(lambda: _hydrate_batched(reads, tags))
+            print(f"    top_k {top_k:>5}: connection per hit {before:8.2f} ms, "
+                  f"pooled + IN {after:7.2f} ms ({before / after:.0f}x)")
+            check(f"top_k {top_k}: same rows, misses included", same)
+            if top_k == 150:
+                check("top_k 150: pooled + IN at least 5x faster", after * 5 < before)
+        print()
+
+        check("one connection reused across searches", reads.opens == 1)
+        other = []
+        t = threading.Thread(target=lambda: other.append(reads.get()))
+        t.start()
+        t.join()
+        check("each thread gets its own connection",
+              other[0] is not reads.get() and reads.opens == 2)
+
+        w = sqlite3.connect(path)
+        w.execute("INSERT INTO danbooru_tag_wikis VALUES ('late_tag', 'b', 's')")
+        w.commit()
+        w.close()
+        check("later commits visible on the reused connection",
+              _hydrate_batched(reads, ["late_tag"])[0] is not None and reads.opens == 2)
+        try:
+            reads.get().execute("DELETE FROM danbooru_tag_wikis")
+            wrote = True
+        except sqlite3.OperationalError:
+            wrote = False
+        check("pooled connection is read-only", not wrote)
+
+        _make_db(d / "replacement.db", rows=10)
+        os.replace(d / "replacement.db", path)
+        check("replaced file: reopened, reads the new rows",
+              _hydrate_batched(reads, ["tag_5", "tag_15"]) == [
+                  {"tag": "tag_5", "body_full": "wiki body for tag 5 " * 12,
+                   "body_summary": "summary 5", "ranking": 0}, None]
+              and reads.opens == 3)
+
+        conn = reads.get()
+        keys = [f"tag_{i % 7}" for i in range(1300)]
+        check("rows_by_key: de-duplicated keys, chunked past the parameter cap",
+              len(_dg.rows_by_key(conn, HYDRATE_SQL, keys)) == 7
+              and _dg.rows_by_key(conn, HYDRATE_SQL, []) == [])
+        _make_db(d / "big.db", rows=1200)
+        big = sqlite3.connect(d / "big.db")
+        check("rows_by_key: 1200 distinct keys -> 1200 rows",
+              len(_dg.rows_by_key(big, HYDRATE_SQL, [f"tag_{i}" for i in range(1200)])) == 1200)
+        big.close()
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
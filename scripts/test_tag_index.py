@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Differential test for the TagStore autocomplete index (core/tag_index.py).
+
+Loads the bundled data/tags CSVs the way TagStore._load_source does and checks
+that TagSearchIndex returns exactly what the old linear scan + sort returned —
+same tags, same order — across short, long, multi-word, underscore/space and
+no-match queries, at several limits. Also checks that the normalized name map
+(get_similar / lookup_many) finds the same tag the old exact-match scan did.
+torch-free; run anywhere.
+"""
+
+from __future__ import annotations
+
+import csv
+import importlib.util
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "tag_index", os.path.join(_HERE, "core", "tag_index.py"))
+_ti = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_ti)
+
+MIN_RANKING_THRESHOLD = 100  # mirrors core/tags.py
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def load_tags(path):
+    """Row parsing of TagStore._load_source (the fields search reads)."""
+    tags = []
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for row in csv.DictReader(f):
+            try:
+                tag = row.get("TAG", "").strip()
+                if not tag:
+                    continue
+                tags.append({"id": int(row.get("ID", 0)), "tag": tag,
+                             "ranking": int(row.get("RANKING", 0) or 0),
+                             "_search": tag.lower()})
+            except (ValueError, KeyError):
+                continue
+    tags.sort(key=lambda x: -x["ranking"])
+    return tags
+
+
+def legacy_search(tags, query, limit):
+    """The pre-index TagStore.search body (reference)."""
+    query_lower = query.lower().replace(" ", "_")
+    query_stripped = query_lower.rstrip("_")
+    query_words = [w for w in query_stripped.replace("_", " ").split() if w]
+    matches = []
+    for tag in tags:
+        ranking = tag["ranking"]
+        if ranking > 0 and MIN_RANKING_THRESHOLD > 0 and ranking < MIN_RANKING_THRESHOLD:
+            continue
+        sk = tag["_search"]
+        contiguous = query_lower in sk or query_stripped in sk
+        multi = False
+        if not contiguous and len(query_words) > 1:
+            multi = all(w in sk for w in query_words)
+        if not contiguous and not multi:
+            continue
+        sort_key = (0, -ranking, "") if ranking > 0 else (1, 0, sk)
+        matches.append((sort_key, tag))
+    matches.sort(key=lambda x: x[0])
+    return [m[1]["id"] for m in matches[:limit]]
+
+
+def index_search(index, query, limit):
+    query_lower = query.lower().replace(" ", "_")
+    query_stripped = query_lower.rstrip("_")
+    query_words = [w for w in query_stripped.replace("_", " ").split() if w]
+    return [t["id"] for t in index.search(query_lower, query_stripped, query_words, limit)]
+
+
+QUERIES = ["a", "h", "ha", "hai", "hair", "long hair", "long_hair", "long_hair_",
+           "hair long", "blue eyes", "eyes blue", "Blue Eyes", "smil", "_", " ",
+           "__", "xx", "zzzqqq", "fox", "red fox", "fox red tail", "tail fox",
+           "1girl", "(", ":3", "o_o", "pony", "my little", "a b", "big bre",
+           "solo_focus", "anthro", "t", "é", "x_x", "hat", "the", "of the"]
+
+
+def main() -> int:
+    tags_dir = os.path.join(_HERE, "data", "tags")
+    for fname in sorted(os.listdir(tags_dir)):
+        if not fname.endswith(".csv"):
+            continue
+        tags = load_tags(os.path.join(tags_dir, fname))
+        index = _ti.TagSearchIndex(tags, MIN_RANKING_THRESHOLD)
+        bad = [(q, lim) for q in QUERIES for lim in (1, 20, 40, 100)
+               if index_search(index, q, lim) != legacy_search(tags, q, lim)]
+        check(f"{fname}: {len(QUERIES)} queries x 4 limits identical to linear scan"
+              + (f" (first mismatch: {bad[0]!r})" if bad else ""), not bad)
+
+        # old get_similar: first tag (rank order) with _search == needle. Keys
+        # with spaces or stray underscores were unreachable by that scan (the
+        # needle had spaces folded to "_"), so only the reachable ones compare.
+        by_name = _ti.build_name_map(tags)
+        first: dict[str, dict] = {}
+        for t in tags:
+            first.setdefault(t["_search"], t)
+        bad = [k for k, t in first.items() if by_name.get(_ti.normalize_tag_name(k)) is not t
+               and " " not in k and "__" not in k and k == k.strip("_")]
+        check(f"{fname}: name map resolves every tag the exact scan did"
+              + (f" (first mismatch: {bad[0]!r})" if bad else ""), not bad)
+
+    norm = _ti.normalize_tag_name
+    check("normalize folds case, spaces and underscores",
+          norm("Long Hair") == norm(" long__hair ") == norm("LONG_HAIR") == "long_hair")
+    check("normalize of blank is empty", norm("  _ ") == "")
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Tests for the tag CSV sync's stat cache and background sync (core/tags.py).
+
+In a temp ComfyUI user dir with a temp system tags dir:
+
+  * files whose (size, mtime_ns) match the manifest's file_stats are not
+    re-hashed; a changed size or mtime is, and a changed system file is
+    copied over an untouched user file;
+  * with tag_sync_background, TagStore loads the user CSVs first and the
+    background sync then reloads only the source it rewrote;
+  * concurrent syncs, restores and reloads never expose a half-written
+    manifest, and leave one whose file_stats agree with the files on disk.
+
+Needs aiohttp (core/config.py imports core/api_utils.py); exits 0 with a
+note when it isn't installed. The ComfyUI `folder_paths` host module is
+provided the way the scripts/natlang_* harnesses do.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import types
+from pathlib import Path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def _csv(path: Path, tags: list[str]):
+    rows = ["ID,TAG,CATEGORY,RANKING,SIMILAR"]
+    rows += [f"{i},{t},general,{1000 - i}," for i, t in enumerate(tags)]
+    path.write_text("\n".join(rows) + "\n", encoding="utf-8")
+
+
+def main() -> int:
+    if importlib.util.find_spec("aiohttp") is None:
+        print("skipped: aiohttp not installed (core/config.py imports it)")
+        return 0
+
+    tmp = Path(tempfile.mkdtemp())
+    user_root, system = tmp / "user", tmp / "system"
+    system.mkdir()
+    sys.modules.setdefault("folder_paths", types.SimpleNamespace(
+        get_user_directory=lambda: str(user_root)))
+    from core import config, tags  # noqa: E402
+
+    tags._system_tags_dir = lambda: system
+    user_dir = user_root / "PromptChain" / "tags"
+    for name in ("a", "b", "c"):
+        _csv(system / f"{name}.csv", [f"{name}_tag_{i}" for i in range(50)])
+
+    hashed: list[str] = []
+    hash_file = tags._hash_file
+    tags._hash_file = lambda p: (hashed.append(Path(p).name), hash_file(p))[1]
+
+    def sync():
+        hashed.clear()
+        return tags._sync_tag_files()
+
+    states, copied = sync()
+    check("first boot copies every system file",
+          copied == {"a.csv", "b.csv", "c.csv"} and set(states.values()) == {"default"})
+    config.set_onboarded()
+
+    states, copied = sync()
+    check("unchanged files are not re-hashed", hashed == [] and copied == set())
+
+    _csv(system / "a.csv", [f"a_tag_{i}" for i in range(60)])     # size change
+    states, copied = sync()
+    check("changed system size: re-hashed and copied over the untouched user file",
+          hashed == ["a.csv"] and copied == {"a.csv"} and states["a.csv"] == "default"
+          and (user_dir / "a.csv").read_bytes() == (system / "a.csv").read_bytes())
+
+    st = (user_dir / "b.csv").stat()
+    os.utime(user_dir / "b.csv", ns=(st.st_atime_ns, st.st_mtime_ns + 5_000_000_000))
+    states, copied = sync()
+    check("changed user mtime alone: re-hashed, same digest, nothing copied",
+          hashed == ["b.csv"] and copied == set() and states["b.csv"] == "default")
+
+    _csv(user_dir / "c.csv", ["user_edit"])
+    states, copied = sync()
+    check("user edit: re-hashed, kept as modified",
+          hashed == ["c.csv"] and copied == set() and states["c.csv"] == "modified")
+    states, copied = sync()
+    check("second pass after the edits hashes nothing", hashed == [])
+
+    cfg = config.load()
+    cfg["tag_sync_background"] = True
+    config.save(cfg)
+    _csv(system / "b.csv", ["b_new_0", "b_new_1"])
+    store = tags.TagStore()
+    store.load_all()
+    loaded_first = store.sources["b"]["count"]
+    deadline = time.monotonic() + 10
+    while store.sources["b"]["count"] == loaded_first and time.monotonic() < deadline:
+        time.sleep(0.02)
+    check("background sync: loads the stale file first, then reloads it",
+          loaded_first == 50 and store.sources["b"]["count"] == 2)
+    check("background sync: sources it didn't rewrite are left alone",
+          store.sources["c"]["count"] == 1 and store.sources["a"]["count"] == 60)
+
+    errors: list[BaseException] = []
+
+    def hammer(fn):
+        try:
+            for _ in range(15):
+                fn()
+        except BaseException as e:    # noqa: BLE001 — reported below
+            errors.append(e)
+
+    torn: list[int] = []
+    done = threading.Event()
+
+    def read_manifest():
+        while not done.is_set():
+            if "system_hashes" not in tags._load_manifest():
+                torn.append(1)
+
+    tags._hash_file = hash_file
+    reader = threading.Thread(target=read_manifest)
+    reader.start()
+    workers = ([threading.Thread(target=hammer, args=(tags._sync_tag_files,)) for _ in range(3)]
+               + [threading.Thread(target=hammer, args=(lambda: tags.restore_file("c.csv"),))]
+               + [threading.Thread(target=hammer, args=(store.reload,))]
+               + [threading.Thread(target=hammer, args=(store._background_sync,))])
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    done.set()
+    reader.join()
+    manifest = json.loads((user_root / "PromptChain" / tags._MANIFEST_FILE).read_text("utf-8"))
+    stats = manifest.get("file_stats", {})
+    fresh = {}
+    for d in (system, user_dir):
+        for f in d.glob("*.csv"):
+            st = f.stat()
+            fresh[str(f)] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns,
+                             "digest": hash_file(f)}
+    check("concurrent sync / restore / reload: no errors", not errors)
+    check(f"concurrent readers never see a half-written manifest ({len(torn)} torn)", not torn)
+    check("concurrent sync / restore / reload: file_stats match the files on disk",
+          stats == fresh)
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
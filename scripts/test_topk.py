@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Differential test for the shared top-k selection (core/topk.py).
+
+Checks that top_k returns exactly what the old "score everything, stable
+sort on -score, slice, stop at the threshold" loop returned — same rows,
+same order, ties included — across sizes, k values, thresholds and masks.
+numpy only; torch-free.
+"""
+
+from __future__ import annotations
+
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+_HERE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_spec = importlib.util.spec_from_file_location(
+    "topk", os.path.join(_HERE, "core", "topk.py"))
+_tk = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(_tk)
+
+_failures = []
+
+
+def check(name, cond):
+    print(f"  {'PASS' if cond else 'FAIL'}  {name}")
+    if not cond:
+        _failures.append(name)
+
+
+def legacy_top_k(scores, k, threshold=None, mask=None):
+    """The pre-top_k loop: tolist, stable sort on -score, slice, break."""
+    paired = [(i, s) for i, s in enumerate(np.asarray(scores, dtype=np.float32).tolist())
+              if mask is None or mask[i]]
+    paired.sort(key=lambda x: -x[1])
+    out = []
+    for i, s in paired[:k]:
+        if threshold is not None and s < threshold:
+            break
+        out.append((i, s))
+    return out
+
+
+def main() -> int:
+    rng = np.random.default_rng(7)
+    for n in (1, 5, 100, 14_000):
+        scores = rng.uniform(-1, 1, n).astype(np.float32)
+        bad = [(k, t) for k in (1, 2, 12, 30, 150, n, n + 5) for t in (None, 0.0, 0.55)
+               if _tk.top_k(scores, k, t) != legacy_top_k(scores, k, t)]
+        check(f"n={n}: matches stable sort for every k/threshold", not bad)
+
+    # heavy ties: quantized scores, including ties straddling the k-th slot
+    tied = rng.integers(0, 4, 5000).astype(np.float32) / 4
+    bad = [k for k in (1, 3, 10, 1249, 1250, 1251, 4999)
+           if _tk.top_k(tied, k) != legacy_top_k(tied, k)]
+    check("ties resolved by lower row index, boundary included", not bad)
+
+    mask = rng.random(14_000) < 0.1
+    scores = rng.uniform(-1, 1, 14_000).astype(np.float32)
+    check("mask keeps only masked-in rows",
+          _tk.top_k(scores, 50, mask=mask) == legacy_top_k(scores, 50, mask=mask))
+    few = np.zeros(100, dtype=bool)
+    few[[3, 70]] = True
+    check("mask with fewer rows than k returns just those",
+          [i for i, _ in _tk.top_k(scores[:100], 10, mask=few)]
+          == [i for i, _ in legacy_top_k(scores[:100], 10, mask=few)])
+    check("k <= 0 and empty input", _tk.top_k(scores, 0) == []
+          and _tk.top_k(np.zeros(0, dtype=np.float32), 3) == [])
+    check("scores come back as Python floats",
+          all(type(s) is float and type(i) is int for i, s in _tk.top_k(scores, 5)))
+
+    print(f"\n{'ALL PASS' if not _failures else str(len(_failures)) + ' FAILURE(S)'}")
+    return 1 if _failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())